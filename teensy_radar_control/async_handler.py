@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 16:05:33 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+"""
+import logging
+import asyncio
+import collections
+import time
+
+import serial
+from cobs import cobs
+
+from teensy_radar_control import message, transport
+from teensy_radar_control.packet import PacketFramer, LatencyStats, LinkStats, decode_frames, \
+    MSG_START_PATTERN
+
+class AsyncSerialPacketHandler(object):
+    # asyncio flavour of SerialPacketHandler.  Everything runs on the event
+    # loop of the caller: the serial port is registered with add_reader(),
+    # the bytes are framed with a PacketFramer as they arrive, and decoded
+    # packets wait in an asyncio.Queue.  There is no child process and no
+    # thread, so one loop can drive several radars.
+    #
+    # The loop must support add_reader() (any loop on POSIX, the selector
+    # loop on Windows), and the port must have a file descriptor: serial,
+    # tcp:// or udp://, not replay://.
+    #
+    # Inside a coroutine asyncio.get_event_loop() is the running loop, it
+    # is used instead of get_running_loop() to keep working on Python 3.6.
+    #
+    def __init__(self, port, max_data_size=message.MSG_MAX_DATA_SIZE, read_queue_size=1000):
+        self.logger = logging.getLogger(type(self).__name__)
+
+        self.port = port
+        self.max_frame_len = message.max_encoded_size(max_data_size)
+        self.max_buf_len = max(6000, 2*self.max_frame_len)
+
+        self.read_queue = asyncio.Queue(maxsize=read_queue_size)
+        self._link_stats = LinkStats()
+
+        self._serial_port = None
+        self._loop = None
+        self._framer = None
+        self._write_buf = bytearray()
+        self._closed = None
+
+    async def open(self):
+        self._loop = asyncio.get_event_loop()
+        self._closed = self._loop.create_future()
+
+        # timeout=0 makes read() and write() non blocking
+        self._serial_port = transport.open_transport(self.port, baudrate=2000000, timeout=0, write_timeout=0)
+        if not transport.pollable(self._serial_port):
+            self._serial_port.close()
+            self._serial_port = None
+            raise ValueError('%s can not be used with asyncio' % (self.port,))
+        self._serial_port.reset_input_buffer()
+        self._serial_port.reset_output_buffer()
+        self._framer = PacketFramer(max_buf_len=self.max_buf_len, packet_sep=b'\x00',
+                                    max_frame_len=self.max_frame_len,
+                                    start_pattern=MSG_START_PATTERN)
+
+        self._loop.add_reader(self._serial_port.fileno(), self._on_readable)
+        self.logger.debug('Serial port open')
+        return self
+
+    async def close(self):
+        self._close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def is_alive(self):
+        return self._serial_port is not None
+
+    def stats(self):
+        # Link counters, with rates since the previous call
+        return self._link_stats.snapshot()
+
+    async def wait_closed(self):
+        # Resolves when the port is closed, by close() or by an error
+        await asyncio.shield(self._closed)
+
+    async def read_packet(self):
+        # Returns None once the port is closed and every packet was read
+        if self.read_queue.empty() and not self.is_alive():
+            return None
+        packet = await self.read_queue.get()
+        return packet
+
+    def read_packets(self, max_n=None):
+        # Every packet already waiting, without awaiting
+        packets = []
+        while max_n is None or len(packets) < max_n:
+            try:
+                packet = self.read_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if packet is None:
+                # Keep the end marker for messages()
+                self._put_end()
+                break
+            packets.append(packet)
+        return packets
+
+    async def messages(self):
+        # async for packet in handler.messages(), ends when the port closes
+        while True:
+            packet = await self.read_packet()
+            if packet is None:
+                return
+            yield packet
+
+    def write_packet(self, packet):
+        # Queue a packet for writing.  Returns without waiting, the bytes
+        # that do not fit in the OS buffer go out when the port is writable.
+        if self._serial_port is None:
+            raise ValueError('Write to closed port')
+        pending = len(self._write_buf) > 0
+        self._write_buf.extend(cobs.encode(packet) + b'\x00')
+        if not pending:
+            self._on_writable()
+
+    def _on_readable(self):
+        try:
+            read_bytes = self._serial_port.read(self._framer.free_space())
+        except serial.SerialException as e:
+            self.logger.debug('Serial port error in read, closing')
+            self.logger.debug(str(e))
+            self._close()
+            return
+        self._framer.feed(read_bytes)
+        self._link_stats.add(LinkStats.BYTES_RECEIVED, len(read_bytes))
+        self._link_stats.add(LinkStats.LOOP_ITERATIONS)
+
+        packets, errors = decode_frames(self._framer, self._link_stats)
+        for e in errors:
+            self.logger.debug('COBS decode error, continuing')
+            self.logger.debug(str(e))
+        for packet in packets:
+            try:
+                self.read_queue.put_nowait(packet)
+            except asyncio.QueueFull:
+                # Nobody is reading, drop the packet
+                self._link_stats.add(LinkStats.QUEUE_FULL_DROPS)
+
+    def _on_writable(self):
+        try:
+            size = self._serial_port.write(self._write_buf)
+        except serial.SerialException as e:
+            self.logger.debug('Serial port error in write, closing')
+            self.logger.debug(str(e))
+            self._close()
+            return
+        del self._write_buf[0:size]
+
+        fd = self._serial_port.fileno()
+        if len(self._write_buf) > 0:
+            self._loop.add_writer(fd, self._on_writable)
+        else:
+            self._loop.remove_writer(fd)
+
+    def _close(self):
+        if self._serial_port is None:
+            return
+        fd = self._serial_port.fileno()
+        self._loop.remove_reader(fd)
+        self._loop.remove_writer(fd)
+        try:
+            self._serial_port.close()
+        except serial.SerialException:
+            self.logger.debug('Serial port close failed')
+        self._serial_port = None
+        self._write_buf.clear()
+        self._put_end()
+        if not self._closed.done():
+            self._closed.set_result(None)
+        self.logger.debug('Serial port closed')
+
+    def _put_end(self):
+        # Wake up any reader with the end marker
+        try:
+            self.read_queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+
+class AsyncRadarHandler(object):
+    # asyncio flavour of BasicRadarHandler.  The cmd_* methods are
+    # coroutines that resolve with the msg_reply to the command, or None
+    # after reply_timeout seconds.
+    #
+    # The firmware answers every command in order, so replies are matched
+    # to commands first in first out.  Several commands may be outstanding.
+    # A command that timed out keeps its place in line for late_reply_window
+    # seconds so a late reply does not get matched to the next command.
+    #
+    def __init__(self, reply_timeout=0.1, late_reply_window=1.0, **sph_kwargs):
+        self.logger = logging.getLogger(type(self).__name__)
+
+        # Extra AsyncSerialPacketHandler options used on every connect
+        self.sph_kwargs = sph_kwargs
+        self.reply_timeout = reply_timeout
+        self.late_reply_window = late_reply_window
+
+        self.log_queue = None
+        self.pulse_queue = None
+
+        self.sph = None
+        self._task = None
+        self._pending_replies = collections.deque()
+
+        # Heartbeat tracking
+        self.heartbeat_clock = None
+        self.heartbeat_msg = None
+
+        # Command to reply round trip
+        self.command_latency = LatencyStats()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def connect(self, port):
+        self.logger.debug('Connect called')
+        if self.is_alive():
+            self.logger.debug('Radar Already running')
+            return
+
+        # Make sure everything is shutdown first
+        await self.disconnect()
+
+        self.heartbeat_clock = None
+        self.heartbeat_msg = None
+        self.log_queue = asyncio.Queue(maxsize=1000)
+        self.pulse_queue = asyncio.Queue(maxsize=1000)
+
+        try:
+            self.sph = await AsyncSerialPacketHandler(port, **self.sph_kwargs).open()
+        except Exception as e:
+            self.logger.debug('RadarHandler: error starting AsyncSerialPacketHandler, aborting.')
+            self.logger.debug(str(e))
+            self.sph = None
+            return
+
+        self._task = asyncio.get_event_loop().create_task(self._dispatch_task())
+        self.logger.debug('Connect done')
+
+    async def disconnect(self):
+        self.logger.debug('Disconnect called')
+        if self.sph is not None:
+            await self.sph.close()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        self.sph = None
+
+        # Nothing will answer the outstanding commands
+        while self._pending_replies:
+            cmd, fut, cmd_clock = self._pending_replies.popleft()
+            if not fut.done():
+                fut.set_result(None)
+        self.logger.debug('Disconnect done')
+
+    def time_since_heartbeat(self):
+        if self.heartbeat_clock is None:
+            return None
+        return time.perf_counter() - self.heartbeat_clock
+
+    def is_alive(self):
+        sph_alive = self.sph is not None and self.sph.is_alive()
+        task_alive = self._task is not None and not self._task.done()
+        watchdog = False
+        dt = self.time_since_heartbeat()
+        if dt is None or dt < 10.0:
+            watchdog = True
+        return sph_alive and task_alive and watchdog
+
+    async def cmd_version(self):
+        return await self._send_command(b'V')
+
+    async def cmd_start(self, pulse_length, gain, fstart, fstop, freturn):
+        cmd = b'S %3d %3d %8.3f %8.3f %8.3f \x00' % \
+            (pulse_length, gain, fstart, fstop, freturn)
+        return await self._send_command(cmd)
+
+    async def cmd_stop(self):
+        return await self._send_command(b'X')
+
+    async def cmd_trigger_on(self):
+        return await self._send_command(b'A')
+
+    async def cmd_trigger_off(self):
+        return await self._send_command(b'L')
+
+    def latency_stats(self):
+        return {'round_trip':self.command_latency.snapshot()}
+
+    async def get_pulse(self):
+        return await self.pulse_queue.get()
+
+    async def get_log_msg(self):
+        return await self.log_queue.get()
+
+    async def pulses(self):
+        # async for pulse in radar.pulses()
+        while True:
+            yield await self.pulse_queue.get()
+
+    async def log_msgs(self):
+        while True:
+            yield await self.log_queue.get()
+
+    async def _send_command(self, cmd):
+        if not self.is_alive():
+            return None
+
+        fut = asyncio.get_event_loop().create_future()
+        cmd_clock = time.perf_counter()
+        try:
+            self.sph.write_packet(cmd)
+        except Exception as e:
+            self._put_log(message.msg_log(0,0,'COMMAND: Write failed.  Continuing'))
+            return None
+        self._pending_replies.append((cmd, fut, cmd_clock))
+        self._put_log(message.msg_log(0,0,'COMMAND: "%s"' % (cmd,)))
+
+        try:
+            # The future is cancelled on timeout
+            reply = await asyncio.wait_for(fut, self.reply_timeout)
+        except asyncio.TimeoutError:
+            self._put_log(message.msg_log(0,0,'COMMAND: "%s" never got a reply' % (cmd,)))
+            reply = None
+        return reply
+
+    async def _dispatch_task(self):
+        async for msg in self.sph.messages():
+            # Try to parse message
+            try:
+                parsed_msg = message.parse_message(msg)
+            except Exception as e:
+                self.logger.debug('RadarHandler: parse_message() error, continuing.')
+                self.logger.debug(str(e))
+                continue
+            self._dispatch_message(parsed_msg)
+        self.logger.debug('RadarHandler: port closed')
+
+    def _dispatch_message(self, parsed_msg):
+        if isinstance(parsed_msg, message.msg_heartbeat):
+            self.logger.debug(str(parsed_msg))
+            self.heartbeat_clock = time.perf_counter()
+            self.heartbeat_msg = parsed_msg
+        elif isinstance(parsed_msg, message.msg_log):
+            self._put_log(parsed_msg)
+        elif isinstance(parsed_msg, message.msg_reply):
+            self._resolve_reply(parsed_msg)
+            # Send the reply to the log too
+            self._put_log(parsed_msg)
+        elif isinstance(parsed_msg, message.msg_pulse):
+            try:
+                self.pulse_queue.put_nowait(parsed_msg)
+            except asyncio.QueueFull:
+                self.logger.debug('pulse_queue full, dropping pulse')
+        else:
+            err = 'Unexpected packed type.  Ignoring: "%s"' % (str(parsed_msg),)
+            self._put_log(message.msg_log(message.LOG_ERROR,0,err))
+            self.logger.debug(err)
+
+    def _resolve_reply(self, reply):
+        # Give up on timed out commands that are too old to still answer
+        now = time.perf_counter()
+        while self._pending_replies:
+            cmd, fut, cmd_clock = self._pending_replies[0]
+            if not fut.done() or now - cmd_clock < self.late_reply_window:
+                break
+            self._pending_replies.popleft()
+
+        if not self._pending_replies:
+            self.logger.debug('Reply without a command: %s' % (str(reply),))
+            return
+        cmd, fut, cmd_clock = self._pending_replies.popleft()
+        if fut.done():
+            self.logger.debug('Late reply to "%s": %s' % (cmd, str(reply)))
+            return
+        self.command_latency.add(time.perf_counter() - cmd_clock)
+        fut.set_result(reply)
+
+    def _put_log(self, log_msg):
+        if self.log_queue is None:
+            # Not connected yet
+            self.logger.debug('No log_queue, dropping log message')
+            return
+        try:
+            self.log_queue.put_nowait(log_msg)
+        except asyncio.QueueFull:
+            self.logger.debug('log_queue full, dropping log message')
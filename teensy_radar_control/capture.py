@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 21:14:05 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Wire capture files.  The undecoded bytes read from the radar, one record
+per read:
+
+    file header:  unique_word, version, start wall clock  ('IId')
+    record:       seconds since start, size               ('dI')
+                  size bytes
+"""
+import logging
+import struct, time
+import threading
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_UNIQUE_WORD = 0xC1C2C3C4
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct('IId')
+CAPTURE_RECORD = struct.Struct('dI')
+
+class CaptureWriter(object):
+    # Appends timestamped chunks to a capture file from a write behind
+    # thread.  write() only copies the chunk into a buffer, the thread
+    # swaps buffers and does the file writes.  If the disk can not keep
+    # up and max_pending bytes are waiting, chunks are dropped and counted
+    # rather than holding up the caller.
+    #
+    def __init__(self, path, buffer_size=1<<20, max_pending=64<<20, flush_interval=0.5):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+
+        self.drop_count = 0
+        self.bytes_written = 0
+
+        self._fh = open(path, 'wb', buffering=0)
+        self._start_clock = time.perf_counter()
+        self._fh.write(CAPTURE_HEADER.pack(CAPTURE_UNIQUE_WORD, CAPTURE_VERSION, time.time()))
+
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+        self._keep_running = True
+        self._th = threading.Thread(target=self._writer_thread,args=(),name='CaptureWriter')
+        self._th.daemon = True
+        self._th.start()
+
+    def write(self, data, clock=None):
+        # clock is a time.perf_counter() value, default now
+        if clock is None:
+            clock = time.perf_counter()
+        with self._cond:
+            if len(self._buf) + len(data) > self.max_pending:
+                self.drop_count = self.drop_count + 1
+                return
+            self._buf.extend(CAPTURE_RECORD.pack(clock - self._start_clock, len(data)))
+            self._buf.extend(data)
+            if len(self._buf) >= self.buffer_size:
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._keep_running = False
+            self._cond.notify()
+        self._th.join()
+        self._fh.close()
+
+    def _writer_thread(self):
+        keep_running = True
+        while keep_running:
+            with self._cond:
+                if self._keep_running and len(self._buf) < self.buffer_size:
+                    self._cond.wait(self.flush_interval)
+                buf = self._buf
+                self._buf = bytearray()
+                keep_running = self._keep_running
+            if len(buf) > 0:
+                try:
+                    self._fh.write(buf)
+                    self.bytes_written = self.bytes_written + len(buf)
+                except OSError as e:
+                    logger.warning('Capture write failed, stopping capture: %s' % (e,))
+                    return
+
+
+def is_capture(fh):
+    # True if the open file starts with a capture header.  Leaves the
+    # file positioned after the header if so, at the start otherwise.
+    header = fh.read(CAPTURE_HEADER.size)
+    if len(header) == CAPTURE_HEADER.size:
+        unique_word, version, start_time = CAPTURE_HEADER.unpack(header)
+        if unique_word == CAPTURE_UNIQUE_WORD:
+            if version != CAPTURE_VERSION:
+                raise ValueError('Unsupported capture version %d' % (version,))
+            return True
+    fh.seek(0)
+    return False
+
+def read_record(fh):
+    # Returns (seconds since start, chunk), or None at the end of the file
+    record = fh.read(CAPTURE_RECORD.size)
+    if len(record) < CAPTURE_RECORD.size:
+        return None
+    clock, size = CAPTURE_RECORD.unpack(record)
+    data = fh.read(size)
+    if len(data) < size:
+        return None
+    return clock, data
+
+def read_capture(path):
+    # Yields (seconds since start, chunk) for every record
+    with open(path, 'rb') as fh:
+        if not is_capture(fh):
+            raise ValueError('%s is not a capture file' % (path,))
+        while True:
+            record = read_record(fh)
+            if record is None:
+                return
+            yield record
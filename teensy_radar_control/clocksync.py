@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 04:51:37 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Radar clock to host clock (time.perf_counter()) models.  The radar has
+two clocks off the same crystal: the heartbeat time_stamp, milliseconds
+since boot, and pulse_cycle_count, CPU cycles since the last start.  Each
+is fitted with a line, host = offset + rate*device, from the times
+messages were read.  A message is always read some time after the radar
+stamped it, so the line is fitted to the lower envelope of the points,
+the messages that were delayed least.  rate is the drift between the two
+clocks.
+"""
+import collections
+import threading
+
+import numpy as np
+
+from teensy_radar_control import message
+
+# Both device counters are uint32
+COUNTER_MODULUS = 1 << 32
+
+class ClockFit(object):
+    # host = offset + rate*device over the last window seconds of device
+    # time.  The window is split in max_points buckets and each keeps its
+    # least delayed point.  The rate is the least squares slope of the
+    # bucket points in the lowest quarter of the residuals, the offset
+    # puts the line through the lowest point.  The line is refitted when
+    # a bucket fills, the offset follows a new lowest point at once.
+    #
+    def __init__(self, window=60.0, max_points=256):
+        self.window = window
+        self.max_points = max_points
+        self.bucket = window/max_points
+        self.reset()
+
+    def reset(self):
+        self._points = collections.deque(maxlen=self.max_points)
+        self._bucket_start = None
+        self.rate = 1.0
+        self.offset = None
+        self.spread = None
+
+    def ready(self):
+        return self.offset is not None
+
+    def add(self, device, host):
+        if self._bucket_start is not None and device - self._bucket_start < self.bucket:
+            # Same bucket, keep the least delayed point
+            last_device, last_host = self._points[-1]
+            if host - device < last_host - last_device:
+                self._points[-1] = (device, host)
+            if host - self.rate*device < self.offset:
+                self.offset = host - self.rate*device
+            return
+
+        self._points.append((device, host))
+        self._bucket_start = device
+        while device - self._points[0][0] > self.window:
+            self._points.popleft()
+        self._fit()
+
+    def to_host(self, device):
+        return self.offset + self.rate*np.asarray(device)
+
+    def _fit(self):
+        points = np.array(self._points)
+        device = points[:,0] - points[0,0]
+        host = points[:,1]
+        if len(points) >= 2 and device[-1] > 0.0:
+            rate, offset = np.polyfit(device, host, 1)
+            residual = host - (offset + rate*device)
+            low = residual <= np.percentile(residual, 25.0)
+            if np.count_nonzero(low) >= 2 and np.ptp(device[low]) > 0.0:
+                rate, offset = np.polyfit(device[low], host[low], 1)
+            self.rate = float(rate)
+        else:
+            self.rate = 1.0
+        residual = host - self.rate*device
+        self.offset = float(residual.min()) - self.rate*points[0,0]
+        # How far above the line the bucket points sit
+        self.spread = float(np.std(residual))
+
+
+class ClockSync(object):
+    # Host clocks for radar messages.  update_pulses() takes the
+    # pulse_cycle_count values of a batch of pulses with the host clock
+    # they were read at, and returns the host clock of each pulse's
+    # acquisition.  heartbeat() does the same for the heartbeat clock.
+    #
+    # The cycle counter starts over when the radar starts streaming, call
+    # reset_pulses() on cmd_start().  A batch that does not fit the model
+    # (acquired after it was read, or more than max_delay before) also
+    # starts the pulse fit over.
+    #
+    # The read clocks must be no earlier than the radar sent the messages.
+    # SerialPacketHandler.last_batch_clock is when the child read the
+    # batch, with batch_latency > 0 later messages of the batch can arrive
+    # after it and pull the fit up to batch_latency early.
+    #
+    def __init__(self, cpu_clock_hz=message.CPU_CLOCK_HZ, window=60.0, max_delay=1.0):
+        self.cpu_clock_hz = cpu_clock_hz
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._pulse_fit = ClockFit(window=window)
+        self._heartbeat_fit = ClockFit(window=10*window)
+        self.pulse_resets = 0
+        self._last_cycles = None
+        self._cycles_u = 0
+        self._last_time_stamp = None
+        self._time_stamp_u = 0
+
+    def reset_pulses(self):
+        with self._lock:
+            self._pulse_fit.reset()
+            self._last_cycles = None
+
+    def update_pulses(self, cycle_counts, host_clock):
+        # Returns the acquisition host clocks, None if host_clock is None
+        cycles = np.asarray(cycle_counts, dtype=np.int64)
+        if host_clock is None or len(cycles) == 0:
+            return None
+        with self._lock:
+            if self._last_cycles is None:
+                self._last_cycles = int(cycles[0])
+                self._cycles_u = int(cycles[0])
+            unwrapped = self._unwrap(cycles, self._last_cycles, self._cycles_u)
+            device = unwrapped/self.cpu_clock_hz
+            if self._pulse_fit.ready():
+                delay = host_clock - self._pulse_fit.to_host(device[-1])
+                if delay < -self.max_delay or delay > self.max_delay:
+                    # The counter started over
+                    self.pulse_resets = self.pulse_resets + 1
+                    self._pulse_fit.reset()
+                    unwrapped = self._unwrap(cycles, int(cycles[0]), int(cycles[0]))
+                    device = unwrapped/self.cpu_clock_hz
+            self._last_cycles = int(cycles[-1])
+            self._cycles_u = int(unwrapped[-1])
+
+            # The last pulse of the batch waited least for the read
+            self._pulse_fit.add(float(device.max()), host_clock)
+            return self._pulse_fit.to_host(device)
+
+    def heartbeat(self, time_stamp, host_clock):
+        # Returns the host clock the heartbeat was sent at
+        if host_clock is None:
+            return None
+        with self._lock:
+            if self._last_time_stamp is None:
+                self._time_stamp_u = time_stamp
+            else:
+                step = (time_stamp - self._last_time_stamp) % COUNTER_MODULUS
+                if step >= COUNTER_MODULUS >> 1:
+                    # Radar rebooted
+                    self._heartbeat_fit.reset()
+                    self._time_stamp_u = time_stamp
+                else:
+                    self._time_stamp_u = self._time_stamp_u + step
+            self._last_time_stamp = time_stamp
+            device = self._time_stamp_u/1000.0
+            self._heartbeat_fit.add(device, host_clock)
+            return float(self._heartbeat_fit.to_host(device))
+
+    def report(self):
+        # Drift in parts per million of the radar clock against the host,
+        # and the spread of the read delays the fit sees, per clock
+        with self._lock:
+            report = {'pulse_resets': self.pulse_resets}
+            for name, fit in (('pulse', self._pulse_fit), ('heartbeat', self._heartbeat_fit)):
+                report[name + '_points'] = len(fit._points)
+                report[name + '_drift_ppm'] = None
+                report[name + '_spread'] = None
+                if fit.ready():
+                    report[name + '_drift_ppm'] = (fit.rate - 1.0)*1e6
+                    report[name + '_spread'] = fit.spread
+        return report
+
+    def _unwrap(self, cycles, last_cycles, last_u):
+        prev = np.empty(len(cycles), dtype=np.int64)
+        prev[0] = last_cycles
+        prev[1:] = cycles[:-1]
+        step = (cycles - prev) % COUNTER_MODULUS
+        step[step >= COUNTER_MODULUS >> 1] -= COUNTER_MODULUS
+        return last_u + np.cumsum(step)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 13:40:51 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+"""
+import numpy as np
+
+# COBS frames are delimited by a zero byte
+COBS_SEP = 0
+
+def decode_max_size(encoded_size):
+    # Decoding never grows a frame
+    return encoded_size
+
+def decode_frames(buf, out=None):
+    # Decode every complete 0x00 delimited COBS frame in buf in one pass.
+    #
+    # Decoded payloads are packed back to back into out (a writable buffer
+    # at least len(buf) bytes long, allocated if None).  Returns
+    #   consumed:  bytes of buf used, up to and including the last delimiter
+    #   offsets:   start of each payload in out
+    #   sizes:     length of each payload
+    #   ok:        False for frames that failed to decode.  These have size 0
+    #              and do not stop the rest of the batch.
+    # Empty frames (back to back delimiters) are skipped.
+    #
+    # The results are byte identical to cobs.cobs.decode() on each frame.
+    #
+    enc = np.frombuffer(buf, dtype=np.uint8)
+    if out is None:
+        out = bytearray(decode_max_size(len(enc)))
+    dec = np.frombuffer(out, dtype=np.uint8)
+    if len(dec) < decode_max_size(len(enc)):
+        raise ValueError('Output buffer too small')
+
+    empty = np.zeros((0,), dtype=np.intp)
+    seps = np.flatnonzero(enc == COBS_SEP)
+    if len(seps) == 0:
+        return 0, empty, empty, np.zeros((0,), dtype=bool)
+    consumed = int(seps[-1]) + 1
+    enc = enc[0:consumed]
+
+    # Frame boundaries, without the empty frames
+    starts = np.empty_like(seps)
+    starts[0] = 0
+    starts[1:] = seps[:-1] + 1
+    stops = seps
+    keep = stops > starts
+    starts = starts[keep]
+    stops = stops[keep]
+    nframes = len(starts)
+
+    # Follow the chain of code bytes in every frame at the same time.  Each
+    # step takes one code byte from every frame that is not finished yet, so
+    # the number of steps is the block count of the longest frame.
+    #
+    # A code byte is dropped from the output if it starts the frame or
+    # follows a 0xFF code, otherwise it decodes to a 0x00.
+    code_pos = [empty]
+    zero_pos = [empty]
+    ok = np.ones(nframes, dtype=bool)
+    frame = np.arange(nframes)
+    pos = starts
+    stop = stops
+    after_ff = np.ones(nframes, dtype=bool)
+    while len(pos) > 0:
+        code = enc[pos]
+        code_pos.append(pos)
+        zero_pos.append(pos[~after_ff])
+        pos = pos + code
+        more = pos < stop
+        # A code that runs past the end of its frame is a decode error
+        ok[frame[pos > stop]] = False
+        pos = pos[more]
+        stop = stop[more]
+        frame = frame[more]
+        after_ff = code[more] == 0xFF
+    is_code = np.zeros(consumed, dtype=bool)
+    is_code[np.concatenate(code_pos)] = True
+    is_zero = np.zeros(consumed, dtype=bool)
+    is_zero[np.concatenate(zero_pos)] = True
+
+    # Data bytes plus code bytes that became zeros, minus the delimiters
+    out_mask = (~is_code & (enc != COBS_SEP)) | is_zero
+    if not np.all(ok):
+        bad = np.zeros(consumed+1, dtype=np.intp)
+        np.add.at(bad, starts[~ok], 1)
+        np.add.at(bad, stops[~ok], -1)
+        out_mask &= np.cumsum(bad[0:consumed]) == 0
+
+    payload = enc[out_mask]
+    payload[is_zero[out_mask]] = 0
+    dec[0:len(payload)] = payload
+
+    total = np.zeros(consumed+1, dtype=np.intp)
+    np.cumsum(out_mask, out=total[1:])
+    offsets = total[starts]
+    sizes = total[stops] - offsets
+
+    return consumed, offsets, sizes, ok
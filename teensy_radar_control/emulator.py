@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 18:20:44 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Radar emulator on a Linux pseudo terminal.  Speaks the firmware protocol
+so the host software can be run and load tested without a Teensy.
+
+    python -m teensy_radar_control.emulator --pulse-rate 2000
+"""
+import logging
+import os, sys, time, struct, select, tty
+import threading
+import multiprocessing as mp
+import argparse
+
+import numpy as np
+from cobs import cobs
+
+from teensy_radar_control import message
+from teensy_radar_control.packet import PacketFramer
+
+# Firmware version string returned by 'V'
+EMULATOR_VERSION = '1.1.0'
+
+# pulse_length_ms -> data_size, from the firmware timing parameters
+# (50 kHz sampling).  35 ms has no working timing parameters.
+PULSE_DATA_SIZES = {5:250, 10:500, 15:750, 20:1000, 25:1250, 30:1500, 40:2000}
+
+# Teensy 3.6 CPU clock, drives pulse_cycle_count
+CPU_CLOCK_HZ = message.CPU_CLOCK_HZ
+
+# Firmware radar states
+RSTATE_COMMAND = 1
+RSTATE_STREAMING = 2
+
+class RadarEmulator(object):
+    # Emulated radar on the master side of a pty.  Open self.port (the
+    # slave side) like the serial port of a real radar.
+    #
+    # Pulses are produced every pulse_length_ms like the firmware, or at
+    # pulse_rate pulses per second if given.  data_size overrides the size
+    # given by the pulse length.  link_rate limits the bytes per second
+    # written, to emulate the USB link.  When the host or the link can not
+    # keep up for more than max_lag seconds, pulses are dropped and logged
+    # the way the firmware does.
+    #
+    # The emulator runs in a thread, or with use_process in a forked
+    # process so it does not share the GIL with the host software under
+    # test.
+    #
+    # With packed12 pulses carry 12 bit samples as MSG_TYPE_PULSE12.
+    #
+    PULSES_SENT = 0
+    PULSES_DROPPED = 1
+    BYTES_SENT = 2
+    COMMANDS_RECEIVED = 3
+    COUNTER_NAMES = ('pulses_sent', 'pulses_dropped', 'bytes_sent', 'commands_received')
+
+    def __init__(self, pulse_rate=None, data_size=None, link_rate=None,
+                 heartbeat_period=2.0, cpu_clock_hz=CPU_CLOCK_HZ, seed=None,
+                 max_lag=0.01, use_process=False, packed12=False):
+        if os.name != 'posix':
+            raise RuntimeError('RadarEmulator needs a POSIX pty')
+        self.logger = logging.getLogger(type(self).__name__)
+
+        self.pulse_rate = pulse_rate
+        self.data_size = data_size
+        self.link_rate = link_rate
+        self.heartbeat_period = heartbeat_period
+        self.cpu_clock_hz = cpu_clock_hz
+        self.max_lag = max_lag
+        self.packed12 = packed12
+
+        self._rng = np.random.default_rng(seed)
+        self._framer = PacketFramer(max_buf_len=4096)
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+
+        # Radar state
+        self.radar_state = RSTATE_COMMAND
+        self.transmit_trigger = False
+        self.pulse_length_ms = 0
+        self.gain = 0
+        self.freq_start = 0.0
+        self.freq_stop = 0.0
+        self.freq_return = 0.0
+        self._pulse_period = None
+        self._pulse_clock = None
+        self._pulse_number = 0
+        self._pulse_data = None
+
+        # Counters, shared with the process if there is one
+        self.use_process = use_process
+        self._counters = mp.Array('d',[0.0]*len(self.COUNTER_NAMES),lock=False)
+
+        self._keep_running = mp.Value('i',0)
+        self._th = None
+
+    @property
+    def pulses_sent(self):
+        return int(self._counters[self.PULSES_SENT])
+
+    @property
+    def pulses_dropped(self):
+        return int(self._counters[self.PULSES_DROPPED])
+
+    @property
+    def bytes_sent(self):
+        return int(self._counters[self.BYTES_SENT])
+
+    @property
+    def commands_received(self):
+        return int(self._counters[self.COMMANDS_RECEIVED])
+
+    def start(self):
+        self._keep_running.value = 1
+        if self.use_process:
+            # The pty file descriptors are inherited through fork
+            self._th = mp.get_context('fork').Process(target=self._run_loop,args=(),name='RadarEmulator')
+        else:
+            self._th = threading.Thread(target=self._run_loop,args=(),name='RadarEmulator')
+        self._th.daemon = True
+        self._th.start()
+        return self
+
+    def join(self):
+        self._keep_running.value = 0
+        if self._th is not None:
+            self._th.join()
+            self._th = None
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.join()
+
+    def stats(self):
+        return dict((name, int(self._counters[ii])) for ii, name in enumerate(self.COUNTER_NAMES))
+
+    def _count(self, index, count):
+        self._counters[index] = self._counters[index] + count
+
+    def _run_loop(self):
+        self._start_clock = time.perf_counter()
+        self._heartbeat_clock = self._start_clock
+        self._link_clock = self._start_clock
+
+        while self._keep_running.value != 0:
+            timeout = max(self._next_event() - time.perf_counter(), 0.0)
+            ready, _, _ = select.select([self._master], [], [], min(timeout, 0.1))
+            if ready:
+                self._read_commands()
+
+            ct = time.perf_counter()
+            if ct - self._heartbeat_clock >= self.heartbeat_period:
+                self._heartbeat_clock = self._heartbeat_clock + self.heartbeat_period
+                time_stamp = int((ct - self._start_clock)*1000.0) & 0xFFFFFFFF
+                self._send(message.MSG_TYPE_HEARTBEAT, struct.pack('I', time_stamp))
+
+            if self.radar_state == RSTATE_STREAMING:
+                self._stream_pulse(ct)
+
+    def _next_event(self):
+        next_clock = self._heartbeat_clock + self.heartbeat_period
+        if self.radar_state == RSTATE_STREAMING and self._pulse_period is not None:
+            next_clock = min(next_clock, self._pulse_clock + (self._pulse_number+1)*self._pulse_period)
+        return next_clock
+
+    def _read_commands(self):
+        try:
+            data = os.read(self._master, self._framer.free_space())
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            # EIO while nothing has the slave open
+            time.sleep(0.01)
+            return
+        self._framer.feed(data)
+        for frame in self._framer.frames():
+            try:
+                cmd = cobs.decode(frame)
+            except cobs.DecodeError:
+                continue
+            self._on_command(cmd)
+
+    def _on_command(self, cmd):
+        # Same replies as on_packet_received() in the firmware
+        self._count(self.COMMANDS_RECEIVED, 1)
+        # LOG_DEBUG
+        self._send_log(0, 1, 'RECEIVED A COMMAND')
+
+        code = cmd[0:1]
+        if code == b'A':
+            self.transmit_trigger = True
+            self._send_reply(0, 'TRIGGER ON')
+        elif code == b'L':
+            self.transmit_trigger = False
+            self._send_reply(0, 'TRIGGER OFF')
+        elif self.radar_state == RSTATE_STREAMING:
+            if code == b'X':
+                self.radar_state = RSTATE_COMMAND
+                self._send_reply(0, 'STOPPING')
+            else:
+                self._send_reply(-1, 'COMMAND NOT VALID')
+        elif code == b'V':
+            self._send_reply(0, 'LLRISE RADAR VERSION ' + EMULATOR_VERSION)
+        elif code == b'S':
+            self._configure(cmd)
+            self.radar_state = RSTATE_STREAMING
+            self._send_reply(0, 'STREAMING')
+        elif code == b'X':
+            self._send_reply(0, 'STOPPED')
+        else:
+            self._send_reply(-1, 'COMMAND NOT VALID')
+
+    def _configure(self, cmd):
+        # "S %hu %hu %f %f %f", fields that do not parse are left as they were
+        fields = cmd.rstrip(b'\x00').split()[1:6]
+        values = [self.pulse_length_ms, self.gain, self.freq_start, self.freq_stop, self.freq_return]
+        for ii, field in enumerate(fields):
+            try:
+                values[ii] = int(field) if ii < 2 else float(field)
+            except ValueError:
+                break
+        self.pulse_length_ms, self.gain, self.freq_start, self.freq_stop, self.freq_return = values
+
+        data_size = self.data_size
+        if data_size is None:
+            data_size = PULSE_DATA_SIZES.get(self.pulse_length_ms, 0)
+        pulse_rate = self.pulse_rate
+        if pulse_rate is None and self.pulse_length_ms > 0:
+            pulse_rate = 1000.0/self.pulse_length_ms
+
+        if data_size == 0 or not pulse_rate:
+            self._send_log(message.LOG_ERROR, 1, 'NO TIMING PARAMETERS FOR PULSE LENGTH %d' % (self.pulse_length_ms,))
+            self._pulse_period = None
+        else:
+            self._pulse_period = 1.0/pulse_rate
+        self._pulse_data = self._make_pulse_data(max(data_size,1))
+
+        # configure() resets the cycle counter, pulse numbers start over
+        self._pulse_clock = time.perf_counter()
+        self._pulse_number = 0
+
+    def _make_pulse_data(self, data_size, count=16):
+        # A few pulses of beat tones plus noise around mid scale, reused
+        # round robin so high pulse rates cost little
+        t = np.arange(data_size)/float(data_size)
+        pulses = []
+        for ii in range(0,count):
+            beat = 2000.0*np.sin(2*np.pi*(20.0 + ii)*t) + 800.0*np.sin(2*np.pi*113.0*t + ii)
+            noise = self._rng.normal(0.0, 200.0, size=data_size)
+            data = np.clip(32768.0 + beat + noise, 0, 65535).astype('<u2')
+            if self.packed12:
+                # What a 12 bit ADC gives
+                pulses.append((data_size, message.pack12(data >> 4)))
+            else:
+                pulses.append((data_size, data.tobytes()))
+        return pulses
+
+    def _stream_pulse(self, ct):
+        if self._pulse_period is None:
+            return
+        pulse_number = int((ct - self._pulse_clock)/self._pulse_period)
+        if pulse_number <= self._pulse_number:
+            return
+
+        # Pulses less than max_lag late are still sent, the Teensy would not
+        # lose them to the OS scheduling of this thread.  Older ones are
+        # dropped and logged like the firmware does.
+        first = self._pulse_number + 1
+        oldest = pulse_number - int(self.max_lag/self._pulse_period)
+        if oldest > first:
+            self._count(self.PULSES_DROPPED, oldest - first)
+            self._send_log(message.LOG_ERROR, 1, 'Teensy pulse sequence error. Dropped %d pulses before %d' %
+                           (oldest - self._pulse_number, oldest))
+            first = oldest
+
+        for number in range(first, pulse_number+1):
+            data_size, data = self._pulse_data[number % len(self._pulse_data)]
+            cycle_count = int(number*self._pulse_period*self.cpu_clock_hz) & 0xFFFFFFFF
+            header = struct.pack('HHIIIHHfff', 32, data_size, number, cycle_count,
+                                 1 if self.transmit_trigger else 0, self.gain,
+                                 self.pulse_length_ms, self.freq_start, self.freq_stop,
+                                 self.freq_return)
+            self._send(message.MSG_TYPE_PULSE12 if self.packed12 else message.MSG_TYPE_PULSE, header + data)
+            self._count(self.PULSES_SENT, 1)
+        self._pulse_number = pulse_number
+
+    def _send_log(self, category, level, text):
+        self._send(message.MSG_TYPE_LOG, struct.pack('BB', category, level) + text.encode())
+
+    def _send_reply(self, status, text):
+        self._send(message.MSG_TYPE_REPLY, struct.pack('h', status) + text.encode())
+
+    def _send(self, msg_type, payload):
+        msg = struct.pack('IHH', message.MSG_UNIQUE_WORD, len(payload), msg_type) + payload
+        self._write(cobs.encode(msg) + b'\x00')
+
+    def _write(self, data):
+        # Blocks while the host is not reading, like the USB serial port
+        view = memoryview(data)
+        while len(view) > 0 and self._keep_running.value != 0:
+            if self.link_rate is not None:
+                # Hold the link to link_rate bytes per second
+                delay = self._link_clock - time.perf_counter()
+                if delay > 0.0:
+                    time.sleep(delay)
+            _, ready, _ = select.select([], [self._master], [], 0.1)
+            if not ready:
+                continue
+            try:
+                size = os.write(self._master, view)
+            except (BlockingIOError, InterruptedError):
+                continue
+            view = view[size:]
+            self._count(self.BYTES_SENT, size)
+            if self.link_rate is not None:
+                self._link_clock = max(self._link_clock, time.perf_counter() - 0.01) + size/self.link_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LLRISE radar emulator on a pty')
+    parser.add_argument('--pulse-rate', type=float, default=None,
+                        help='pulses per second (default 1000/pulse_length_ms)')
+    parser.add_argument('--data-size', type=int, default=None,
+                        help='samples per pulse (default from pulse_length_ms)')
+    parser.add_argument('--link-rate', type=float, default=None,
+                        help='link bytes per second (default unlimited)')
+    parser.add_argument('--packed12', action='store_true',
+                        help='send 12 bit packed pulses (MSG_TYPE_PULSE12)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    emulator = RadarEmulator(pulse_rate=args.pulse_rate, data_size=args.data_size,
+                             link_rate=args.link_rate, packed12=args.packed12).start()
+    print('Radar emulator on %s' % (emulator.port,))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(5.0)
+            print(emulator.stats())
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    emulator.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,34 +5,101 @@ Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
 @author: ER17450
 """
 import logging
-import copy, time
+import os, copy, time
+from dataclasses import astuple
 
 import threading, queue
+import serial.tools.list_ports
 
-from teensy_radar_control import message, packet
+from teensy_radar_control import message, packet, scheduling, integrity, clocksync, pulse_ring
 import numpy as np
 
 class BasicRadarHandler(object):
-    def __init__(self):
+    # Pulses go into a pulse_ring.PulseRingBuffer of ring_memory bytes.
+    # get_pulse() hands them out one at a time, get_pulses() as blocks of
+    # header records and a sample matrix, copied out of the ring.  With
+    # views=True they are read only views into the ring instead, good only
+    # until it comes round again (pulse_ring.capacity() pulses later), so
+    # a consumer that holds on to pulses (a record queue) must not ask for
+    # them.
+    # With the sph queue_policy 'block' or 'spill' the ring waits for its
+    # readers and the wait backs up into the serial process, otherwise a
+    # reader that falls capacity pulses behind loses the oldest.
+    #
+    def __init__(self, thread_affinity=None, ring_memory=16<<20, packet_handler=None, **sph_kwargs):
         self.logger = logging.getLogger(type(self).__name__)
 
+        # Extra SerialPacketHandler options used on every connect
+        self.sph_kwargs = sph_kwargs
+
+        # Makes the packet handler on every connect, called like
+        # SerialPacketHandler(port, max_log_level, **sph_kwargs).  A
+        # manager.RadarManager open_device runs the radar on one device of
+        # a manager shared by several handlers.
+        if packet_handler is None:
+            packet_handler = packet.SerialPacketHandler
+        self.packet_handler = packet_handler
+
+        # CPUs for the processing threads (Linux only).  Pair with the
+        # cpu_affinity sph option to keep them off the serial child's cpu.
+        self.thread_affinity = thread_affinity
+
         self.reply_queue = queue.Queue(maxsize=10)
         self.log_queue = queue.Queue(maxsize=1000)
-        self.pulse_queue = queue.Queue(maxsize=1000)
+        self.log_drops = 0
+
+        overwrite = sph_kwargs.get('queue_policy') not in ('block', 'spill')
+        self.pulse_ring = pulse_ring.PulseRingBuffer(ring_memory, overwrite=overwrite)
+        self._pulse_reader = self.pulse_ring.reader()
+
+        # Pulse sequence checks and radar to host clock model, fed once per
+        # block of pulses
+        self.integrity = integrity.PulseIntegrity()
+        self.clock_sync = clocksync.ClockSync()
+
+        # Pulse acquisition to get_pulse(), from the pulse acq_clock
+        self.acquisition_latency = packet.LatencyStats()
 
         self.sph = None
         self.th = None
+        # Held while sph and th are replaced, and by is_alive() which can
+        # end up joining the serial process
+        self._connect_lock = threading.RLock()
+
+        # Last port connected to, the last cmd_start() parameters and the
+        # last pulse_number, used to come back after the radar goes away
+        self.port = None
+        self.last_start = None
+        self.last_pulse_number = None
 
         # Heartbeat tracking
         self.heartbeat_lock = threading.Lock()
         self.heartbeat_clock = None
         self.heartbeat_msg = None
 
+        # Command to reply round trip
+        self.command_latency = packet.LatencyStats()
+        self.last_cmd_id = None
+
+        # Connect timing, see connect_stats()
+        self._connect_clock = None
+        # When _open() last started the serial process
+        self._open_clock = None
+        self._start_clock = None
+        self.connect_time = None
+        self.first_pulse_time = None
+        self.start_to_first_pulse = None
+
     def join(self):
         self.disconnect()
 
     def connect(self,port):
+        with self._connect_lock:
+            self._connect(port)
+
+    def _connect(self, port):
         self.logger.debug('Connect called')
+        connect_clock = time.perf_counter()
         if self.is_alive():
             self.logger.debug('Radar Already running')
             return
@@ -49,28 +116,55 @@ class BasicRadarHandler(object):
             # This should not happen
             raise RuntimeError('connect cant acquire heartbeat lock')
 
+        if not self._open(port):
+            return
+
+        self.first_pulse_time = None
+        self.start_to_first_pulse = None
+        self._connect_clock = connect_clock
+        self.connect_time = time.perf_counter() - connect_clock
+        self.logger.debug('Connect done in %.3f s' % (self.connect_time,))
+
+    def _open(self, port, gap=None):
+        # Start the serial process and the reader thread.  gap goes into
+        # the pulse stream ahead of the first new pulse.  Returns False if
+        # the port did not open.
         try:
-            self.sph = packet.SerialPacketHandler(port,max_log_level=100)
+            self.sph = self.packet_handler(port,max_log_level=100,**self.sph_kwargs)
         except Exception as e:
             self.logger.debug('RadarHandler: error starting SerialPortHandler, aborting.')
             self.logger.debug(str(e))
-            return
+            self.sph = None
+            return False
+        self.port = port
+        self._open_clock = time.perf_counter()
+
+        if gap is not None:
+            gap.restored_clock = time.perf_counter()
+            gap.port = port
+            self.pulse_ring.mark(gap)
 
         self.th_keep_running = True
         self.th = threading.Thread(target=self._bg_thread,args=())
         self.th.daemon = True
         self.th.start()
-        self.logger.debug('Connect done')
+        return True
 
     def disconnect(self):
+        with self._connect_lock:
+            self._disconnect()
+
+    def _disconnect(self):
         self.logger.debug('Disconnect called')
         self.th_keep_running = False
-        if self.th is not None and self.th.is_alive():
-            self.th.join()
+        if self.th is not None:
+            if self.th.is_alive():
+                self.th.join()
             self.th = None
         self.logger.debug('Disconnect sph')
-        if self.sph is not None and self.sph.is_alive():
-            self.sph.join()
+        if self.sph is not None:
+            if self.sph.is_alive():
+                self.sph.join()
             self.sph = None
         self.logger.debug('Disconnect done')
 
@@ -86,18 +180,34 @@ class BasicRadarHandler(object):
         return dt
 
     def is_alive(self):
-        sph_alive = False
-        if self.sph is not None:
-            sph_alive = self.sph.is_alive()
-        th_alive = False
-        if self.th is not None:
-            th_alive = self.th.is_alive()
+        # Not alive while another thread connects, disconnects or reconnects
+        if not self._connect_lock.acquire(timeout=0.1):
+            return False
+        try:
+            sph = self.sph
+            th = self.th
+            sph_alive = False
+            if sph is not None:
+                sph_alive = sph.is_alive()
+            th_alive = False
+            if th is not None:
+                th_alive = th.is_alive()
+        finally:
+            self._connect_lock.release()
         watchdog = False
-        dt = self.time_since_heartbeat()
+        dt = self._heartbeat_age()
         if dt is None or dt < 10.0:
             watchdog = True
         return sph_alive and th_alive and watchdog
 
+    def _heartbeat_age(self):
+        # Seconds since the last heartbeat, or since the port was opened if
+        # there was none yet.  None if it was never opened.
+        dt = self.time_since_heartbeat()
+        if dt is None and self._open_clock is not None:
+            dt = time.perf_counter() - self._open_clock
+        return dt
+
     def cmd_version(self):
         cmd = b'V'
         reply = self._send_command(cmd)
@@ -107,10 +217,15 @@ class BasicRadarHandler(object):
         cmd = b'S %3d %3d %8.3f %8.3f %8.3f \x00' % \
             (pulse_length, gain, fstart, fstop, freturn)
 
+        self._start_clock = time.perf_counter()
+        self.last_start = (pulse_length, gain, fstart, fstop, freturn)
+        # The radar cycle counter starts over
+        self.clock_sync.reset_pulses()
         reply = self._send_command(cmd)
         return reply
 
     def cmd_stop(self):
+        self.last_start = None
         cmd = b'X'
         reply = self._send_command(cmd)
         return reply
@@ -125,15 +240,70 @@ class BasicRadarHandler(object):
         reply = self._send_command(cmd)
         return reply
 
-    def get_pulse(self, block=True, timeout=0):
-        try:
-            pulse = self.pulse_queue.get(block=block, timeout=timeout)
-        except Exception as e:
-            raise e
-        pulse = copy.copy(pulse)
-        self.pulse_queue.task_done()
+    def connect_stats(self):
+        # Seconds for connect() to return, from connect() to the first
+        # pulse, and from the cmd_start() before it to the first pulse.
+        # None until it happened.
+        return {'connect':self.connect_time,
+                'first_pulse':self.first_pulse_time,
+                'start_to_first_pulse':self.start_to_first_pulse}
+
+    def integrity_report(self):
+        # Lost, duplicated and late pulses, counter wraps and pulse interval
+        # jitter since the handler was created or integrity.reset()
+        report = self.integrity.report()
+        report['loss_map'] = self.integrity.loss_map()
+        # Pulses overwritten in the ring before get_pulse() got to them
+        report['ring_lost'] = self._pulse_reader.lost
+        return report
+
+    def latency_stats(self):
+        stats = {}
+        sph = self.sph
+        if sph is not None:
+            stats = sph.latency_stats()
+        stats['round_trip'] = self.command_latency.snapshot()
+        stats['acquisition'] = self.acquisition_latency.snapshot()
+        return stats
+
+    def last_command_record(self):
+        # Queueing and write timing of the last command sent
+        sph = self.sph
+        if sph is None or self.last_cmd_id is None:
+            return None
+        return sph.command_record(self.last_cmd_id)
+
+    def get_pulse(self, block=True, timeout=0, views=False):
+        # The next message.msg_pulse, or a message.msg_gap.  Raises
+        # queue.Empty.  With views the pulse data is a view into the ring,
+        # not a copy.
+        pulse = self._pulse_reader.get(block, timeout)
+        if isinstance(pulse, message.msg_pulse):
+            if not views:
+                pulse.data = pulse.data.copy()
+            if pulse.acq_clock is not None:
+                self.acquisition_latency.add(time.perf_counter() - pulse.acq_clock)
         return pulse
 
+    def get_pulses(self, max_n=None, block=True, timeout=0, views=False):
+        # Up to max_n pulses as (headers, data, acq_clock), a
+        # PULSE_HEADER_DTYPE array, a pulses x data_size matrix and the
+        # acquisition clocks (NaN where not known).  Copies, or with views
+        # views into the ring.  A message.msg_gap comes back on its own.
+        # Raises queue.Empty.  Shares its place in the stream with
+        # get_pulse().
+        item = self._pulse_reader.get_block(max_n, block, timeout)
+        if isinstance(item, tuple):
+            if not views:
+                item = tuple(a.copy() for a in item)
+            dts = time.perf_counter() - item[2]
+            self.acquisition_latency.add_many(dts[~np.isnan(dts)])
+        return item
+
+    def pulse_reader(self):
+        # A reader of its own for another consumer, see pulse_ring
+        return self._pulse_reader.ring.reader()
+
     def get_log_msg(self, block=True, timeout=0):
         try:
             log_msg = self.log_queue.get(block=block, timeout=timeout)
@@ -154,19 +324,21 @@ class BasicRadarHandler(object):
             self.reply_queue.task_done()
 
         # Send command
+        cmd_clock = time.perf_counter()
         try:
-            self.sph.write_packet(cmd, block=True, timeout=0.1)
+            self.last_cmd_id = self.sph.write_packet(cmd, block=True, timeout=0.1)
         except Exception as e:
             log_cmd = message.msg_log(0,0,'COMMAND: Enqueue failed.  Continuing')
             return
 
         log_cmd = message.msg_log(0,0,'COMMAND: "%s"' % (cmd,))
-        self.log_queue.put(log_cmd)
+        self._put_log(log_cmd)
 
         # Wait for reply
         try:
             reply = copy.copy(self.reply_queue.get(timeout=0.1))
             self.reply_queue.task_done()
+            self.command_latency.add(time.perf_counter() - cmd_clock)
         except queue.Empty:
             log_cmd = message.msg_log(0,0,'COMMAND: "%s" never got a reply' % (cmd,))
             reply = None
@@ -174,82 +346,198 @@ class BasicRadarHandler(object):
         return reply
 
     def _bg_thread(self):
+        scheduling.pin_current_thread(self.thread_affinity)
+
         # Look forever
         while self.th_keep_running:
-            # Read messages from serial port handler
+            # Read all waiting messages from serial port handler
+            # On errors stop here, is_alive() turns False and disconnect()
+            # cleans up.  This thread can not join itself.
             try:
-                msg = self.sph.read_packet(block=True, timeout=0.1)
-            except queue.Empty:
-                continue
+                msgs = self.sph.read_packets(timeout=0.1)
             except ValueError:
-                self.logger.debug('SerialPortHandler crashed, disconnecting.')
-                self.disconnect()
-            except Exception as e:
-                self.logger.debug('read_packet() error, aborting.')
-                self.logger.debug(str(e))
-                self.disconnect()
-
-            # Try to parse message
-            try:
-                parsed_msg = message.parse_message(msg)
+                self.logger.debug('SerialPortHandler crashed, stopping.')
+                break
             except Exception as e:
-                self.logger.debug('RadarHandler: parse_message() error, continuing.')
+                self.logger.debug('read_packets() error, aborting.')
                 self.logger.debug(str(e))
-                continue
-
-            if isinstance(parsed_msg, message.msg_heartbeat):
-                self.logger.debug(str(parsed_msg))
-                if self.heartbeat_lock.acquire(blocking=True, timeout=1.0):
-                    self.heartbeat_clock = time.perf_counter()
-                    self.heartbeat_msg = parsed_msg
-                    self.heartbeat_lock.release()
+                break
+            if len(msgs) == 0 and not self.sph.is_alive():
+                # The serial process ended, the port went away
+                self.logger.debug('SerialPortHandler ended, stopping.')
+                break
+
+            # Raw frames, shared ring slots arrive as numpy views, are parsed
+            # a run at a time.  The pulses are copied out of the frames.
+            frames = []
+            for msg in msgs:
+                if isinstance(msg, (bytes, bytearray, memoryview, np.ndarray)):
+                    frames.append(msg)
+                    continue
+                self._dispatch_frames(frames)
+                frames = []
+                # Already parsed by the serial process with parse_in_child
+                if isinstance(msg, message.msg_pulse_block):
+                    self._dispatch_pulses(msg.headers, msg.data)
                 else:
-                    # This should not happen
-                    raise RuntimeError('Thread cant acquire heartbeat lock')
-            elif isinstance(parsed_msg, message.msg_log):
-                self.log_queue.put(parsed_msg)
-            elif isinstance(parsed_msg, message.msg_reply):
-                self.reply_queue.put(parsed_msg)
-                # Send the reply to the log too
-                self.log_queue.put(parsed_msg)
-            elif isinstance(parsed_msg, message.msg_pulse):
-                self.pulse_queue.put(parsed_msg)
-            else:
-                err = 'Unexpected packed type.  Ignoring: "%s"' % (str(parsed_msg),)
-                log_msg = message.msg_log(message.LOG_ERROR,0,err)
-                self.log_queue.put(log_msg)
-                self.logger.debug(err)
+                    self._dispatch_message(msg)
+            self._dispatch_frames(frames)
 
         # Make sure the thread gives up the lock
         if self.heartbeat_lock.locked():
             self.heartbeat_lock.release()
 
+    def _put_log(self, msg):
+        # Log messages nobody reads must not hold up the pulses, drop the
+        # oldest
+        while True:
+            try:
+                self.log_queue.put(msg, block=False)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.log_queue.get(block=False)
+                self.log_queue.task_done()
+                self.log_drops = self.log_drops + 1
+            except queue.Empty:
+                pass
+
+    def _dispatch_message(self, parsed_msg):
+        if isinstance(parsed_msg, message.msg_heartbeat):
+            self.logger.debug(str(parsed_msg))
+            self.clock_sync.heartbeat(parsed_msg.time_stamp, self.sph.last_batch_clock)
+            self.integrity.heartbeat(parsed_msg.time_stamp)
+            if self.heartbeat_lock.acquire(blocking=True, timeout=1.0):
+                self.heartbeat_clock = time.perf_counter()
+                self.heartbeat_msg = parsed_msg
+                self.heartbeat_lock.release()
+            else:
+                # This should not happen
+                raise RuntimeError('Thread cant acquire heartbeat lock')
+        elif isinstance(parsed_msg, message.msg_log):
+            self._put_log(parsed_msg)
+        elif isinstance(parsed_msg, message.msg_reply):
+            self.reply_queue.put(parsed_msg)
+            # Send the reply to the log too
+            self._put_log(parsed_msg)
+        elif isinstance(parsed_msg, message.msg_pulse):
+            headers = np.array([astuple(parsed_msg.header)], dtype=message.PULSE_HEADER_DTYPE)
+            self._dispatch_pulses(headers, parsed_msg.data[np.newaxis,:])
+        else:
+            err = 'Unexpected packed type.  Ignoring: "%s"' % (str(parsed_msg),)
+            log_msg = message.msg_log(message.LOG_ERROR,0,err)
+            self._put_log(log_msg)
+            self.logger.debug(err)
+
+    def _dispatch_frames(self, frames):
+        if len(frames) == 0:
+            return
+        headers, data, others, errors = message.parse_messages(frames)
+        for err in errors:
+            self.logger.debug('RadarHandler: parse error, continuing.')
+            self.logger.debug(err)
+        for parsed_msg in others:
+            self._dispatch_message(parsed_msg)
+        if len(headers) == 0:
+            return
+
+        sizes = headers['data_size']
+        if (sizes == sizes[0]).all():
+            self._dispatch_pulses(headers, data)
+            return
+        # data_size changed, zero padded rows.  The ring takes one
+        # data_size at a time.
+        bounds = [0] + (np.flatnonzero(np.diff(sizes)) + 1).tolist() + [len(sizes)]
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            self._dispatch_pulses(headers[start:stop], data[start:stop,0:sizes[start]])
+
+    def _dispatch_pulses(self, headers, data):
+        # A block of pulses with the same data_size: sequence checks,
+        # acquisition clocks, then the ring
+        self.integrity.update_headers(headers)
+        acq_clock = self.clock_sync.update_pulses(headers['pulse_cycle_count'], self.sph.last_batch_clock)
+
+        self.last_pulse_number = int(headers['pulse_number'][-1])
+        if self.first_pulse_time is None and self._connect_clock is not None:
+            now = time.perf_counter()
+            self.first_pulse_time = now - self._connect_clock
+            if self._start_clock is not None and self._start_clock >= self._connect_clock:
+                self.start_to_first_pulse = now - self._start_clock
+            self.logger.debug('First pulse %.3f s after connect' % (self.first_pulse_time,))
+
+        # Without overwrite wait for the readers, the wait backs up into
+        # the serial process where its queue_policy applies
+        while self.th_keep_running:
+            if self.pulse_ring.write(headers, data, acq_clock, timeout=0.1):
+                return
+
 
 class ExtendedRadarHandler(BasicRadarHandler):
-    def __init__(self):
-        super().__init__()
+    # With auto_reconnect the queues and their consumers outlive the radar
+    # connection.  When the serial process ends (USB dropped, Teensy reset)
+    # or heartbeats stop for heartbeat_timeout seconds, the handler polls
+    # every reconnect_poll seconds for the port, or a port with the same
+    # USB vid, pid and serial number, reopens it, sends the last cmd_start()
+    # again and puts a message.msg_gap in the pulse stream.
+    #
+    # get_pulse() and get_pulses() read extended_pulse_ring, filled from
+    # pulse_ring by a worker thread that joins doppler pulses.
+    #
+    def __init__(self, auto_reconnect=True, reconnect_poll=0.25, heartbeat_timeout=5.0, **sph_kwargs):
+        super().__init__(**sph_kwargs)
         self.logger = logging.getLogger(type(self).__name__)
 
-        self.extended_pulse_queue = queue.Queue(maxsize=1000)
+        self.extended_pulse_ring = pulse_ring.PulseRingBuffer(self.pulse_ring.memory_budget,
+                                                              overwrite=self.pulse_ring.overwrite)
+        # The worker reads pulse_ring, users read extended_pulse_ring
+        self._extended_reader = self.pulse_ring.reader()
+        self._pulse_reader = self.extended_pulse_ring.reader()
 
         # Pulse concatenation (used for longer doppler pulses)
         self.pulse_cat_count = 1
 
+        # Reconnect state.  _want_connected is cleared by the user
+        # disconnecting, _connect_lock keeps connect() and disconnect() out
+        # of a reconnect.
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_poll = reconnect_poll
+        self.heartbeat_timeout = heartbeat_timeout
+        self.reconnecting = False
+        self.reconnect_count = 0
+        self._want_connected = False
+        self._port_id = None
+
         self.extended_pulse_keep_running = True
         self.extended_pulse_th = threading.Thread(target=self._extended_pulse_bg,args=())
         self.extended_pulse_th.daemon = True
         self.extended_pulse_th.start()
 
+        self.reconnect_th = threading.Thread(target=self._reconnect_bg,args=())
+        self.reconnect_th.daemon = True
+        self.reconnect_th.start()
+
     def join(self):
         self.extended_pulse_keep_running = False
         self.extended_pulse_th.join()
+        self.reconnect_th.join()
         super().join()
 
+    def connect(self, port):
+        with self._connect_lock:
+            super().connect(port)
+            if self.sph is not None:
+                self._want_connected = True
+                self._port_id = self._usb_id(port)
+
     def disconnect(self):
-        self.pulse_cat_count = 1
-        return super().disconnect()
+        with self._connect_lock:
+            self._want_connected = False
+            self.pulse_cat_count = 1
+            return super().disconnect()
 
     def cmd_start(self, pulse_length, gain, fstart, fstop, freturn):
+        last_start = (pulse_length, gain, fstart, fstop, freturn)
         bw = abs(fstop-fstart)
         if bw < 1e-6 and pulse_length > 40:
             # doppler mode
@@ -262,68 +550,178 @@ class ExtendedRadarHandler(BasicRadarHandler):
 
         reply = super().cmd_stop()
         reply = super().cmd_start(pulse_length, gain, fstart, fstop, freturn)
+        # Resend the parameters as given, not as modified for the radar
+        self.last_start = last_start
         return reply
 
     def cmd_stop(self):
         self.pulse_cat_count = 1
         return super().cmd_stop()
 
-    def get_pulse(self, block=True, timeout=0):
-        try:
-            pulse = self.extended_pulse_queue.get(block=block, timeout=timeout)
-        except Exception as e:
-            raise e
-        pulse = copy.copy(pulse)
-        self.extended_pulse_queue.task_done()
-        return pulse
+    def is_reconnecting(self):
+        # True while the link is down and the handler is bringing it back
+        return self.auto_reconnect and self._want_connected and not self.is_alive()
+
+    def _usb_id(self, port):
+        # (vid, pid, serial_number) of a USB serial port, None otherwise
+        path = os.path.realpath(port) if os.path.exists(port) else port
+        for info in serial.tools.list_ports.comports():
+            if info.device in (port, path) and info.serial_number is not None:
+                return (info.vid, info.pid, info.serial_number)
+        return None
+
+    def _find_port(self):
+        # The last port if it is back, else the same USB device on a new
+        # port.  None if neither is there yet.
+        port = self.port
+        if '://' in port or os.path.exists(port):
+            return port
+        for info in serial.tools.list_ports.comports():
+            if info.device == port:
+                return port
+            if self._port_id is not None and \
+                    (info.vid, info.pid, info.serial_number) == self._port_id:
+                return info.device
+        return None
+
+    def _link_lost(self):
+        if self.sph is None or not self.sph.is_alive():
+            return True
+        if self.th is None or not self.th.is_alive():
+            return True
+        dt = self._heartbeat_age()
+        return dt is not None and dt > self.heartbeat_timeout
+
+    def _reconnect_bg(self):
+        while self.extended_pulse_keep_running:
+            time.sleep(self.reconnect_poll)
+            if not self.auto_reconnect or not self._want_connected:
+                continue
+            with self._connect_lock:
+                if not self._want_connected or not self._link_lost():
+                    continue
+                gap, last_start = self._drop_link()
+            self._reconnect(gap, last_start)
+
+    def _drop_link(self):
+        # Called holding _connect_lock.  Tears down the lost link and
+        # returns the gap for the pulse stream and the last cmd_start()
+        # parameters.
+        self.logger.warning('Radar on %s lost, reconnecting' % (self.port,))
+        self.reconnecting = True
+        gap = message.msg_gap(time.perf_counter(), None, self.last_pulse_number, self.port)
+        last_start = self.last_start
+        BasicRadarHandler.disconnect(self)
+        with self.heartbeat_lock:
+            self.heartbeat_clock = None
+            self.heartbeat_msg = None
+        return gap, last_start
+
+    def _reconnect(self, gap, last_start):
+        # Each try takes _connect_lock on its own, connect() and
+        # disconnect() get in between.  Gives up once the user disconnects
+        # or connects.
+        reconnected = False
+        while self.extended_pulse_keep_running:
+            with self._connect_lock:
+                if not self._want_connected or self.sph is not None:
+                    break
+                port = self._find_port()
+                if port is not None and self._open(port, gap):
+                    reconnected = True
+                    self.reconnect_count = self.reconnect_count + 1
+                    if last_start is not None:
+                        self.cmd_start(*last_start)
+                    break
+            time.sleep(self.reconnect_poll)
+        self.reconnecting = False
+        if not reconnected:
+            return
+
+        self.logger.warning('Radar back on %s after %.2f s' % (gap.port, gap.restored_clock - gap.lost_clock))
+        self._put_log(message.msg_log(0,0,'RECONNECTED after %.2f s' % (gap.restored_clock - gap.lost_clock,)))
+
+    def integrity_report(self):
+        report = super().integrity_report()
+        report['ring_lost'] = report['ring_lost'] + self._extended_reader.lost
+        return report
+
+    def _put_extended_pulses(self, headers, data, acq_clock):
+        # Without overwrite wait for the readers, the wait backs up into
+        # the serial process where its queue_policy applies
+        while self.extended_pulse_keep_running:
+            if self.extended_pulse_ring.write(headers, data, acq_clock, timeout=0.1):
+                return
 
     def _extended_pulse_bg(self):
+        scheduling.pin_current_thread(self.thread_affinity)
+
+        reader = self._extended_reader
+        # Pulses not yet joined, kept for the next block
+        carry = None
         while self.extended_pulse_keep_running:
+            # Partial concatenations are dropped at a gap
+            for gap in reader.markers():
+                carry = None
+                self.extended_pulse_ring.mark(gap)
+            try:
+                headers, data, acq_clock = reader.read(block=True, timeout=0.1)
+            except queue.Empty:
+                continue
+            if len(headers) == 0:
+                continue
+
             # Short circuit for the common case
-            if self.pulse_cat_count == 1:
-                try:
-                    pulse = super().get_pulse(block=True,timeout=0.1)
-                except queue.Empty:
-                    continue
-                self.extended_pulse_queue.put(pulse,block=True,timeout=0.1)
+            cat_count = self.pulse_cat_count
+            if cat_count == 1:
+                carry = None
+                self._put_extended_pulses(headers, data, acq_clock)
                 continue
 
             # Must be concatenating pulses
             try:
-                # Find a starting pulse with.
-                # Consume a few pulses until pulse number divides evenly
-                try:
-                    pulse = super().get_pulse(block=True,timeout=0.1)
-                except queue.Empty:
-                    continue
-                pulse_number = pulse.header.pulse_number
-                cat_count = self.pulse_cat_count
-                consume = (cat_count - (pulse_number % cat_count))%cat_count
-                for ii in range(0,consume):
-                    pulse = super().get_pulse(block=True,timeout=0.1)
-
-                # Use this header as the header for the concatenated pulse.
-                # Modify some of the fields as we go.
-                pulse_number = pulse.header.pulse_number//self.pulse_cat_count
-                data_size = pulse.header.data_size
-                pulse_length_ms = pulse.header.pulse_length_ms
-                data = [pulse.data]
-                for ii in range(1,self.pulse_cat_count):
-                    npulse = super().get_pulse(block=True,timeout=0.1)
-                    data.append(npulse.data)
-                    data_size = data_size + npulse.header.data_size
-                    pulse_length_ms = pulse_length_ms + npulse.header.pulse_length_ms
-
-                # Build the new pulse
-                pulse.header.pulse_number = pulse_number
-                pulse.header.data_size = data_size
-                pulse.header.pulse_length_ms = pulse_length_ms
-                pulse.data = np.concatenate(data)
-
-                self.extended_pulse_queue.put(pulse,block=True,timeout=0.1)
+                if carry is not None and carry[0] == cat_count and carry[2].shape[1] == data.shape[1]:
+                    headers = np.concatenate((carry[1], headers))
+                    data = np.concatenate((carry[2], data))
+                    acq_clock = np.concatenate((carry[3], acq_clock))
+                joined, keep = _concatenate_pulses(headers, data, acq_clock, cat_count)
+                carry = (cat_count, headers[keep:].copy(), data[keep:].copy(), acq_clock[keep:].copy())
+                self._put_extended_pulses(*joined)
             except Exception as e:
                 self.logger.debug('Problem assembling a concatenated pulse.')
                 self.logger.debug(str(e))
+                carry = None
                 continue
 
+
+def _concatenate_pulses(headers, data, acq_clock, cat_count):
+    # Joins each run of cat_count consecutive pulses that starts at a
+    # pulse_number divisible by cat_count into one pulse (longer doppler
+    # pulses).  The joined pulse has the first pulse's header with
+    # pulse_number divided by cat_count and the summed data_size and
+    # pulse_length_ms, its data is the run's data end to end.  Runs broken
+    # by a lost pulse are dropped.  Returns the joined (headers, data,
+    # acq_clock) and the index of the first pulse that could still start a
+    # run completed by later pulses.
+    count = len(headers)
+    numbers = headers['pulse_number'].astype(np.int64)
+    offsets = np.arange(cat_count)
+
+    starts = np.flatnonzero(numbers[0:max(count-cat_count+1, 0)] % cat_count == 0)
+    rows = starts[:,np.newaxis] + offsets
+    whole = ((numbers[rows] - numbers[starts][:,np.newaxis]) == offsets).all(axis=1)
+    starts = starts[whole]
+    rows = rows[whole]
+
+    joined = headers[starts]
+    joined['pulse_number'] = joined['pulse_number']//cat_count
+    joined['data_size'] = headers['data_size'][rows].sum(axis=1)
+    joined['pulse_length_ms'] = headers['pulse_length_ms'][rows].sum(axis=1)
+    joined_data = data[rows].reshape(len(starts), cat_count*data.shape[1])
+
+    keep = max(count-cat_count+1, 0)
+    if len(starts) > 0:
+        keep = max(keep, int(starts[-1]) + cat_count)
+    return (joined, joined_data, acq_clock[starts]), keep
+
 #     Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 04:02:19 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Pulse sequence integrity from the pulse_number and pulse_cycle_count
+header fields: lost, duplicated and out of order pulses, counter wraps,
+radar restarts and the jitter of the time between pulses.  Works on
+batches of headers with numpy, live through PulseIntegrity.update() or
+on a whole recording with check_headers().
+"""
+import collections
+import threading
+
+import numpy as np
+
+from teensy_radar_control import message
+
+# Both counters are uint32 in the firmware
+COUNTER_MODULUS = 1 << 32
+
+class PulseIntegrity(object):
+    # Tracks one pulse stream.  pulse_number steps are taken modulo 2**32,
+    # so a counter wrap is not a loss.  A step back of more than
+    # reorder_window pulses is a restart of the radar (or of the emulator
+    # numbering on cmd_start) and starts the tracking over without counting
+    # anything lost.  Smaller steps back are pulses arriving late, or
+    # duplicates if the number repeats the previous one, as long as their
+    # pulse_cycle_count fits: off by more than restart_tolerance pulse
+    # intervals from where the interval mean puts it, the cycle counter
+    # was reset and it is a restart too.  heartbeat() takes the firmware
+    # heartbeat time stamps, one going back is a restart and the next pulse
+    # starts the tracking over whatever its number.
+    #
+    # The loss map keeps the last max_loss_runs runs of missing pulses as
+    # (first missing pulse_number, count).  A late pulse does not edit the
+    # map, it is counted in reordered and taken off lost.
+    #
+    # Intervals between adjacent pulses come from pulse_cycle_count, the
+    # CPU cycle counter when the pulse was sampled, in cycles of
+    # cpu_clock_hz.
+    #
+    def __init__(self, cpu_clock_hz=message.CPU_CLOCK_HZ, reorder_window=64, max_loss_runs=256,
+                 restart_tolerance=0.5):
+        self.cpu_clock_hz = cpu_clock_hz
+        self.reorder_window = reorder_window
+        self.restart_tolerance = restart_tolerance
+        self.max_loss_runs = max_loss_runs
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.received = 0
+            self.missing = 0
+            self.duplicates = 0
+            self.reordered = 0
+            self.wraps = 0
+            self.restarts = 0
+            self.loss_runs = 0
+            self._loss_map = collections.deque(maxlen=self.max_loss_runs)
+
+            # Last pulse_number and cycle count seen, and the unwrapped
+            # pulse number of the last and the highest pulse
+            self._last_number = None
+            self._last_cycles = None
+            self._last_u = 0
+            self._max_u = 0
+
+            # Last heartbeat time stamp, a restart seen in the pulses since
+            # it, and a restart from the heartbeats for the next pulse
+            self._heartbeat_stamp = None
+            self._restart_seen = False
+            self._restart_pending = False
+
+            # Interval statistics in cycles: count, mean, sum of squared
+            # differences from the mean, min and max
+            self._int_count = 0
+            self._int_mean = 0.0
+            self._int_m2 = 0.0
+            self._int_min = None
+            self._int_max = None
+
+    def heartbeat(self, time_stamp):
+        # time_stamp of a msg_heartbeat, milliseconds since the firmware
+        # started
+        with self._lock:
+            last = self._heartbeat_stamp
+            self._heartbeat_stamp = int(time_stamp)
+            restart_seen = self._restart_seen
+            self._restart_seen = False
+            if last is None:
+                return
+            if (int(time_stamp) - last) % COUNTER_MODULUS < (COUNTER_MODULUS >> 1):
+                return
+            # Unless the pulses already showed this restart
+            if not restart_seen:
+                self._restart_pending = True
+
+    def update_headers(self, headers):
+        # headers is a PULSE_HEADER_DTYPE array, e.g. from parse_messages()
+        self.update(headers['pulse_number'], headers['pulse_cycle_count'])
+
+    def update(self, pulse_numbers, cycle_counts):
+        # The pulses of one batch, in arrival order
+        numbers = np.asarray(pulse_numbers, dtype=np.int64)
+        cycles = np.asarray(cycle_counts, dtype=np.int64)
+        if len(numbers) != len(cycles):
+            raise ValueError('pulse_numbers and cycle_counts differ in length')
+        with self._lock:
+            while len(numbers) > 0:
+                if self._restart_pending:
+                    self._restart_pending = False
+                    if self._last_number is not None:
+                        self.restarts = self.restarts + 1
+                        self._restart_seen = True
+                        self._last_number = None
+                if self._last_number is None:
+                    self._start(numbers[0], cycles[0])
+                    numbers = numbers[1:]
+                    cycles = cycles[1:]
+                    continue
+                restart = self._update(numbers, cycles)
+                if restart is None:
+                    break
+                # Start over at the restart, the rest is a new stream
+                self.restarts = self.restarts + 1
+                self._restart_seen = True
+                self._start(numbers[restart], cycles[restart])
+                numbers = numbers[restart+1:]
+                cycles = cycles[restart+1:]
+
+    def lost(self):
+        # Pulses never seen, allowing for the late ones
+        return max(self.missing - self.reordered, 0)
+
+    def loss_map(self):
+        # Recent runs of missing pulses, an array of (first pulse_number, count)
+        with self._lock:
+            if len(self._loss_map) == 0:
+                return np.empty((0,2), dtype=np.int64)
+            return np.array(self._loss_map, dtype=np.int64)
+
+    def report(self):
+        with self._lock:
+            report = {'received': self.received,
+                      'lost': self.lost(),
+                      'duplicates': self.duplicates,
+                      'reordered': self.reordered,
+                      'wraps': self.wraps,
+                      'restarts': self.restarts,
+                      'loss_runs': self.loss_runs}
+            # Pulse to pulse interval and its jitter, in seconds
+            report['interval_count'] = self._int_count
+            report['interval_mean'] = None
+            report['interval_jitter'] = None
+            report['interval_min'] = None
+            report['interval_max'] = None
+            if self._int_count > 0:
+                report['interval_mean'] = self._int_mean/self.cpu_clock_hz
+                report['interval_jitter'] = float(np.sqrt(self._int_m2/self._int_count))/self.cpu_clock_hz
+                report['interval_min'] = self._int_min/self.cpu_clock_hz
+                report['interval_max'] = self._int_max/self.cpu_clock_hz
+        return report
+
+    def _start(self, number, cycles):
+        self.received = self.received + 1
+        self._last_number = int(number)
+        self._last_cycles = int(cycles)
+        self._last_u = int(number)
+        self._max_u = int(number)
+
+    def _update(self, numbers, cycles):
+        # Tracks numbers up to the first restart.  Returns the index of
+        # the restart, None if there is none.
+        half = COUNTER_MODULUS >> 1
+        prev = np.empty(len(numbers), dtype=np.int64)
+        prev[0] = self._last_number
+        prev[1:] = numbers[:-1]
+        step = (numbers - prev) % COUNTER_MODULUS
+        step[step >= half] -= COUNTER_MODULUS
+
+        prev_cycles = np.empty(len(cycles), dtype=np.int64)
+        prev_cycles[0] = self._last_cycles
+        prev_cycles[1:] = cycles[:-1]
+        cycle_step = (cycles - prev_cycles) % COUNTER_MODULUS
+
+        restarted = step < -self.reorder_window
+        back = step <= 0
+        if self._int_count > 0 and back.any():
+            # Cycles from the previous pulse to a late or repeated one,
+            # against what the pulse numbers say
+            back_cycles = cycle_step[back]
+            back_cycles[back_cycles >= half] -= COUNTER_MODULUS
+            error = np.abs(back_cycles - step[back]*self._int_mean)
+            restarted[back] |= error > self.restart_tolerance*self._int_mean
+
+        restart = np.flatnonzero(restarted)
+        if len(restart) > 0:
+            restart = int(restart[0])
+            numbers = numbers[0:restart]
+            cycles = cycles[0:restart]
+            step = step[0:restart]
+            cycle_step = cycle_step[0:restart]
+        else:
+            restart = None
+        if len(numbers) == 0:
+            return restart
+
+        # Unwrapped numbers, and how far each one is past the highest so far
+        unwrapped = self._last_u + np.cumsum(step)
+        highest = np.maximum.accumulate(np.concatenate(([self._max_u], unwrapped)))
+        advance = unwrapped - highest[:-1]
+
+        duplicates = int(np.count_nonzero(step == 0))
+        gaps = np.flatnonzero(advance > 1)
+        self.received = self.received + len(numbers)
+        self.duplicates = self.duplicates + duplicates
+        self.reordered = self.reordered + int(np.count_nonzero(advance <= 0)) - duplicates
+        if len(gaps) > 0:
+            counts = advance[gaps] - 1
+            firsts = (highest[gaps] + 1) % COUNTER_MODULUS
+            self.missing = self.missing + int(counts.sum())
+            self.loss_runs = self.loss_runs + len(gaps)
+            self._loss_map.extend(zip(firsts.tolist(), counts.tolist()))
+        self.wraps = self.wraps + int(highest[-1]//COUNTER_MODULUS - self._max_u//COUNTER_MODULUS)
+
+        # Cycle counts between pulses that follow each other
+        intervals = cycle_step[step == 1]
+        if len(intervals) > 0:
+            self._add_intervals(intervals)
+
+        self._last_number = int(numbers[-1])
+        self._last_cycles = int(cycles[-1])
+        self._last_u = int(unwrapped[-1])
+        self._max_u = int(highest[-1])
+        return restart
+
+    def _add_intervals(self, intervals):
+        # Merge the batch statistics into the running ones (Chan et al.)
+        count = len(intervals)
+        mean = float(intervals.mean())
+        m2 = float(((intervals - mean)**2).sum())
+        total = self._int_count + count
+        delta = mean - self._int_mean
+        self._int_mean = self._int_mean + delta*count/total
+        self._int_m2 = self._int_m2 + m2 + delta*delta*self._int_count*count/total
+        self._int_count = total
+        low = int(intervals.min())
+        high = int(intervals.max())
+        self._int_min = low if self._int_min is None else min(self._int_min, low)
+        self._int_max = high if self._int_max is None else max(self._int_max, high)
+
+
+def check_headers(headers, cpu_clock_hz=message.CPU_CLOCK_HZ, reorder_window=64, max_loss_runs=256,
+                  restart_tolerance=0.5):
+    # Integrity of a whole recording.  Returns (report, loss map) as from
+    # PulseIntegrity.  Recordings have no heartbeats, restarts come from
+    # the pulse numbers and cycle counts only.
+    tracker = PulseIntegrity(cpu_clock_hz=cpu_clock_hz, reorder_window=reorder_window,
+                             max_loss_runs=max_loss_runs, restart_tolerance=restart_tolerance)
+    tracker.update_headers(headers)
+    return tracker.report(), tracker.loss_map()
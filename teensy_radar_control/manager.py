@@ -0,0 +1,612 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 00:12:44 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Acquisition from several radars in one process.  A SerialPacketHandler per
+radar costs a process, a writer thread, a log thread and four queues each.
+RadarManager services every port from a single selector driven child
+process, with one writer thread, and tags every packet with the index of
+the radar it came from.
+
+    rm = RadarManager(['/dev/ttyACM0', '/dev/ttyACM1'])
+    rm.write_packet(1, b'V')
+    for device_id, packet in rm.read_packets(timeout=0.1):
+        ...
+    stream = rm.device(0)          # one device on its own
+    packets = stream.read_packets(timeout=0.1)
+
+The radar handlers run on a device of a shared manager with
+
+    rh = ExtendedRadarHandler(packet_handler=rm.open_device)
+    rh.connect('/dev/ttyACM0')
+"""
+import logging
+import time, selectors
+import threading, queue
+import collections
+from dataclasses import dataclass
+
+import serial
+
+from teensy_radar_control import message, transport, packet
+from teensy_radar_control.packet import mp, PacketFramer, LinkStats, LatencyStats, \
+    BatchSender, LogForwarder, command_record, MSG_START_PATTERN
+
+class RadarManager(object):
+    def __init__(self, ports, max_log_level=0, batch_latency=0.0,
+                 max_data_size=message.MSG_MAX_DATA_SIZE, parse_in_child=False,
+                 baudrate=2000000, write_queue_size=64, connect_timeout=5.0,
+                 queue_policy='drop_newest', spill_dir=None, measure_latency=False,
+                 reopen_interval=1.0):
+        self.logger = logging.getLogger(type(self).__name__)
+
+        self.ports = list(ports)
+        self.device_count = len(self.ports)
+        self.max_log_level = max_log_level
+        self.baudrate = baudrate
+
+        # Everything read in one pass over the ports goes to the parent as
+        # one batch, or once the oldest packet waited batch_latency seconds
+        self.batch_latency = batch_latency
+
+        # Same framing limits, parsing and read_queue options as
+        # SerialPacketHandler.  A full read_queue holds up every device.
+        self.max_frame_len = message.max_encoded_size(max_data_size)
+        self.max_buf_len = max(6000, 2*self.max_frame_len)
+        self.parse_in_child = parse_in_child
+        if queue_policy not in BatchSender.QUEUE_POLICIES:
+            raise ValueError('queue_policy must be one of %s' % (BatchSender.QUEUE_POLICIES,))
+        self.queue_policy = queue_policy
+        self.spill_dir = spill_dir
+
+        # A port that fails to open, or goes away, is tried again every
+        # reopen_interval seconds
+        self.reopen_interval = reopen_interval
+
+        # Parent side packets per device that were read from the queue but
+        # not handed out yet, and the batch clock of the newest.  The lock
+        # serializes readers of read_queue.  Packets of a device whose
+        # DeviceStream was joined are dropped.
+        self._pending = [collections.deque() for ii in range(0,self.device_count)]
+        self._last_batch_clock = [None]*self.device_count
+        self._released = [False]*self.device_count
+        self._read_lock = threading.Lock()
+
+        # Commands get an id from write_packet(), the child writer thread
+        # reports them written in a command_record per device
+        self._cmd_id = 0
+        self._write_lock = threading.Lock()
+        self._command_records = [collections.OrderedDict() for ii in range(0,self.device_count)]
+        self._max_command_records = 100
+        self._records_lock = threading.Lock()
+
+        # Latency per device, as in SerialPacketHandler.  command from the
+        # command records, delivery with measure_latency.
+        self.measure_latency = measure_latency
+        self._command_latency = [LatencyStats() for ii in range(0,self.device_count)]
+        self._delivery_latency = [LatencyStats() for ii in range(0,self.device_count)]
+
+        # Link counters per device and device open flags, maintained by the
+        # child
+        self._link_stats = [LinkStats(mp.Array('d',[0.0]*len(LinkStats.NAMES),lock=False))
+                            for ii in range(0,self.device_count)]
+        self._device_open = mp.Array('i',[0]*self.device_count,lock=False)
+
+        # open_device() asks the child to reopen a port by counting up its
+        # entry in _reopen_requests, the child copies the count to
+        # _reopen_done once it tried
+        self._reopen_requests = mp.Array('i',[0]*self.device_count,lock=False)
+        self._reopen_done = mp.Array('i',[0]*self.device_count,lock=False)
+        self.connect_timeout = connect_timeout
+
+        # read_queue carries (batch_clock, [(device_id, packets), ...]),
+        # write_queue (device_id, cmd_id, enqueue_clock, packet) and
+        # write_done_queue (device_id, command_record)
+        self.write_queue = mp.Queue(maxsize=write_queue_size)
+        self.read_queue = mp.Queue(maxsize=1000)
+        self.log_queue = mp.Queue(maxsize=1000)
+        self.write_done_queue = mp.Queue(maxsize=1000)
+
+        self._mp_keep_running = mp.Value('i',1)
+
+        # Set by the child once every port was opened (or failed to)
+        self._mp_ready = mp.Event()
+        self.connect_time = None
+        connect_clock = time.perf_counter()
+
+        try:
+            self.logger.debug('Processes: Launching child process')
+            self._mp = mp.Process(target=self._mp_startup,args=(),name='RadarManager')
+            self._mp.daemon = True
+            self._mp.start()
+        except Exception as e:
+            self.logger.warning('Process: Launch failed.')
+            raise e
+
+        self._log_forwarder = LogForwarder(self.log_queue, self.logger)
+
+        while not self._mp_ready.wait(0.01):
+            if not self._mp.is_alive():
+                self.join()
+                err = 'Process: DOA exit = %s' % (self._mp.exitcode,)
+                self.logger.warning(err)
+                raise RuntimeError(err)
+            if time.perf_counter() - connect_clock > connect_timeout:
+                self.join()
+                err = 'Process: ports not ready after %.1f s' % (connect_timeout,)
+                self.logger.warning(err)
+                raise RuntimeError(err)
+        self.connect_time = time.perf_counter() - connect_clock
+
+    def device(self, device_id):
+        # A DeviceStream on one device
+        self._check_device(device_id)
+        with self._read_lock:
+            self._released[device_id] = False
+        return DeviceStream(self, device_id)
+
+    def open_device(self, port, **sph_kwargs):
+        # Opens the port again, as a new SerialPacketHandler would, and
+        # returns a DeviceStream on it.  Takes the SerialPacketHandler
+        # arguments so it can stand in for it as a radar handler
+        # packet_handler, but they are ignored, the manager's own options
+        # apply.  Raises RuntimeError if the port did not open.
+        if port not in self.ports:
+            raise ValueError('%s is not a port of this manager' % (port,))
+        device_id = self.ports.index(port)
+        with self._write_lock:
+            request = self._reopen_requests[device_id] + 1
+            self._reopen_requests[device_id] = request
+        deadline = time.perf_counter() + self.connect_timeout
+        while self._reopen_done[device_id] != request:
+            if not self._mp.is_alive() or time.perf_counter() > deadline:
+                raise RuntimeError('Device %d %s not reopened' % (device_id, port))
+            time.sleep(0.005)
+        if not self.is_alive(device_id):
+            raise RuntimeError('Device %d %s is not open' % (device_id, port))
+        stream = self.device(device_id)
+        with self._read_lock:
+            self._pending[device_id].clear()
+        return stream
+
+    def read_packets(self, timeout=None):
+        # All waiting packets from every device as (device_id, packet),
+        # waiting up to timeout for the first one.  [] on timeout.
+        with self._read_lock:
+            if not any(self._pending):
+                self._read_batch(True, timeout)
+            while self._read_batch(False, None):
+                pass
+            packets = []
+            for device_id, pending in enumerate(self._pending):
+                packets.extend([(device_id, p) for p in pending])
+                pending.clear()
+        return packets
+
+    def read_device_packets(self, device_id, timeout=None, max_n=None):
+        # Waiting packets from one device, at most max_n.  Packets of other
+        # devices read along the way, and any past max_n, are kept.
+        self._check_device(device_id)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        pending = self._pending[device_id]
+        with self._read_lock:
+            while len(pending) == 0:
+                if deadline is None:
+                    wait = None
+                else:
+                    wait = deadline - time.perf_counter()
+                    if wait <= 0.0:
+                        break
+                self._read_batch(True, wait)
+            while self._read_batch(False, None):
+                pass
+            if max_n is None or len(pending) <= max_n:
+                packets = list(pending)
+                pending.clear()
+            else:
+                packets = [pending.popleft() for ii in range(0,max_n)]
+        return packets
+
+    def write_packet(self, device_id, packet, block=True, timeout=None):
+        # Returns the command id, or None if the packet was dropped
+        self._check_device(device_id)
+        with self._write_lock:
+            self._cmd_id = self._cmd_id + 1
+            cmd_id = self._cmd_id
+        try:
+            self.write_queue.put((device_id,cmd_id,time.perf_counter(),packet), block=block, timeout=timeout)
+        except (ValueError, AssertionError):
+            self.logger.debug('Write to closed queue')
+            raise ValueError('Write to closed queue')
+        except queue.Full:
+            self.logger.debug('Write times out on queue full')
+            return None
+        return cmd_id
+
+    def command_record(self, device_id, cmd_id, timeout=0.0):
+        # Timing of a written command, None if it is not written (yet)
+        self._check_device(device_id)
+        deadline = time.perf_counter() + timeout
+        while True:
+            self._collect_command_records()
+            record = self._command_records[device_id].get(cmd_id)
+            if record is not None or time.perf_counter() >= deadline:
+                return record
+            time.sleep(0.001)
+
+    def command_records(self, device_id):
+        # Most recent command records of one device, oldest first
+        self._check_device(device_id)
+        self._collect_command_records()
+        return list(self._command_records[device_id].values())
+
+    def latency_stats(self, device_id):
+        self._check_device(device_id)
+        self._collect_command_records()
+        return {'command':self._command_latency[device_id].snapshot(),
+                'delivery':self._delivery_latency[device_id].snapshot()}
+
+    def reset_latency_stats(self, device_id):
+        self._check_device(device_id)
+        self._command_latency[device_id].reset()
+        self._delivery_latency[device_id].reset()
+
+    def stats(self, device_id):
+        # Link counters of one device, with rates since the previous call
+        self._check_device(device_id)
+        return self._link_stats[device_id].snapshot()
+
+    def reset_stats(self, device_id):
+        self._check_device(device_id)
+        self._link_stats[device_id].reset()
+
+    def is_alive(self, device_id=None):
+        # The manager process, or one device in it
+        alive = self._mp.is_alive()
+        if device_id is not None:
+            self._check_device(device_id)
+            alive = alive and self._device_open[device_id] != 0
+        return alive
+
+    def join(self):
+        self.logger.debug('Process: Join Called')
+        packet.stop_child(self._mp, self._mp_keep_running, self.write_queue,
+                          (self.read_queue,self.write_done_queue))
+        self._log_forwarder.stop()
+        packet.close_queues((self.write_queue,self.read_queue,self.log_queue,self.write_done_queue),
+                            self.logger)
+        self.logger.debug('Process: Join Done')
+
+    def _check_device(self, device_id):
+        if device_id < 0 or device_id >= self.device_count:
+            raise ValueError('No device %d, have %d' % (device_id, self.device_count))
+
+    def _release_device(self, device_id):
+        # A DeviceStream was joined, drop the device's packets until the
+        # next device() or open_device()
+        with self._read_lock:
+            self._released[device_id] = True
+            self._pending[device_id].clear()
+
+    def _read_batch(self, block, timeout):
+        # Spread one batch over the per device pending lists.  Returns
+        # False if there was none.
+        try:
+            batch_clock, batch = self.read_queue.get(block,timeout)
+        except queue.Empty:
+            return False
+        except (ValueError, OSError):
+            self.logger.debug('Read from closed queue')
+            raise ValueError('Read from closed queue')
+        for device_id, packets in batch:
+            if self._released[device_id]:
+                continue
+            self._pending[device_id].extend(packets)
+            self._last_batch_clock[device_id] = batch_clock
+            if self.measure_latency:
+                self._delivery_latency[device_id].add(time.perf_counter() - batch_clock)
+        return True
+
+    def _collect_command_records(self):
+        with self._records_lock:
+            while True:
+                try:
+                    device_id, record = self.write_done_queue.get(block=False)
+                except (queue.Empty, ValueError, OSError):
+                    break
+                records = self._command_records[device_id]
+                records[record.cmd_id] = record
+                while len(records) > self._max_command_records:
+                    records.popitem(last=False)
+                self._command_latency[device_id].add(record.write_clock - record.enqueue_clock)
+
+    def _mp_startup(self):
+        self._mp_log_message(0,'Process: startup() called')
+        self._mp_write_lock = threading.Lock()
+
+        # One record per device: port, framer, counters
+        self._mp_devices = []
+        for device_id, port in enumerate(self.ports):
+            device = _device(device_id, port, None,
+                             PacketFramer(max_buf_len=self.max_buf_len, packet_sep=b'\x00',
+                                          max_frame_len=self.max_frame_len,
+                                          start_pattern=MSG_START_PATTERN),
+                             self._link_stats[device_id])
+            self._mp_open_device(device)
+            self._mp_devices.append(device)
+
+        self._mp_batch = collections.OrderedDict()
+        self._mp_batch_clock = None
+
+        # read_queue with the queue_policy applied, drops counted per device
+        self._mp_sender = BatchSender(self.read_queue, self.queue_policy, self._link_stats,
+                                      lambda entry: [(d, len(p)) for d, p in entry[1]],
+                                      self._mp_keep_running, self.spill_dir, self._mp_log_message)
+
+        self._mp_writer_keep_running = True
+        self._mp_writer_th = threading.Thread(target=self._mp_writer_thread,args=(),name='RadarWriter')
+        self._mp_writer_th.daemon = True
+        self._mp_writer_th.start()
+
+        self._mp_run_loop()
+
+    def _mp_open_device(self, device):
+        # Returns False if the port did not open
+        try:
+            # Reads never block, the selector does the waiting
+            serial_port = transport.open_transport(device.port, baudrate=self.baudrate, timeout=0, write_timeout=0.1)
+            serial_port.reset_input_buffer()
+            serial_port.reset_output_buffer()
+        except Exception as e:
+            self._mp_log_message(0,'Packet: %d %s failed to open, continuing without' % (device.device_id, device.port))
+            self._mp_log_message(1,str(e))
+            return False
+        device.framer.reset()
+        device.pollable = transport.pollable(serial_port)
+        with self._mp_write_lock:
+            device.serial_port = serial_port
+        self._device_open[device.device_id] = 1
+        self._mp_log_message(1,'Packet: %d %s open' % (device.device_id, device.port))
+        return True
+
+    def _mp_watch_device(self, device, selector, polled):
+        # Ports with a file descriptor wait in the selector, the others
+        # (replay://) are read on every pass
+        if device.pollable:
+            try:
+                selector.register(device.serial_port.fileno(), selectors.EVENT_READ, device)
+                return
+            except (ValueError, OSError):
+                pass
+        polled.append(device)
+
+    def _mp_run_loop(self):
+        self._mp_log_message(0,'Process: run_loop running')
+
+        selector = selectors.DefaultSelector()
+        polled = []
+        for device in self._mp_devices:
+            if device.serial_port is not None:
+                self._mp_watch_device(device, selector, polled)
+        reopen_clock = time.perf_counter()
+
+        self._mp_ready.set()
+        try:
+            while self._mp_keep_running.value != 0:
+                timeout = 0.1
+                if len(polled) > 0 or self._mp_sender.spool_count > 0:
+                    timeout = 0.01
+                if len(self._mp_batch) > 0:
+                    timeout = self._mp_batch_clock + self.batch_latency - time.perf_counter()
+                    timeout = min(max(timeout,0.0),0.1)
+
+                ready = [key.data for key, events in selector.select(timeout)]
+                for device in ready + polled:
+                    if self._device_open[device.device_id] == 0:
+                        continue
+                    try:
+                        self._mp_read_device(device)
+                    except serial.SerialException as e:
+                        self._mp_log_message(0,'Packet: %d %s error, closing it' % (device.device_id, device.port))
+                        self._mp_log_message(1,str(e))
+                        self._mp_close_device(device, selector, polled)
+
+                if self._mp_sender.spool_count > 0:
+                    self._mp_sender.unspill()
+
+                if len(self._mp_batch) > 0 and \
+                        time.perf_counter()-self._mp_batch_clock >= self.batch_latency:
+                    self._mp_send_batch()
+
+                for device in self._mp_devices:
+                    request = self._reopen_requests[device.device_id]
+                    if request != device.reopen_request:
+                        device.reopen_request = request
+                        if device.serial_port is not None:
+                            self._mp_close_device(device, selector, polled)
+                        if self._mp_open_device(device):
+                            self._mp_watch_device(device, selector, polled)
+                        self._reopen_done[device.device_id] = request
+
+                if time.perf_counter() - reopen_clock >= self.reopen_interval:
+                    reopen_clock = time.perf_counter()
+                    for device in self._mp_devices:
+                        if device.serial_port is None and self._mp_open_device(device):
+                            self._mp_watch_device(device, selector, polled)
+
+        except Exception as e:
+            self._mp_log_message(0,'Process: Error in run_loop, aborting')
+            self._mp_log_message(1,str(e))
+
+        self._mp_writer_keep_running = False
+        self._mp_writer_th.join()
+        self._mp_sender.close()
+
+        for device in self._mp_devices:
+            if device.serial_port is not None:
+                self._mp_close_device(device, selector, polled)
+        selector.close()
+
+        self._mp_log_message(0,'Process: run_loop process ended')
+
+    def _mp_read_device(self, device):
+        framer = device.framer
+        read_size = framer.free_space()
+        if device.pollable:
+            read_size = min(max(device.serial_port.in_waiting,1), read_size)
+        if read_size > 0:
+            read_bytes = device.serial_port.read(read_size)
+            if len(read_bytes) > 0:
+                framer.feed(read_bytes)
+                device.link_stats.add(LinkStats.BYTES_RECEIVED, len(read_bytes))
+
+        packets, errors = packet.decode_frames(framer, device.link_stats)
+        for e in errors:
+            self._mp_log_message(0,'Packet: %d COBS decode error, continuing' % (device.device_id,))
+            self._mp_log_message(1,str(e))
+
+        if len(packets) > 0:
+            if len(self._mp_batch) == 0:
+                self._mp_batch_clock = time.perf_counter()
+            self._mp_batch.setdefault(device.device_id, []).extend(packets)
+
+    def _mp_send_batch(self):
+        batch = []
+        counts = []
+        for device_id, packets in self._mp_batch.items():
+            counts.append((device_id, len(packets)))
+            if self.parse_in_child:
+                packets, errors = message.parse_stream(packets)
+                if len(errors) > 0:
+                    self._link_stats[device_id].add(LinkStats.PARSE_ERRORS, len(errors))
+                if len(packets) == 0:
+                    continue
+            batch.append((device_id, packets))
+        self._mp_batch = collections.OrderedDict()
+        if len(batch) > 0:
+            self._mp_sender.send((self._mp_batch_clock,batch), counts)
+
+    def _mp_close_device(self, device, selector, polled):
+        self._device_open[device.device_id] = 0
+        if device in polled:
+            polled.remove(device)
+        else:
+            try:
+                selector.unregister(device.serial_port.fileno())
+            except (KeyError, ValueError, OSError):
+                pass
+        with self._mp_write_lock:
+            try:
+                device.serial_port.close()
+            except serial.SerialException:
+                self._mp_log_message(0,'Process: %d close failed' % (device.device_id,))
+            device.serial_port = None
+
+    def _mp_writer_thread(self):
+        # Commands for every device are written from this one thread
+        while self._mp_writer_keep_running:
+            try:
+                item = self.write_queue.get(block=True, timeout=0.1)
+            except queue.Empty:
+                continue
+            except (ValueError, OSError):
+                break
+            if item is None:
+                # join() is shutting the child down
+                break
+            device_id, cmd_id, enqueue_clock, data = item
+            dequeue_clock = time.perf_counter()
+            device = self._mp_devices[device_id]
+            with self._mp_write_lock:
+                status = packet.SerialPacketHandler.WRITE_ERROR
+                if device.serial_port is not None:
+                    try:
+                        if packet.write_frame(device.serial_port, data, device.link_stats):
+                            status = packet.SerialPacketHandler.WRITE_OK
+                        else:
+                            status = packet.SerialPacketHandler.WRITE_TIMEOUT
+                            self._mp_log_message(0,'Packet: %d write timeout, continuing' % (device_id,))
+                    except serial.SerialException as e:
+                        # The read side notices and closes the device
+                        self._mp_log_message(0,'Packet: %d write error: %s' % (device_id, e))
+            record = command_record(cmd_id, enqueue_clock, dequeue_clock, time.perf_counter(), status)
+            try:
+                self.write_done_queue.put((device_id, record), block=False)
+            except queue.Full:
+                # Nobody is collecting records
+                pass
+
+    def _mp_log_message(self, level, msg):
+        if level <= self.max_log_level:
+            packet.put_log(self.log_queue, msg, self.logger)
+
+
+@dataclass(eq=False)
+class _device:
+    # Child side state of one port
+    device_id: int
+    port: str
+    serial_port: object
+    framer: PacketFramer
+    link_stats: LinkStats
+    pollable: bool = False
+    # Last RadarManager._reopen_requests count handled
+    reopen_request: int = 0
+
+
+class DeviceStream(object):
+    # One device of a RadarManager with the SerialPacketHandler calls the
+    # radar handlers use, see RadarManager.open_device().  join() lets go of
+    # the device, not of the manager, its packets are dropped from then on
+    # until the next device() or open_device().
+    def __init__(self, manager, device_id):
+        self.manager = manager
+        self.device_id = device_id
+        self.port = manager.ports[device_id]
+        self.ring = None
+        self._joined = False
+
+    @property
+    def last_batch_clock(self):
+        # When the child read the newest batch taken, perf_counter()
+        return self.manager._last_batch_clock[self.device_id]
+
+    def read_packet(self, block=True, timeout=None):
+        packets = self.manager.read_device_packets(self.device_id, timeout if block else 0.0, max_n=1)
+        if len(packets) == 0:
+            raise queue.Empty()
+        return packets[0]
+
+    def read_packets(self, max_n=None, timeout=None):
+        return self.manager.read_device_packets(self.device_id, timeout, max_n)
+
+    def write_packet(self, packet, block=True, timeout=None):
+        return self.manager.write_packet(self.device_id, packet, block=block, timeout=timeout)
+
+    def command_record(self, cmd_id, timeout=0.0):
+        return self.manager.command_record(self.device_id, cmd_id, timeout)
+
+    def command_records(self):
+        return self.manager.command_records(self.device_id)
+
+    def latency_stats(self):
+        return self.manager.latency_stats(self.device_id)
+
+    def reset_latency_stats(self):
+        self.manager.reset_latency_stats(self.device_id)
+
+    def stats(self):
+        return self.manager.stats(self.device_id)
+
+    def reset_stats(self):
+        self.manager.reset_stats(self.device_id)
+
+    def is_alive(self):
+        return not self._joined and self.manager.is_alive(self.device_id)
+
+    def join(self):
+        if not self._joined:
+            self._joined = True
+            self.manager._release_device(self.device_id)
@@ -19,6 +19,16 @@ MSG_TYPE_HEARTBEAT = 0
 MSG_TYPE_LOG = 1
 MSG_TYPE_REPLY = 2
 MSG_TYPE_PULSE = 3
+# Pulse with 12 bit samples packed two to three bytes, see pack12().  The
+# parsers shift the samples up to 16 bit full scale like MSG_TYPE_PULSE.
+MSG_TYPE_PULSE12 = 4
+PULSE12_SHIFT = 4
+
+# Largest pulse the firmware buffers, in samples
+MSG_MAX_DATA_SIZE = 2048
+
+# pulse_cycle_count is the Teensy 3.6 CPU cycle counter
+CPU_CLOCK_HZ = 180e6
 
 # Logging levels
 LOG_DEBUG = 0,
@@ -26,29 +36,48 @@ LOG_INFO = 1,
 LOG_WARN = 2,
 LOG_ERROR = 3
 
+# Wire formats, compiled once
+MSG_COMMON_HEADER = struct.Struct('IHH')
+MSG_HEARTBEAT = struct.Struct('I')
+MSG_LOG_HEADER = struct.Struct('BB')
+MSG_REPLY_HEADER = struct.Struct('h')
+MSG_PULSE_HEADER = struct.Struct('HHIIIHHfff')
+_PULSE_DATA_SIZE = struct.Struct('H')
+
+SAMPLE_DTYPE = np.dtype('<u2')
+
+# The message classes use __slots__, there can be thousands of them a
+# second and a per instance __dict__ is most of their size.
+
 @dataclass
 class msg_common_header:
+    __slots__ = ('unique_word', 'msg_size', 'msg_type')
     unique_word: int
     msg_size: int
     msg_type: int
 
 @dataclass
 class msg_heartbeat:
+    __slots__ = ('time_stamp',)
     time_stamp: int
 
 @dataclass
 class msg_log:
+    __slots__ = ('category', 'level', 'message')
     category: int
     level: int
     message: str
 
 @dataclass
 class msg_reply:
+    __slots__ = ('status', 'message')
     status: int
     message: str
 
 @dataclass
 class msg_pulse_header:
+    __slots__ = ('hdr_size', 'data_size', 'pulse_number', 'pulse_cycle_count', 'status',
+                 'gain', 'pulse_length_ms', 'freq_start', 'freq_stop', 'freq_return')
     hdr_size: int
     data_size: int
     pulse_number: int
@@ -60,36 +89,328 @@ class msg_pulse_header:
     freq_stop: float
     freq_return: float
 
+class msg_pulse(object):
+    # A pulse, header and data.  Built by msg_pulse(header, data), or by
+    # msg_pulse.from_buffer(buf, offset) which keeps a reference to the
+    # buffer holding the payload at offset and decodes the header on first
+    # access.  data is then a read only view on the buffer, no copy.  A
+    # consumer that keeps the pulse after the buffer is reused (shared ring
+    # slots) must call detach().
+    #
+    # acq_clock is the host time.perf_counter() of the acquisition, set by
+    # the handler from clocksync.ClockSync, None if it is not known.
+    __slots__ = ('_buf', '_offset', '_header', '_data', 'acq_clock')
+
+    def __init__(self, header, data, acq_clock=None):
+        self._buf = None
+        self._offset = 0
+        self._header = header
+        self._data = data
+        self.acq_clock = acq_clock
+
+    @classmethod
+    def from_buffer(cls, buf, offset=0):
+        # Raises ValueError if the payload does not hold the data_size
+        # samples its header says, like the MSG_TYPE_PULSE12 parser
+        size = len(buf) - offset
+        if size < 32:
+            raise ValueError('Bad pulse payload size %d' % (size,))
+        data_size, = _PULSE_DATA_SIZE.unpack_from(buf, offset+2)
+        if size != 32 + 2*data_size:
+            raise ValueError('Bad pulse size %d for %d samples' % (size, data_size))
+        pulse = cls.__new__(cls)
+        pulse._buf = buf
+        pulse._offset = offset
+        pulse._header = None
+        pulse._data = None
+        pulse.acq_clock = None
+        return pulse
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = msg_pulse_header(*MSG_PULSE_HEADER.unpack_from(self._buf, self._offset))
+        return self._header
+
+    @header.setter
+    def header(self, header):
+        self._header = header
+
+    @property
+    def data(self):
+        if self._data is None:
+            data = np.frombuffer(self._buf,dtype=SAMPLE_DTYPE,offset=self._offset+32)
+            # The buffer may be a bytearray
+            data.flags.writeable = False
+            self._data = data
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    def detach(self):
+        # Decode the header, copy the data and let go of the payload
+        # buffer.  Returns self.
+        if self._buf is not None:
+            self._header = self.header
+            self._data = self.data.copy()
+            self._buf = None
+        return self
+
+    def __repr__(self):
+        return 'msg_pulse(header=%r, data=%r)' % (self.header, self.data)
+
+    def __reduce__(self):
+        return (msg_pulse, (self.header, self.data, self.acq_clock))
+
+@dataclass
+class msg_gap:
+    # Not from the radar.  Marks a gap in the pulse stream where the
+    # handler lost the radar and reconnected.  Pulse numbers start over
+    # after it if the radar was reset.
+    __slots__ = ('lost_clock', 'restored_clock', 'last_pulse_number', 'port')
+    lost_clock: float
+    restored_clock: float
+    last_pulse_number: int
+    port: str
+
+# msg_pulse_header as a numpy record, 32 bytes like 'HHIIIHHfff'
+PULSE_HEADER_DTYPE = np.dtype([('hdr_size','<u2'), ('data_size','<u2'),
+                               ('pulse_number','<u4'), ('pulse_cycle_count','<u4'),
+                               ('status','<u4'), ('gain','<u2'),
+                               ('pulse_length_ms','<u2'), ('freq_start','<f4'),
+                               ('freq_stop','<f4'), ('freq_return','<f4')])
+
 @dataclass
-class msg_pulse:
-    header: msg_pulse_header
+class msg_pulse_block:
+    # Consecutive pulses with the same data_size.  headers is a
+    # PULSE_HEADER_DTYPE array, data is pulses x data_size uint16.
+    __slots__ = ('headers', 'data')
+    headers: np.ndarray
     data: np.ndarray
 
-def parse_payload(msg_type, payload):
+    def __len__(self):
+        return len(self.headers)
+
+    def pulses(self):
+        # The block as msg_pulse objects, data rows are views into the block
+        return [msg_pulse(msg_pulse_header(*header), data)
+                for header, data in zip(self.headers.tolist(), self.data)]
+
+    def __reduce__(self):
+        # Pickle as the raw records, far cheaper to send between processes
+        # than two arrays
+        records = np.empty(len(self.headers), dtype=_pulse_block_dtype(self.data.shape[1]))
+        records['header'] = self.headers
+        records['data'] = self.data
+        return (pulse_block_from_buffer, (records.tobytes(), self.data.shape[1]))
+
+def max_encoded_size(data_size=MSG_MAX_DATA_SIZE):
+    # Longest COBS encoded pulse message with data_size samples, without the
+    # delimiter.  COBS adds at most one byte per 254 bytes.
+    size = 8 + 32 + 2*data_size
+    return size + size//254 + 1
+
+def packed12_size(data_size):
+    # Bytes holding data_size packed 12 bit samples
+    return 3*((data_size+1)//2)
+
+def pack12(samples):
+    # uint16 samples (< 4096) packed little endian, two samples to three
+    # bytes:  s0[7:0]  s1[3:0]s0[11:8]  s1[11:4].  An odd sample count is
+    # padded with a zero sample.
+    samples = np.asarray(samples, dtype=np.uint16)
+    if len(samples) > 0 and samples.max() > 0xFFF:
+        raise ValueError('Sample %d does not fit in 12 bits' % (samples.max(),))
+    if len(samples) % 2:
+        samples = np.append(samples, np.uint16(0))
+    pairs = samples.reshape(-1,2)
+    packed = np.empty((len(pairs),3), dtype=np.uint8)
+    packed[:,0] = pairs[:,0] & 0xFF
+    packed[:,1] = (pairs[:,0] >> 8) | ((pairs[:,1] & 0x0F) << 4)
+    packed[:,2] = pairs[:,1] >> 4
+    return packed.tobytes()
+
+def unpack12(packed, data_size):
+    # Inverse of pack12().  packed is bytes like, or a uint8 array whose last
+    # axis holds the packed bytes of one pulse.  Returns uint16 samples with
+    # data_size on the last axis.
+    packed = np.frombuffer(packed, dtype=np.uint8) if not isinstance(packed, np.ndarray) else packed
+    nbytes = packed12_size(data_size)
+    triples = packed[...,0:nbytes].reshape(packed.shape[:-1] + (-1,3))
+    b0 = triples[...,0].astype(np.uint16)
+    b1 = triples[...,1].astype(np.uint16)
+    b2 = triples[...,2].astype(np.uint16)
+    samples = np.empty(packed.shape[:-1] + (2*triples.shape[-2],), dtype=np.dtype('<u2'))
+    samples[...,0::2] = b0 | ((b1 & 0x0F) << 8)
+    samples[...,1::2] = (b1 >> 4) | (b2 << 4)
+    return samples[...,0:data_size]
+
+def _parse_heartbeat(buf, offset):
+    return msg_heartbeat(*MSG_HEARTBEAT.unpack_from(buf, offset))
+
+def _parse_log(buf, offset):
+    category, level = MSG_LOG_HEADER.unpack_from(buf, offset)
+    return msg_log(category,level,bytes(buf[offset+2:]))
+
+def _parse_reply(buf, offset):
+    status, = MSG_REPLY_HEADER.unpack_from(buf, offset)
+    return msg_reply(status,bytes(buf[offset+2:]))
+
+def _parse_pulse(buf, offset):
+    return msg_pulse.from_buffer(buf, offset)
+
+def _parse_pulse12(buf, offset):
+    header = msg_pulse_header(*MSG_PULSE_HEADER.unpack_from(buf, offset))
+    if len(buf) - offset != 32 + packed12_size(header.data_size):
+        raise ValueError('Bad packed pulse size %d for %d samples' % (len(buf) - offset, header.data_size))
+    data = unpack12(memoryview(buf)[offset+32:], header.data_size)
+    data <<= PULSE12_SHIFT
+    return msg_pulse(header,data)
+
+# msg_type -> parser(buf, offset) for the payload at offset in buf
+PAYLOAD_PARSERS = {
+    MSG_TYPE_HEARTBEAT: _parse_heartbeat,
+    MSG_TYPE_LOG: _parse_log,
+    MSG_TYPE_REPLY: _parse_reply,
+    MSG_TYPE_PULSE: _parse_pulse,
+    MSG_TYPE_PULSE12: _parse_pulse12,
+}
+
+def _parse_at(msg_type, buf, offset):
     # Create class by type
-    if msg_type == MSG_TYPE_HEARTBEAT:
-         return msg_heartbeat(*struct.unpack('I',payload[0:4]))
-    elif msg_type == MSG_TYPE_LOG:
-        category, level = struct.unpack('BB',payload[0:2])
-        message = payload[2:]
-        return msg_log(category,level,message)
-    elif msg_type == MSG_TYPE_REPLY:
-        status, = struct.unpack('h',payload[0:2])
-        message = payload[2:]
-        return msg_reply(status,message)
-    elif msg_type == MSG_TYPE_PULSE:
-        header = msg_pulse_header(*struct.unpack('HHIIIHHfff',payload[0:32]))
-        data = np.frombuffer(payload[32:],dtype=np.dtype('<u2'))
-        return msg_pulse(header,data)
-    else:
+    try:
+        parser = PAYLOAD_PARSERS[msg_type]
+    except KeyError:
         # Unexpected Packet
-        err = 'Unexpected packed type=%d.  Ignoring: "%s"' % (msg_type, str(payload),)
+        err = 'Unexpected packed type=%d.  Ignoring: "%s"' % (msg_type, str(bytes(buf[offset:])),)
         raise ValueError(err)
+    return parser(buf, offset)
+
+def parse_payload(msg_type, payload):
+    return _parse_at(msg_type, payload, 0)
+
+def _pulse_block_dtype(data_size):
+    return np.dtype([('header',PULSE_HEADER_DTYPE), ('data','<u2',(data_size,))])
+
+def pulse_block_from_buffer(buf, data_size):
+    # Back to back pulse payloads with data_size samples each
+    records = np.frombuffer(buf, dtype=_pulse_block_dtype(data_size))
+    return msg_pulse_block(records['header'], records['data'])
+
+def parse_pulse_block(payloads, data_size, msg_type=MSG_TYPE_PULSE):
+    # Pulse payloads that all hold data_size samples, as one msg_pulse_block
+    if msg_type == MSG_TYPE_PULSE12:
+        dtype = np.dtype([('header',PULSE_HEADER_DTYPE), ('data','u1',(packed12_size(data_size),))])
+        records = np.frombuffer(b''.join(payloads), dtype=dtype)
+        data = unpack12(records['data'], data_size)
+        data <<= PULSE12_SHIFT
+        return msg_pulse_block(records['header'], data)
+    return pulse_block_from_buffer(b''.join(payloads), data_size)
+
+def _pulse_key(msg):
+    # Checks the common header of msg.  Returns (data_size, msg_type) if
+    # msg is a well formed pulse, None for any other message.
+    try:
+        unique_word, msg_size, msg_type = MSG_COMMON_HEADER.unpack_from(msg)
+    except struct.error:
+        raise ValueError('Cannot parse common header')
+    if unique_word != MSG_UNIQUE_WORD:
+        raise ValueError('Bad message unique_word')
+    if msg_size != len(msg)-8:
+        raise ValueError('Bad message size' + str(msg_common_header(unique_word, msg_size, msg_type)))
+    if msg_type in (MSG_TYPE_PULSE, MSG_TYPE_PULSE12) and msg_size >= 32:
+        data_size = MSG_PULSE_HEADER.unpack_from(msg, 8)[1]
+        if msg_type == MSG_TYPE_PULSE:
+            expected = 32 + 2*data_size
+        else:
+            expected = 32 + packed12_size(data_size)
+        if msg_size == expected:
+            return (data_size, msg_type)
     return None
 
+def parse_stream(msgs):
+    # Parses a list of messages in order.  Runs of pulses with the same
+    # type and data_size come back as a single msg_pulse_block (unpacked to
+    # 16 bit scale for MSG_TYPE_PULSE12), everything else as
+    # from parse_message().  Returns (parsed, errors), messages that do not
+    # parse are left out and listed in errors as strings.
+    parsed = []
+    errors = []
+    run = []
+    run_key = None
+    for msg in msgs:
+        try:
+            key = _pulse_key(msg)
+            if key is not None:
+                if key != run_key and len(run) > 0:
+                    parsed.append(parse_pulse_block(run, *run_key))
+                    run = []
+                run.append(memoryview(msg)[8:])
+                run_key = key
+                continue
+            item = parse_message(msg)
+        except (ValueError, struct.error) as e:
+            errors.append(str(e))
+            continue
+        if len(run) > 0:
+            parsed.append(parse_pulse_block(run, *run_key))
+            run = []
+        parsed.append(item)
+    if len(run) > 0:
+        parsed.append(parse_pulse_block(run, *run_key))
+    return parsed, errors
+
+def parse_messages(frames):
+    # Parses a batch of messages for block processing.  Every pulse comes
+    # back as a row of headers, a PULSE_HEADER_DTYPE record array, and of
+    # data, a pulses x data_size uint16 matrix, in arrival order
+    # (MSG_TYPE_PULSE12 unpacked to 16 bit scale).  If data_size changes
+    # within the batch data is as wide as the largest pulse, shorter rows
+    # are zero padded and headers['data_size'] gives their length.  Heartbeats, logs and
+    # replies are parsed and returned in order in others.  Returns
+    # (headers, data, others, errors), errors as for parse_stream().
+    groups = {}
+    others = []
+    errors = []
+    count = 0
+    for msg in frames:
+        try:
+            key = _pulse_key(msg)
+            if key is None:
+                others.append(parse_message(msg))
+                continue
+        except (ValueError, struct.error) as e:
+            errors.append(str(e))
+            continue
+        if key not in groups:
+            groups[key] = ([], [])
+        payloads, rows = groups[key]
+        payloads.append(memoryview(msg)[8:])
+        rows.append(count)
+        count = count + 1
+
+    if len(groups) == 0:
+        return np.empty(0, dtype=PULSE_HEADER_DTYPE), np.empty((0,0), dtype=SAMPLE_DTYPE), others, errors
+    if len(groups) == 1:
+        # The usual case, one pulse configuration
+        key, (payloads, rows) = groups.popitem()
+        block = parse_pulse_block(payloads, *key)
+        return block.headers, block.data, others, errors
+
+    width = max(data_size for data_size, msg_type in groups)
+    headers = np.empty(count, dtype=PULSE_HEADER_DTYPE)
+    data = np.zeros((count, width), dtype=SAMPLE_DTYPE)
+    for (data_size, msg_type), (payloads, rows) in groups.items():
+        block = parse_pulse_block(payloads, data_size, msg_type)
+        headers[rows] = block.headers
+        data[rows,0:data_size] = block.data
+    return headers, data, others, errors
+
 def parse_common_header(header_bytes):
     try:
-        header = msg_common_header(*struct.unpack('IHH',header_bytes))
+        header = msg_common_header(*MSG_COMMON_HEADER.unpack(header_bytes))
     except Exception as e:
         raise ValueError('Cannot parse common header')
     if header.unique_word != MSG_UNIQUE_WORD:
@@ -97,7 +418,14 @@ def parse_common_header(header_bytes):
     return header
 
 def parse_message(msg):
-    header = parse_common_header(msg[0:8])
-    if header.msg_size != len(msg)-8:
-        raise ValueError('Bad message size' + str(header))
-    return parse_payload(header.msg_type, msg[8:])
+    # Same checks as parse_common_header() without building the header
+    try:
+        unique_word, msg_size, msg_type = MSG_COMMON_HEADER.unpack_from(msg)
+    except struct.error:
+        raise ValueError('Cannot parse common header')
+    if unique_word != MSG_UNIQUE_WORD:
+        raise ValueError('Bad message unique_word')
+    if msg_size != len(msg)-8:
+        raise ValueError('Bad message size' + str(msg_common_header(unique_word, msg_size, msg_type)))
+    # Parsed in place, pulses keep msg rather than a copy of the payload
+    return _parse_at(msg_type, msg, 8)
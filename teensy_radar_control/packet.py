@@ -5,13 +5,18 @@ Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
 @author: ER17450
 """
 import logging
-import sys, platform, os, time
+import sys, platform, os, time, struct, select
+import pickle, tempfile
 
 import serial
 from cobs import cobs
 
-import psutil
 import threading, queue
+import collections
+from dataclasses import dataclass
+
+from teensy_radar_control import message, transport, capture, scheduling
+from teensy_radar_control.shared_ring import SharedPulseRing
 
 # The Spyder IDE does not work consistantly with multiprocessing.
 # If launched from cmd it works.  Some other IDEs are also reported to work.
@@ -34,25 +39,722 @@ else:
     logger.info('Using multiprocessing')
     import multiprocessing as mp
 
+# Every COBS encoded message starts with a code byte and then the unique
+# word, which has no zero bytes so COBS leaves it as is
+MSG_START_PATTERN = struct.pack('I', message.MSG_UNIQUE_WORD)
+
+class PacketFramer(object):
+    # Splits a byte stream into 0x00 delimited COBS frames.
+    #
+    # Data is appended to a preallocated bytearray and the delimiter scan
+    # resumes where the previous scan stopped, so every byte is copied in
+    # once and scanned once.  All complete frames are returned by a single
+    # call to frames().
+    #
+    # A partial frame longer than max_frame_len can not be valid, the
+    # delimiter was lost.  The framer resyncs: if start_pattern (the encoded
+    # bytes every frame starts with, after the first code byte) shows up
+    # in the partial frame, it is split there.  Otherwise the partial frame
+    # and the rest of the stream up to the next delimiter or start_pattern
+    # are dropped.  Without max_frame_len this happens when the buffer is
+    # full.
+    #
+    # feed() never drops data.  If more than free_space() is fed the buffer
+    # grows, frames() then splits or resyncs (counted in resync_count and
+    # discarded_bytes) whatever is too long to be a frame.
+    #
+    def __init__(self, max_buf_len=6000, packet_sep=b'\x00', max_frame_len=None,
+                 start_pattern=None):
+        if max_frame_len is None:
+            max_frame_len = max_buf_len - 1
+        if max_frame_len >= max_buf_len:
+            raise ValueError('max_frame_len must be less than max_buf_len')
+        self.max_buf_len = max_buf_len
+        self.max_frame_len = max_frame_len
+        self.packet_sep = packet_sep
+        self.start_pattern = start_pattern
+
+        self._buf = bytearray(max_buf_len)
+        self._view = memoryview(self._buf)
+
+        # Unconsumed data lives in _buf[_head:_tail].  _buf[_head:_scan]
+        # has already been searched for a delimiter.
+        self._head = 0
+        self._scan = 0
+        self._tail = 0
+
+        # Dropping data up to the next delimiter or frame start
+        self._skipping = False
+
+        self.resync_count = 0
+        self.discarded_bytes = 0
+
+    def buffered(self):
+        return self._tail - self._head
+
+    def free_space(self):
+        return max(self.max_buf_len - self.buffered(), 0)
+
+    def reset(self):
+        self._head = 0
+        self._scan = 0
+        self._tail = 0
+
+    def feed(self, data):
+        # Returns the number of bytes accepted, always len(data).  Callers
+        # should size their reads with free_space() so the buffer does not
+        # have to grow.
+        size = len(data)
+        if self._tail + size > len(self._buf):
+            self._compact()
+            if self._tail + size > len(self._buf):
+                self._grow(self._tail + size)
+        self._view[self._tail:self._tail+size] = data
+        self._tail = self._tail + size
+        return size
+
+    def frames(self):
+        frames = []
+        buf = self._buf
+        head = self._head
+        tail = self._tail
+
+        # Only the bytes that arrived since the last call need scanning
+        idx = buf.find(self.packet_sep, self._scan, tail)
+        if self._skipping:
+            start = self._find_start(head, tail if idx < 0 else idx)
+            if start >= 0:
+                # Back in sync at this frame start
+                self.discarded_bytes = self.discarded_bytes + start - head
+                self._skipping = False
+                head = start
+            elif idx >= 0:
+                # Back in sync after this delimiter
+                self.discarded_bytes = self.discarded_bytes + idx - head
+                self._skipping = False
+                head = idx + 1
+                idx = buf.find(self.packet_sep, head, tail)
+            else:
+                self.discarded_bytes = self.discarded_bytes + tail - head
+                self.reset()
+                return frames
+
+        while idx >= 0:
+            # Back to back delimiters are empty frames, skip them
+            if idx > head:
+                frames.append(buf[head:idx])
+            head = idx + 1
+            idx = buf.find(self.packet_sep, head, tail)
+
+        # Too long without finding a delimiter, resync
+        while tail - head > self.max_frame_len:
+            self.resync_count = self.resync_count + 1
+            start = self._find_start(head + 1, tail)
+            if start < 0:
+                self.discarded_bytes = self.discarded_bytes + tail - head
+                self._skipping = True
+                head = tail
+                break
+            # The delimiter before this frame start was lost
+            frames.append(buf[head:start])
+            head = start
+
+        self._head = head
+        self._scan = tail
+
+        if head == tail:
+            # Everything consumed, start over at the front of the buffer
+            self.reset()
+
+        return frames
+
+    def _find_start(self, start, stop):
+        # Position of the code byte of the first frame start in
+        # _buf[start:stop], -1 if there is none
+        if self.start_pattern is None:
+            return -1
+        pos = self._buf.find(self.start_pattern, start + 1, stop)
+        if pos < 0:
+            return -1
+        return pos - 1
+
+    def _compact(self):
+        # Move the partial frame to the front of the buffer.  This copies
+        # at most one frame per pass through the buffer.
+        size = self._tail - self._head
+        if self._head > 0:
+            self._view[0:size] = self._view[self._head:self._tail]
+            self._scan = self._scan - self._head
+            self._head = 0
+            self._tail = size
+
+    def _grow(self, size):
+        # Only when fed more than free_space(), frames() brings the buffered
+        # data back under max_frame_len
+        buf = bytearray(max(size, 2*len(self._buf)))
+        buf[0:self._tail] = self._view[0:self._tail]
+        self._view.release()
+        self._buf = buf
+        self._view = memoryview(buf)
+
+
+def split_merged(packet):
+    # A lost delimiter merges two frames, and COBS decodes the pair as the
+    # first message, a 0x00 (none if the last block was full), then the
+    # second message.  The common header sizes tell where to split them.
+    # Returns a list of packets, just [packet] when nothing was merged.
+    size = len(packet)
+    if size < 8:
+        return [packet]
+    unique_word, msg_size = struct.unpack_from('IH', packet, 0)
+    if unique_word != message.MSG_UNIQUE_WORD or 8 + msg_size >= size:
+        return [packet]
+
+    packets = []
+    start = 0
+    while size - start >= 8:
+        unique_word, msg_size = struct.unpack_from('IH', packet, start)
+        end = start + 8 + msg_size
+        if unique_word != message.MSG_UNIQUE_WORD or end >= size:
+            break
+        if packet[end] == 0 and _is_message_start(packet, end+1):
+            packets.append(packet[start:end])
+            start = end + 1
+        elif _is_message_start(packet, end):
+            packets.append(packet[start:end])
+            start = end
+        else:
+            break
+    packets.append(packet[start:])
+    return packets
+
+def _is_message_start(packet, pos):
+    if len(packet) - pos < 8:
+        return False
+    unique_word, = struct.unpack_from('I', packet, pos)
+    return unique_word == message.MSG_UNIQUE_WORD
+
+
+class LatencyStats(object):
+    # Count, sum, min and max of a latency in seconds.  The values can live
+    # in a shared mp.Array so one process records and another reads.
+    def __init__(self, values=None):
+        if values is None:
+            values = [0.0]*4
+        self._values = values
+        self.reset()
+
+    def reset(self):
+        # Item by item, multiprocessing.dummy.Array is an array.array
+        for ii, val in enumerate((0.0, 0.0, float('inf'), 0.0)):
+            self._values[ii] = val
+
+    def add(self, dt):
+        v = self._values
+        v[0] = v[0] + 1
+        v[1] = v[1] + dt
+        if dt < v[2]: v[2] = dt
+        if dt > v[3]: v[3] = dt
+
+    def add_many(self, dts):
+        # A numpy array of latencies at once
+        if len(dts) == 0:
+            return
+        v = self._values
+        v[0] = v[0] + len(dts)
+        v[1] = v[1] + float(dts.sum())
+        v[2] = min(v[2], float(dts.min()))
+        v[3] = max(v[3], float(dts.max()))
+
+    def snapshot(self):
+        count, total, dt_min, dt_max = self._values[0:4]
+        if count == 0:
+            return {'count':0, 'mean':None, 'min':None, 'max':None}
+        return {'count':int(count), 'mean':total/count, 'min':dt_min, 'max':dt_max}
+
+
+class LinkStats(object):
+    # Link counters.  Like LatencyStats the values can live in a shared
+    # mp.Array, one process counts and another takes snapshots.  Each
+    # counter has a single writer so the array needs no lock.  Some are
+    # set to running totals kept elsewhere (resyncs, ring overflows, ...),
+    # so reset() leaves the values alone and only moves the zero of the
+    # counts reported on its own side.
+    BYTES_RECEIVED = 0
+    FRAMES_DECODED = 1
+    COBS_ERRORS = 2
+    RESYNCS = 3
+    QUEUE_FULL_DROPS = 4
+    RING_OVERFLOWS = 5
+    WRITE_TIMEOUTS = 6
+    WRITE_ERRORS = 7
+    LOOP_ITERATIONS = 8
+    DISCARDED_BYTES = 9
+    MERGED_SPLITS = 10
+    CAPTURE_DROPS = 11
+    PARSE_ERRORS = 12
+    QUEUE_OLDEST_DROPS = 13
+    QUEUE_BLOCKED_SECONDS = 14
+    SPILLED_PACKETS = 15
+    UNSPILLED_PACKETS = 16
+    SPOOL_BYTES = 17
+    NAMES = ('bytes_received', 'frames_decoded', 'cobs_errors',
+             'resyncs', 'queue_full_drops', 'ring_overflows',
+             'write_timeouts', 'write_errors', 'loop_iterations',
+             'discarded_bytes', 'merged_splits', 'capture_drops',
+             'parse_errors', 'queue_oldest_drops', 'queue_blocked_seconds',
+             'spilled_packets', 'unspilled_packets', 'spool_bytes')
+    # Levels rather than counts, not zeroed by reset()
+    GAUGES = (SPOOL_BYTES,)
+    # Seconds rather than counts, reported as float
+    SECONDS = (QUEUE_BLOCKED_SECONDS,)
+
+    def __init__(self, values=None):
+        if values is None:
+            values = [0.0]*len(self.NAMES)
+        self._values = values
+        for ii in range(0,len(self.NAMES)):
+            self._values[ii] = 0.0
+        self.reset()
+
+    def reset(self):
+        values = list(self._values[0:len(self.NAMES)])
+        self._offsets = [0.0 if ii in self.GAUGES else value
+                         for ii, value in enumerate(values)]
+        self._last_clock = time.perf_counter()
+        self._last_counts = [value - offset for value, offset in zip(values, self._offsets)]
+
+    def add(self, index, count=1):
+        self._values[index] = self._values[index] + count
+
+    def set(self, index, value):
+        self._values[index] = value
+
+    def snapshot(self):
+        # Counts so far, and rates per second since the previous snapshot
+        clock = time.perf_counter()
+        counts = [value - offset for value, offset
+                  in zip(self._values[0:len(self.NAMES)], self._offsets)]
+        dt = clock - self._last_clock
+        stats = {'interval':dt, 'counts':{}, 'rates':{}}
+        for ii, (name, count, last) in enumerate(zip(self.NAMES, counts, self._last_counts)):
+            stats['counts'][name] = count if ii in self.SECONDS else int(count)
+            stats['rates'][name] = (count - last)/dt if dt > 0.0 else 0.0
+        self._last_clock = clock
+        self._last_counts = counts
+        return stats
+
+
+@dataclass
+class command_record:
+    cmd_id: int
+    enqueue_clock: float
+    dequeue_clock: float
+    write_clock: float
+    status: int
+
+    def queue_latency(self):
+        return self.dequeue_clock - self.enqueue_clock
+
+    def write_latency(self):
+        return self.write_clock - self.dequeue_clock
+
+
+def decode_frames(framer, link_stats):
+    # Child side.  Takes every complete frame out of framer, COBS decodes
+    # it and splits frames merged by a lost delimiter, counting it all in
+    # link_stats.  Returns (packets, decode errors).
+    frames = framer.frames()
+    link_stats.set(LinkStats.RESYNCS, framer.resync_count)
+    link_stats.set(LinkStats.DISCARDED_BYTES, framer.discarded_bytes)
+
+    packets = []
+    errors = []
+    for dat in frames:
+        try:
+            decoded = cobs.decode(dat)
+        except cobs.DecodeError as e:
+            errors.append(e)
+            continue
+        # Recover frames merged by a lost delimiter
+        split = split_merged(decoded)
+        if len(split) > 1:
+            link_stats.add(LinkStats.MERGED_SPLITS, len(split) - 1)
+        packets.extend(split)
+
+    if len(errors) > 0:
+        link_stats.add(LinkStats.COBS_ERRORS, len(errors))
+    if len(frames) > 0:
+        link_stats.add(LinkStats.FRAMES_DECODED, len(frames) - len(errors))
+    return packets, errors
+
+def write_frame(serial_port, packet, link_stats):
+    # Child side.  COBS encodes and writes one packet.  Returns False on a
+    # write timeout, raises serial.SerialException on other errors, both
+    # counted in link_stats.
+    try:
+        serial_port.write(cobs.encode(packet) + b'\x00')
+        serial_port.flush()
+    except serial.SerialTimeoutException:
+        link_stats.add(LinkStats.WRITE_TIMEOUTS)
+        return False
+    except serial.SerialException as e:
+        link_stats.add(LinkStats.WRITE_ERRORS)
+        raise e
+    return True
+
+def put_log(log_queue, msg, logger):
+    # Child side of a LogForwarder
+    if log_queue is None:
+        return
+    try:
+        log_queue.put(msg, block=True, timeout=0.1)
+    except queue.Full:
+        # This message probably won't go anywhere
+        logger.warning('log_queue full timeout, continuing')
+    except (ValueError, OSError):
+        # This message probably won't go anywhere
+        logger.warning('Read from closed queue')
+
+def stop_child(process, keep_running, wake_queue, drain_queues):
+    # Parent side.  Asks the child process to stop, None on wake_queue
+    # wakes a thread blocked on it, and waits for it.  The child can not
+    # exit while its queue feeder threads are blocked on full pipes,
+    # drain_queues are emptied until it is gone.
+    if not process.is_alive():
+        return
+    keep_running.value = 0
+    if wake_queue is not None:
+        try:
+            wake_queue.put(None, block=False)
+        except (queue.Full, ValueError, OSError):
+            pass
+    while process.is_alive():
+        process.join(timeout=0.01)
+        for q in drain_queues:
+            try:
+                while True: q.get(block=False)
+            except (OSError, ValueError, queue.Empty):
+                pass
+
+def close_queues(queues, logger):
+    # Parent side, once the child is gone.  Drains and closes queues.
+    for q in queues:
+        try:
+            while True: q.get(block=False)
+        except (OSError, queue.Empty):
+            # OSError if already closes
+            pass
+        try:
+            q.close()
+            q.join_thread()
+        except Exception as e:
+            logger.debug('Process: Problem shutting down queue, continuing')
+            logger.debug(str(e))
+
+
+class LogForwarder(object):
+    # Parent side.  A thread passing the messages the child puts on
+    # log_queue (put_log()) on to logger.debug().
+    def __init__(self, log_queue, logger):
+        self.log_queue = log_queue
+        self.logger = logger
+        self._keep_running = True
+        self._th = threading.Thread(target=self._log_thread,args=())
+        self._th.daemon = True
+        self._th.start()
+
+    def is_alive(self):
+        return self._th.is_alive()
+
+    def stop(self):
+        if self._th.is_alive():
+            self._keep_running = False
+            # Wake it up rather than wait out its get() timeout
+            try:
+                self.log_queue.put(None, block=False)
+            except (queue.Full, ValueError, OSError):
+                pass
+            self._th.join()
+
+    def _log_thread(self):
+        while self._keep_running:
+            try:
+                msg = self.log_queue.get(block=True, timeout=1.0)
+            except queue.Empty:
+                continue
+            except Exception as e:
+                self.logger.debug('Process: _log_thread error, aborting thread.')
+                self.logger.debug(str(e))
+                break
+            if msg is not None:
+                self.logger.debug(msg)
+            sys.stdout.flush()
+
+        self.logger.debug('_log_thead exited')
+        sys.stdout.flush()
+
+
+class BatchSender(object):
+    # Child side.  Puts batches on read_queue and applies queue_policy when
+    # it is full, see SerialPacketHandler.  Drops and the like are counted
+    # in the LinkStats of link_stats (a list).  counts(entry) says how many
+    # packets a queued entry holds for which of them, as [(index, count)].
+    QUEUE_POLICIES = ('drop_newest', 'drop_oldest', 'block', 'spill')
+
+    def __init__(self, read_queue, queue_policy, link_stats, counts,
+                 keep_running, spill_dir=None, log=None):
+        if queue_policy not in self.QUEUE_POLICIES:
+            raise ValueError('queue_policy must be one of %s' % (self.QUEUE_POLICIES,))
+        self.read_queue = read_queue
+        self.queue_policy = queue_policy
+        self.link_stats = link_stats
+        self.counts = counts
+        self.keep_running = keep_running
+        self.spill_dir = spill_dir
+        self.log = log
+
+        # Spool file for the spill policy, created on first use.  Batches
+        # are pickled back to back, _spool_read is the oldest unsent one.
+        self._spool = None
+        self._spool_read = 0
+        self._spool_write = 0
+        self.spool_count = 0
+
+    def send(self, entry, counts=None):
+        # counts as from counts(entry), for entries that stand for more
+        # packets than they hold (parsed in the child)
+        if counts is None:
+            counts = self.counts(entry)
+
+        if self.queue_policy == 'drop_newest':
+            try:
+                self.read_queue.put(entry, block=True, timeout=0.1)
+            except queue.Full:
+                # Drop the batch
+                self._add(LinkStats.QUEUE_FULL_DROPS, counts)
+
+        elif self.queue_policy == 'drop_oldest':
+            while True:
+                try:
+                    self.read_queue.put(entry, block=False)
+                    break
+                except queue.Full:
+                    pass
+                # Make room, the parent may have taken the batch already
+                try:
+                    old = self.read_queue.get(block=False)
+                    self._add(LinkStats.QUEUE_OLDEST_DROPS, self.counts(old))
+                except queue.Empty:
+                    pass
+
+        elif self.queue_policy == 'block':
+            t0 = time.perf_counter()
+            while self.keep_running.value != 0:
+                try:
+                    self.read_queue.put(entry, block=True, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            dt = time.perf_counter() - t0
+            for index, count in counts:
+                self.link_stats[index].add(LinkStats.QUEUE_BLOCKED_SECONDS, dt)
+
+        else:
+            # spill.  Anything already spooled goes first.
+            if self.spool_count > 0:
+                self.unspill()
+            if self.spool_count == 0:
+                try:
+                    self.read_queue.put(entry, block=False)
+                    return
+                except queue.Full:
+                    pass
+            self._spill(entry, counts)
+
+    def unspill(self):
+        # Move spooled batches, oldest first, to read_queue while it has room
+        self._spool.flush()
+        while self.spool_count > 0:
+            self._spool.seek(self._spool_read)
+            counts, entry = pickle.load(self._spool)
+            try:
+                self.read_queue.put(entry, block=False)
+            except queue.Full:
+                break
+            self._spool_read = self._spool.tell()
+            self.spool_count = self.spool_count - 1
+            self._add(LinkStats.UNSPILLED_PACKETS, counts)
+
+        if self.spool_count == 0:
+            # Caught up, start the file over
+            self._spool.seek(0)
+            self._spool.truncate()
+            self._spool_read = 0
+            self._spool_write = 0
+        self._set_spool_bytes()
+
+    def close(self):
+        if self._spool is not None:
+            if self.spool_count > 0 and self.log is not None:
+                self.log(0,'Process: %d spooled batches not delivered' % (self.spool_count,))
+            self._spool.close()
+
+    def _spill(self, entry, counts):
+        if self._spool is None:
+            self._spool = tempfile.TemporaryFile(prefix='radar_spool_', dir=self.spill_dir)
+            if self.log is not None:
+                self.log(0,'Packet: read_queue full, spilling to disk')
+        self._spool.seek(self._spool_write)
+        pickle.dump((counts, entry), self._spool, protocol=pickle.HIGHEST_PROTOCOL)
+        self._spool_write = self._spool.tell()
+        self.spool_count = self.spool_count + 1
+        self._add(LinkStats.SPILLED_PACKETS, counts)
+        self._set_spool_bytes()
+
+    def _add(self, index, counts):
+        for link, count in counts:
+            self.link_stats[link].add(index, count)
+
+    def _set_spool_bytes(self):
+        # One spool for every link
+        for link_stats in self.link_stats:
+            link_stats.set(LinkStats.SPOOL_BYTES, self._spool_write - self._spool_read)
+
+
 class SerialPacketHandler(object):
-    def __init__(self, port, max_log_level=0):
+    # Status of a command_record
+    WRITE_OK = 0
+    WRITE_TIMEOUT = -1
+    WRITE_ERROR = -2
+
+    # What the child does when read_queue is full
+    QUEUE_POLICIES = BatchSender.QUEUE_POLICIES
+
+    def __init__(self, port, max_log_level=0, batch_size=100, batch_latency=0.0,
+                 shared_ring_slots=0, shared_ring_slot_size=8192,
+                 event_loop=True, measure_latency=False, write_queue_size=16,
+                 max_data_size=message.MSG_MAX_DATA_SIZE, capture_path=None,
+                 nice=None, sched_policy=None, sched_priority=None, cpu_affinity=None,
+                 parse_in_child=False, queue_policy='drop_newest', spill_dir=None,
+                 connect_timeout=5.0):
         self.logger = logging.getLogger(type(self).__name__)
 
         self.port = port
         self.max_log_level = max_log_level
 
+        # Longest valid frame for the largest pulse expected.  The framing
+        # buffer holds one of these plus room for a read.
+        self.max_frame_len = message.max_encoded_size(max_data_size)
+        self.max_buf_len = max(6000, 2*self.max_frame_len)
+
+        # Packets cross the process boundary in batches (lists).  A batch is
+        # sent once it holds batch_size packets, or once the oldest packet
+        # in it has waited batch_latency seconds.  With batch_latency=0.0
+        # everything found by one serial read goes out as one batch.
+        self.batch_size = max(1,batch_size)
+        self.batch_latency = batch_latency
+
+        # Parent side packets that arrived in a batch but were not read yet
+        self._read_pending = collections.deque()
+        # When the child read the newest batch taken, perf_counter()
+        self.last_batch_clock = None
+
+        # Optionally pass pulse messages through shared memory.  Only the
+        # (slot, seq) of each pulse goes through read_queue, and the parent
+        # reads numpy views of the slots.  A view is valid until the next
+        # read_packet() or read_packets() call.
+        self.ring = None
+        self._ring_seq = None
+        if shared_ring_slots > 0 and parse_in_child:
+            raise ValueError('shared_ring_slots and parse_in_child can not be combined')
+        if shared_ring_slots > 0:
+            self.ring = SharedPulseRing(slot_count=shared_ring_slots,
+                                        slot_size=shared_ring_slot_size)
+
+        # Where poll() is available the child sleeps until the serial port is
+        # readable instead of polling between 0.1 s read timeouts.  Commands
+        # are written by their own thread in the child.
+        self.event_loop = event_loop and hasattr(select, 'poll')
+
+        # Commands get an id from write_packet().  The child writer thread
+        # reports when each one was dequeued and written in a command_record.
+        self._cmd_id = 0
+        self._command_records = collections.OrderedDict()
+        self._max_command_records = 100
+
+        # Latency measurement.  command: write_packet() to the serial write,
+        # recorded by the child.  delivery: packet decoded in the child to
+        # handed out by read_packet(s).
+        self.measure_latency = measure_latency
+        self._command_latency = LatencyStats(mp.Array('d',[0.0]*4))
+        self._delivery_latency = LatencyStats()
+
+        # When the parent falls behind and read_queue fills up the child
+        #   drop_newest  drops the batch it is sending (queue_full_drops)
+        #   drop_oldest  drops the oldest queued batch (queue_oldest_drops)
+        #   block        stops reading until there is room, the serial
+        #                buffers take the slack (queue_blocked_seconds)
+        #   spill        appends batches to a spool file in spill_dir (the
+        #                system temp dir by default) and feeds them back in
+        #                order once there is room (spilled_packets,
+        #                unspilled_packets, spool_bytes)
+        if queue_policy not in self.QUEUE_POLICIES:
+            raise ValueError('queue_policy must be one of %s' % (self.QUEUE_POLICIES,))
+        self.queue_policy = queue_policy
+        self.spill_dir = spill_dir
+
+        # Optionally the child also parses the messages (message.parse_stream)
+        # and read_packet(s) return parsed messages instead of bytes.  Runs
+        # of pulses arrive as message.msg_pulse_block, header records plus a
+        # sample matrix.  Messages that do not parse are counted and dropped.
+        self.parse_in_child = parse_in_child
+
+        # Optionally the child appends every chunk it reads to a capture
+        # file, see capture.py.  Replay it with port='replay://<path>'.
+        self.capture_path = capture_path
+
+        # Scheduling of the child, see scheduling.py.  None leaves a
+        # setting as inherited from this process.  A negative nice raises
+        # the priority.  It needs privileges on Linux and is only used
+        # when asked for there.  On Windows it gives HIGH_PRIORITY_CLASS,
+        # which needs none and stays the default.  sched_policy 'fifo' or
+        # 'rr' asks for real time scheduling.  cpu_affinity pins the child
+        # to a list of cpus.  scheduling() reports what the OS actually
+        # applied.
+        if nice is None and platform.system() == 'Windows':
+            nice = -10
+        self.nice = nice
+        self.sched_policy = sched_policy
+        self.sched_priority = sched_priority
+        self.cpu_affinity = cpu_affinity
+
+        # Link counters, maintained by the child
+        self._link_stats = LinkStats(mp.Array('d',[0.0]*len(LinkStats.NAMES),lock=False))
+
         # Launch a seperate process that only manages the serial port,
         # and communicates through three Queues
         #
         # NOTE: It is necessary that the process is launched before other
         #       parent threads in the class.
         #
-        self.write_queue = mp.Queue(maxsize=1)
+        self.write_queue = mp.Queue(maxsize=write_queue_size)
         self.read_queue = mp.Queue(maxsize=1000)
         self.log_queue = mp.Queue(maxsize=1000)
+        self.write_done_queue = mp.Queue(maxsize=1000)
 
         self._sp_keep_running = mp.Value('i',1)
 
+        # Set by the child once the port is open, its buffers are reset and
+        # it is reading.  The constructor returns as soon as it is set.
+        self._sp_ready = mp.Event()
+        self.connect_timeout = connect_timeout
+        self.connect_time = None
+
+        # is_alive() joins a dead child, one thread at a time
+        self._join_lock = threading.RLock()
+
+        connect_clock = time.perf_counter()
         try:
             self.logger.debug('Processes: Launching child process')
             self._sp = mp.Process(target=self._sp_startup,args=(port,),name='SerialMonitor')
@@ -65,42 +767,152 @@ class SerialPacketHandler(object):
         # Launch a thread in the parent process that processed log messages
         # from the serial port process.  This is very useful when debugging.
         #
-        self._log_keep_running = True
-        self._log_th = threading.Thread(target=self._log_thread,args=())
-        self._log_th.daemon = True
-        self._log_th.start()
+        self._log_forwarder = LogForwarder(self.log_queue, self.logger)
 
-        time.sleep(1.0)
-        if not self.is_alive():
-            err = 'Process: DOA exit = %d' % self._sp.exitcode
-            self.logger.warning(err)
-            raise RuntimeError(err)
+        while not self._sp_ready.wait(0.01):
+            if not self.is_alive():
+                err = 'Process: DOA exit = %s' % (self._sp.exitcode,)
+                self.logger.warning(err)
+                raise RuntimeError(err)
+            if time.perf_counter() - connect_clock > connect_timeout:
+                self.join()
+                err = 'Process: port not ready after %.1f s' % (connect_timeout,)
+                self.logger.warning(err)
+                raise RuntimeError(err)
+        self.connect_time = time.perf_counter() - connect_clock
+        self.logger.debug('Process: Ready in %.3f s' % (self.connect_time,))
 
     def read_packet(self, block=True, timeout=None):
-        try:
-            packet = self.read_queue.get(block,timeout)
-        except (ValueError, OSError):
-            self.logger.debug('Read from closed queue')
-            raise ValueError('Read from closed queue')
-        return packet
+        # Raises queue.Empty like Queue.get().  Stale shared ring slots are
+        # skipped, as in read_packets().
+        self._ring_release()
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            while not self._read_pending:
+                wait = None if deadline is None else deadline - time.perf_counter()
+                if block and wait is not None and wait <= 0.0:
+                    # Out of time, one last look without waiting
+                    self._read_pending.extend(self._read_batch(False,None))
+                else:
+                    self._read_pending.extend(self._read_batch(block,wait))
+            packet = self._ring_resolve(self._read_pending.popleft())
+            if packet is not None:
+                return packet
+
+    def read_packets(self, max_n=None, timeout=None):
+        # Wait up to timeout for the first batch, then take whatever else
+        # is already queued.  Returns at most max_n packets, [] on timeout.
+        self._ring_release()
+        if not self._read_pending:
+            try:
+                self._read_pending.extend(self._read_batch(True,timeout))
+            except queue.Empty:
+                return []
+        while max_n is None or len(self._read_pending) < max_n:
+            try:
+                self._read_pending.extend(self._read_batch(False,None))
+            except queue.Empty:
+                break
+
+        if max_n is None or len(self._read_pending) <= max_n:
+            packets = list(self._read_pending)
+            self._read_pending.clear()
+        else:
+            packets = [self._read_pending.popleft() for ii in range(0,max_n)]
+        if self.ring is not None:
+            packets = [self._ring_resolve(p) for p in packets]
+            packets = [p for p in packets if p is not None]
+        return packets
 
     def write_packet(self, packet, block=True, timeout=None):
+        # Returns the command id, or None if the packet was dropped
+        self._cmd_id = self._cmd_id + 1
         try:
-            self.write_queue.put(packet, block=True, timeout=None)
+            self.write_queue.put((self._cmd_id,time.perf_counter(),packet), block=block, timeout=timeout)
         except (ValueError, AssertionError):
             self.logger.debug('Write to closed queue')
             raise ValueError('Write to closed queue')
         except queue.Full:
             # Drop the packet
             self.logger.debug('Write times out on queue full')
+            return None
 
-        return
+        return self._cmd_id
+
+    def command_record(self, cmd_id, timeout=0.0):
+        # Timing of a written command, None if it is not written (yet)
+        deadline = time.perf_counter() + timeout
+        while True:
+            self._collect_command_records()
+            record = self._command_records.get(cmd_id)
+            if record is not None or time.perf_counter() >= deadline:
+                return record
+            time.sleep(0.001)
+
+    def command_records(self):
+        # Most recent command records, oldest first
+        self._collect_command_records()
+        return list(self._command_records.values())
+
+    def _collect_command_records(self):
+        while True:
+            try:
+                record = self.write_done_queue.get(block=False)
+            except (queue.Empty, ValueError, OSError):
+                break
+            self._command_records[record.cmd_id] = record
+            while len(self._command_records) > self._max_command_records:
+                self._command_records.popitem(last=False)
+
+    def latency_stats(self):
+        return {'command':self._command_latency.snapshot(),
+                'delivery':self._delivery_latency.snapshot()}
+
+    def stats(self):
+        # Link counters, with rates since the previous call
+        return self._link_stats.snapshot()
+
+    def reset_stats(self):
+        self._link_stats.reset()
+
+    def scheduling(self):
+        # Effective nice, policy and affinity of the child, from the OS
+        return scheduling.scheduling_report(self._sp.pid)
+
+    def reset_latency_stats(self):
+        self._command_latency.reset()
+        self._delivery_latency.reset()
+
+    def _read_batch(self, block, timeout):
+        try:
+            batch_clock, batch = self.read_queue.get(block,timeout)
+        except (ValueError, OSError):
+            self.logger.debug('Read from closed queue')
+            raise ValueError('Read from closed queue')
+        self.last_batch_clock = batch_clock
+        if self.measure_latency:
+            self._delivery_latency.add(time.perf_counter() - batch_clock)
+        return batch
+
+    def _ring_resolve(self, packet):
+        # Ring packets arrive as (slot, seq)
+        if isinstance(packet, tuple):
+            slot, seq = packet
+            self._ring_seq = seq
+            packet = self.ring.read(slot, seq)
+        return packet
+
+    def _ring_release(self):
+        # Hand the slots read so far back to the writer
+        if self._ring_seq is not None:
+            self.ring.release(self._ring_seq)
+            self._ring_seq = None
 
     def is_alive(self):
         #self.logger.debug('Process: is_alive Called')
         sp_alive = self._sp.is_alive()
         #self.logger.debug('Process: log is_alive Called')
-        log_th_alive = self._log_th.is_alive()
+        log_th_alive = self._log_forwarder.is_alive()
         # The log thread can out live the process.  Make sure it is dead too.
         if not sp_alive and log_th_alive:
             self.logger.debug('Process: log join Called')
@@ -109,60 +921,52 @@ class SerialPacketHandler(object):
         return sp_alive
 
     def join(self):
+        with self._join_lock:
+            self._join()
+
+    def _join(self):
         self.logger.debug('Process: Join Called')
 
         # TBD: Use a timeout and check return code
         self.logger.debug('Process: Stopping process')
-        if self._sp.is_alive():
-            #self._sp.terminate()
-            self._sp_keep_running.value = 0
-            self._sp.join()
+        stop_child(self._sp, self._sp_keep_running, self.write_queue,
+                   (self.read_queue,self.write_done_queue))
 
         self.logger.debug('Process: Stopping log thread')
-        if self._log_th.is_alive():
-            self._log_keep_running = False
-            self._log_th.join()
+        self._log_forwarder.stop()
 
         # Drain and shutdown queues
         self.logger.debug('Process: Draining queues')
-        for q in (self.write_queue,self.read_queue,self.log_queue):
-            try:
-                while True: q.get(block=False)
-            except (OSError, queue.Empty):
-                # OSError if already closes
-                pass
-            try:
-                q.close()
-                q.join_thread()
-            except Exception as e:
-                self.logger.debug('Process: Problem shutting down queue, continuing')
-                self.logger.debug(str(e))
+        close_queues((self.write_queue,self.read_queue,self.log_queue,self.write_done_queue), self.logger)
+
+        if self.ring is not None:
+            self.ring.close()
 
         self.logger.debug('Process: Join Done')
 
     def _sp_startup(self,port):
         self._sp_log_message(0,'Process: startup() called')
 
-        # Change process priority
+        # Change process priority.  Threads started later in the child
+        # inherit the policy and affinity.
         try:
-            p = psutil.Process()
-            self._sp_log_message(0,'Process: Child ' + str(p))
-
-            self._sp_log_message(0,'Process: Child  initial priority: ' + str(p.nice()))
-            if platform.system() == 'Windows':
-                p.nice(psutil.HIGH_PRIORITY_CLASS)
-            else:
-                p.nice(20)
-            self._sp_log_message(0,'Process: Child modified priority: ' + str(p.nice()))
+            self._sp_log_message(0,'Process: Child initial scheduling: %s' % (scheduling.scheduling_report(),))
+            for msg in scheduling.apply_scheduling(nice=self.nice,
+                                                   sched_policy=self.sched_policy,
+                                                   sched_priority=self.sched_priority,
+                                                   cpu_affinity=self.cpu_affinity):
+                self._sp_log_message(0,'Process: Child ' + msg)
+            self._sp_log_message(0,'Process: Child modified scheduling: %s' % (scheduling.scheduling_report(),))
         except Exception as e:
             self._sp_log_message(0,'Process: Failed to modify process priority, continuing.')
             self._sp_log_message(0,str(e))
 
-        # Open serial port handler
+        # Open serial port handler.  port may also be a tcp://, udp:// or
+        # replay:// url, see transport.py
         try:
-            self._sp_serial_port = serial.Serial(port=port, baudrate=2000000, timeout=0.1, write_timeout=0.1)
+            self._sp_serial_port = transport.open_transport(port, baudrate=2000000, timeout=0.1, write_timeout=0.1)
             # Adjust os buffer size if avaliable
-            if platform.system() == 'Windows':
+            if platform.system() == 'Windows' and hasattr(self._sp_serial_port, 'set_buffer_size'):
                 self._sp_serial_port.set_buffer_size(16384)
         except Exception as e:
             self._sp_log_message(0,'Packet: Serial port failed to open, aborting.')
@@ -170,53 +974,100 @@ class SerialPacketHandler(object):
             return
         self._sp_log_message(1,'Packet: Serial port open')
 
+        # Writes happen on the capture's own thread, never in the read loop
+        self._sp_capture = None
+        if self.capture_path is not None:
+            try:
+                self._sp_capture = capture.CaptureWriter(self.capture_path)
+                self._sp_log_message(0,'Packet: Capturing to %s' % (self.capture_path,))
+            except OSError as e:
+                self._sp_log_message(0,'Packet: Capture file failed to open, continuing without')
+                self._sp_log_message(1,str(e))
+
         # Setup an empty read buffer
-        self._packet_sep = b'\x00'
-        self._max_buf_len = 6000
-        self._buf = b''
+        self._framer = PacketFramer(max_buf_len=self.max_buf_len, packet_sep=b'\x00',
+                                    max_frame_len=self.max_frame_len,
+                                    start_pattern=MSG_START_PATTERN)
+
+        # Packets waiting to be sent to the parent
+        self._sp_batch = []
+        self._sp_batch_clock = None
+
+        self._sp_writer_th = None
+
+        # read_queue with the queue_policy applied
+        self._sp_sender = BatchSender(self.read_queue, self.queue_policy, [self._link_stats],
+                                      lambda entry: [(0, len(entry[1]))], self._sp_keep_running,
+                                      self.spill_dir, self._sp_log_message)
 
         self._sp_run_loop()
 
+    def _sp_writer_thread(self):
+        # Child side.  Commands block here, never in the read loop.
+        while self._sp_writer_keep_running:
+            try:
+                item = self.write_queue.get(block=True, timeout=0.1)
+            except queue.Empty:
+                continue
+            except (ValueError, OSError):
+                break
+            if item is None:
+                # join() is shutting the child down
+                break
+            cmd_id, enqueue_clock, packet = item
+            dequeue_clock = time.perf_counter()
+
+            try:
+                status = self._sp_write_packet(packet)
+            except serial.SerialException:
+                # Take the read loop down too
+                self._sp_keep_running.value = 0
+                break
+            write_clock = time.perf_counter()
+
+            if self.measure_latency:
+                self._command_latency.add(write_clock - enqueue_clock)
+            record = command_record(cmd_id, enqueue_clock, dequeue_clock, write_clock, status)
+            try:
+                self.write_done_queue.put(record, block=False)
+            except queue.Full:
+                # Nobody is collecting records
+                pass
+
     def _sp_write_packet(self,packet):
         try:
-            self._sp_serial_port.write(cobs.encode(packet) + b'\x00')
-            self._sp_serial_port.flush()
-        except serial.SerialTimeoutException:
-            self._sp_log_message(0,'Packet: Serial port write_packet() timeout, continuing')
+            if not write_frame(self._sp_serial_port, packet, self._link_stats):
+                self._sp_log_message(0,'Packet: Serial port write_packet() timeout, continuing')
+                return self.WRITE_TIMEOUT
         except serial.SerialException as e:
             self._sp_log_message(0,'Packet: Serial port error in write_packet(), aborting')
             raise e
+        return self.WRITE_OK
 
-    def _sp_read_packet(self):
-        # Set the default return if no new packet is available
-        dat = b''
+    def _sp_read_packets(self, read_size=None):
+        # Returns an empty list if no new packet is available after timeout
+        packets = []
+        errors = []
 
         try:
-            # Look for a packet in buffered data. Extract it if it exists
-            dat,sep,rest = self._buf.partition(self._packet_sep)
-            if sep == self._packet_sep:
-                self._buf = rest
-            else:
-                # If there is any room in the buffer, do a read with timeout
-                got_size = 0
-                if len(self._buf) < self._max_buf_len:
-                    read_size = self._max_buf_len - len(self._buf)
-                    read_bytes = self._sp_serial_port.read(read_size)
-                    got_size = len(read_bytes)
-
-                # If data was available append and try again to find a packet
-                if got_size > 0:
-                    self._buf = self._buf + read_bytes
-
-                    # Look for a packet in buffered data. Extract it if it exists
-                    dat,sep,rest = self._buf.partition(self._packet_sep)
-                    if sep == self._packet_sep:
-                        self._buf = rest
-                    else:
-                        # Check if buffer is full
-                        if len(self._buf) >= self._max_buf_len:
-                            # Out of room, drop buffer
-                            self._buf = b''
+            # If there is any room in the buffer, do a read with timeout.
+            # Without a read_size the read waits to fill the buffer.
+            free_size = self._framer.free_space()
+            if read_size is None:
+                read_size = free_size
+            read_size = min(max(read_size,1), free_size)
+            if read_size > 0:
+                read_bytes = self._sp_serial_port.read(read_size)
+                if len(read_bytes) > 0:
+                    if self._sp_capture is not None:
+                        self._sp_capture.write(read_bytes)
+                    self._framer.feed(read_bytes)
+                    self._link_stats.add(LinkStats.BYTES_RECEIVED, len(read_bytes))
+            if self._sp_capture is not None:
+                self._link_stats.set(LinkStats.CAPTURE_DROPS, self._sp_capture.drop_count)
+
+            # Extract every complete packet in the buffered data
+            packets, errors = decode_frames(self._framer, self._link_stats)
 
         except serial.SerialException as e:
             self._sp_log_message(0,'Packet: Serial port error in read_packet(), aborting')
@@ -225,17 +1076,70 @@ class SerialPacketHandler(object):
             self._sp_log_message(0,'Packet: Error in read_packet(), continuing')
             self._sp_log_message(1,str(e))
 
-        try:
-            if dat != b'':
-                packet = cobs.decode(dat)
-            else:
-                packet = b''
-        except cobs.DecodeError as e:
+        for e in errors:
             self._sp_log_message(0,'Packet: COBS decode error, continuing')
             self._sp_log_message(1,str(e))
-            packet = b''
 
-        return packet
+        if self.ring is not None:
+            # Pulses go through the ring, dropped if it is full (the ring
+            # counts them)
+            ring_packets = []
+            for packet in packets:
+                if self._sp_is_pulse(packet):
+                    packet = self.ring.write(packet)
+                    if packet is None:
+                        continue
+                ring_packets.append(packet)
+            packets = ring_packets
+            self._link_stats.set(LinkStats.RING_OVERFLOWS, self.ring.overflow_count())
+
+        return packets
+
+    def _sp_is_pulse(self, packet):
+        if len(packet) < 8:
+            return False
+        msg_type, = struct.unpack_from('H', packet, 6)
+        return msg_type == message.MSG_TYPE_PULSE or msg_type == message.MSG_TYPE_PULSE12
+
+    def _sp_poll(self, poller):
+        # Sleep until the serial port is readable or the pending batch is
+        # due.  Returns the packets read.
+        timeout = 0.1
+        if len(self._sp_batch) > 0:
+            timeout = self._sp_batch_clock + self.batch_latency - time.perf_counter()
+            timeout = min(max(timeout,0.0),0.1)
+        if self._sp_sender.spool_count > 0:
+            # Check back on read_queue soon
+            timeout = min(timeout,0.01)
+
+        packets = []
+        for fd, event in poller.poll(timeout*1000.0):
+            if event & select.POLLIN:
+                # Drain exactly what is waiting
+                packets = self._sp_read_packets(self._sp_serial_port.in_waiting)
+            else:
+                raise serial.SerialException('Serial port poll() error event 0x%x' % (event,))
+        return packets
+
+    def _sp_send_batch(self):
+        batch = self._sp_batch
+        self._sp_batch = []
+        for ii in range(0,len(batch),self.batch_size):
+            items = batch[ii:ii+self.batch_size]
+            if self.parse_in_child:
+                items = self._sp_parse(items)
+                # Nothing parsed, the errors are counted already
+                if len(items) == 0:
+                    continue
+            self._sp_sender.send((self._sp_batch_clock,items), [(0, len(batch[ii:ii+self.batch_size]))])
+
+    def _sp_parse(self, packets):
+        parsed, errors = message.parse_stream(packets)
+        if len(errors) > 0:
+            self._link_stats.add(LinkStats.PARSE_ERRORS, len(errors))
+            self._sp_log_message(0,'Packet: %d messages failed to parse, continuing' % (len(errors),))
+            self._sp_log_message(1,errors[0])
+        return parsed
 
     def _sp_run_loop(self):
         self._sp_log_message(0,'Process: run_loop running')
@@ -246,35 +1150,64 @@ class SerialPacketHandler(object):
             self._sp_serial_port.reset_input_buffer()
             self._sp_serial_port.reset_output_buffer()
 
+            # Commands are written from their own thread
+            self._sp_writer_keep_running = True
+            self._sp_writer_th = threading.Thread(target=self._sp_writer_thread,args=(),name='SerialWriter')
+            self._sp_writer_th.daemon = True
+            self._sp_writer_th.start()
+
+            poller = None
+            if self.event_loop and transport.pollable(self._sp_serial_port):
+                poller = select.poll()
+                poller.register(self._sp_serial_port.fileno(), select.POLLIN)
+                self._sp_log_message(0,'Process: run_loop using poll()')
+
+            # Ready to read, release the constructor
+            self._sp_ready.set()
+
             # Loop forever
             while self._sp_keep_running.value != 0:
+                self._link_stats.add(LinkStats.LOOP_ITERATIONS)
                 nt = time.perf_counter()
                 if nt-ct >= 5.0:
                     self._sp_log_message(0,'Process: Alive (%.1f)' % (nt-ct0,))
+                    if self.measure_latency:
+                        self._sp_log_message(0,'Process: Command latency %s' % (self._command_latency.snapshot(),))
                     ct = nt
 
-                # If there is data to send send it
-                if not self.write_queue.empty():
-                    try:
-                        packet = self.write_queue.get(block=True, timeout=0.1)
-                    except queue.Empty:
-                        self._sp_log_message(0,'Process: write_queue.get() timeout, continuing')
-                    else:
-                        self._sp_write_packet(packet)
-
-                # Returns b'' of no new packet is available after timeout
-                packet = self._sp_read_packet()
-                if packet != b'':
-                    try:
-                        self.read_queue.put(packet, block=True, timeout=0.1)
-                    except queue.Full:
-                        # Drop the packet
-                        continue
+                if poller is not None:
+                    packets = self._sp_poll(poller)
+                else:
+                    # Returns [] if no new packet is available after timeout
+                    packets = self._sp_read_packets()
+
+                if len(packets) > 0:
+                    if len(self._sp_batch) == 0:
+                        self._sp_batch_clock = time.perf_counter()
+                    self._sp_batch.extend(packets)
+
+                if self._sp_sender.spool_count > 0:
+                    self._sp_sender.unspill()
+
+                if len(self._sp_batch) > 0 and \
+                        (len(self._sp_batch) >= self.batch_size or
+                         time.perf_counter()-self._sp_batch_clock >= self.batch_latency):
+                    self._sp_send_batch()
 
         except Exception as e:
             self._sp_log_message(0,'Process: Error in run_loop, aborting')
             self._sp_log_message(1,str(e))
 
+        self._sp_writer_keep_running = False
+
+        self._sp_sender.close()
+        if self._sp_writer_th is not None:
+            self._sp_writer_th.join()
+
+        if self._sp_capture is not None:
+            self._sp_log_message(1,'Packet: Closing capture file')
+            self._sp_capture.close()
+
         self._sp_log_message(1,'Packet: Closing serial port')
         try:
             self._sp_serial_port.close()
@@ -284,32 +1217,5 @@ class SerialPacketHandler(object):
         self._sp_log_message(0,'Process: run_loop process ended')
 
     def _sp_log_message(self, level, msg):
-        if self.log_queue is not None and level <= self.max_log_level:
-            try:
-                self.log_queue.put(msg, block=True, timeout=0.1)
-            except queue.Full:
-                # This message probably won't go anywhere
-                self.logger.warning('log_queue full timeout, continuing')
-            except (ValueError, OSError):
-                # This message probably won't go anywhere
-                self.logger.warning('Read from closed queue')
-
-    def _log_thread(self):
-        # This thread oly exists on the parent side of the connection
-        while self._log_keep_running:
-            try:
-                msg = self.log_queue.get(block=True, timeout=1.0)
-            except queue.Empty:
-                continue
-            except Exception as e:
-                self.logger.debug('Process: _log_thread error, aborting thread.')
-                self.logger.debug(str(e))
-            if msg is None:
-                self.logger.debug('_log_thead got None message')
-            else:
-                self.logger.debug(msg)
-            sys.stdout.flush()
-
-        self.logger.debug('_log_thead exited')
-        sys.stdout.flush()
-
+        if level <= self.max_log_level:
+            put_log(self.log_queue, msg, self.logger)
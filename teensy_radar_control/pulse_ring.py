@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 05:48:09 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Preallocated pulse storage, one writer and any number of readers each with
+its own cursor.  Pulses go in and come out as blocks, a PULSE_HEADER_DTYPE
+record array, a pulses x data_size sample matrix and the acquisition host
+clocks, and readers get views into the ring rather than copies.
+"""
+import collections
+import logging
+import time
+import threading, queue, weakref
+
+import numpy as np
+
+from teensy_radar_control import message
+
+class _ring_generation(object):
+    # The arrays for one data_size.  end_seq and next are set when pulses
+    # with another data_size replace it.
+    def __init__(self, capacity, data_size, start_seq):
+        self.capacity = capacity
+        self.data_size = data_size
+        self.start_seq = start_seq
+        self.end_seq = None
+        self.next = None
+        self.headers = np.zeros(capacity, dtype=message.PULSE_HEADER_DTYPE)
+        self.data = np.zeros((capacity, data_size), dtype=message.SAMPLE_DTYPE)
+        self.acq_clock = np.full(capacity, np.nan)
+
+        # What readers slice, read only as every reader sees the same rows
+        self._views = (self.headers.view(), self.data.view(), self.acq_clock.view())
+        for view in self._views:
+            view.flags.writeable = False
+
+    def views(self, start, stop):
+        headers, data, acq_clock = self._views
+        return headers[start:stop], data[start:stop], acq_clock[start:stop]
+
+
+def _empty_views():
+    views = (np.empty(0, dtype=message.PULSE_HEADER_DTYPE),
+             np.empty((0,0), dtype=message.SAMPLE_DTYPE), np.empty(0))
+    for view in views:
+        view.flags.writeable = False
+    return views
+
+
+class PulseRingBuffer(object):
+    # Pulse number seq (counted from 0 as written) lives in row
+    # seq % capacity of the current arrays.  capacity is as many pulses as
+    # fit in memory_budget bytes at the current data_size.  Pulses with a
+    # new data_size get new arrays, readers finish the old ones first.
+    #
+    # With overwrite the writer never waits and a reader more than
+    # capacity pulses behind loses the oldest (counted in its lost).
+    # Without it write() waits for the slowest reader, and the wait backs
+    # up into whatever feeds the ring.
+    #
+    # Markers, e.g. a message.msg_gap, go between pulses with mark() and
+    # are handed to each reader when its cursor gets there.  The last
+    # max_markers are kept.
+    #
+    def __init__(self, memory_budget=16<<20, overwrite=True, max_markers=64):
+        self.memory_budget = memory_budget
+        self.overwrite = overwrite
+        self.logger = logging.getLogger(type(self).__name__)
+
+        self.write_seq = 0
+        self._gen = None
+        self._cond = threading.Condition()
+        self._readers = weakref.WeakSet()
+
+        # (marker id, seq, item), seq is the first pulse after the marker
+        self._markers = collections.deque(maxlen=max_markers)
+        self._marker_id = 0
+
+    def capacity_for(self, data_size):
+        row = message.PULSE_HEADER_DTYPE.itemsize + 2*data_size + 8
+        return max(1, self.memory_budget//row)
+
+    def capacity(self):
+        return 0 if self._gen is None else self._gen.capacity
+
+    def reader(self):
+        # A new reader, its first pulse is the next one written
+        with self._cond:
+            reader = PulseRingReader(self)
+            self._readers.add(reader)
+        return reader
+
+    def mark(self, item):
+        with self._cond:
+            self._marker_id = self._marker_id + 1
+            self._markers.append((self._marker_id, self.write_seq, item))
+            self._cond.notify_all()
+
+    def write(self, headers, data, acq_clock=None, timeout=None):
+        # Copies in a block of pulses, headers a PULSE_HEADER_DTYPE array,
+        # data pulses x data_size and acq_clock the acquisition clocks (None
+        # if not known).  Returns False if a reader was still in the way
+        # after timeout seconds, nothing is written then.
+        count = len(headers)
+        if count == 0:
+            return True
+        gen = self._gen
+        if gen is None or gen.data_size != data.shape[1]:
+            gen = self._new_generation(data.shape[1])
+
+        skip = 0
+        if count > gen.capacity:
+            # The first pulses would be overwritten by the last
+            skip = count - gen.capacity
+            headers = headers[skip:]
+            data = data[skip:]
+            if acq_clock is not None:
+                acq_clock = acq_clock[skip:]
+            count = gen.capacity
+
+        if not self.overwrite and not self._wait_for_readers(gen, skip+count, timeout):
+            return False
+
+        # write_seq moves on only once the rows are in
+        start = (self.write_seq + skip) % gen.capacity
+        first = min(count, gen.capacity - start)
+        for rows, src in ((slice(start, start+first), slice(0, first)),
+                          (slice(0, count-first), slice(first, count))):
+            if rows.stop == rows.start:
+                continue
+            gen.headers[rows] = headers[src]
+            gen.data[rows] = data[src]
+            gen.acq_clock[rows] = np.nan if acq_clock is None else acq_clock[src]
+
+        with self._cond:
+            self.write_seq = self.write_seq + skip + count
+            self._cond.notify_all()
+        return True
+
+    def _new_generation(self, data_size):
+        gen = _ring_generation(self.capacity_for(data_size), data_size, self.write_seq)
+        with self._cond:
+            if self._gen is not None:
+                self._gen.end_seq = self.write_seq
+                self._gen.next = gen
+            else:
+                # Readers made before the first pulse start on these
+                for reader in self._readers:
+                    reader.gen = gen
+            self._gen = gen
+        self.logger.debug('Pulse ring of %d pulses of %d samples' % (gen.capacity, data_size))
+        return gen
+
+    def _wait_for_readers(self, gen, count, timeout):
+        # Until every reader is past the rows about to be written.  A
+        # reader still on older arrays starts on gen at gen.start_seq.
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self._cond:
+            while True:
+                oldest = self.write_seq + count - gen.capacity
+                if all(max(reader.cursor, gen.start_seq) >= oldest
+                       for reader in self._readers):
+                    return True
+                wait = None if deadline is None else deadline - time.perf_counter()
+                if wait is not None and wait <= 0.0:
+                    return False
+                self._cond.wait(wait)
+
+
+class PulseRingReader(object):
+    # A cursor into a PulseRingBuffer, made by PulseRingBuffer.reader().
+    # A reader is for one thread.
+    #
+    # read() returns views, not copies.  They stay good until the writer
+    # comes round to the same rows, capacity pulses later.  Without
+    # overwrite that does not happen before the next read().
+    #
+    def __init__(self, ring):
+        self.ring = ring
+        self.gen = ring._gen
+        self.cursor = ring.write_seq
+        self.lost = 0
+        self._marker_id = ring._marker_id
+
+    def available(self):
+        # Pulses written and not read yet, including any overwritten
+        return self.ring.write_seq - self.cursor
+
+    def markers(self):
+        # The markers the cursor has reached, oldest first
+        items = []
+        for marker_id, seq, item in self._pending_markers():
+            if seq > self.cursor:
+                break
+            items.append(item)
+            self._marker_id = marker_id
+        return items
+
+    def read(self, max_n=None, block=False, timeout=None):
+        # (headers, data, acq_clock) views of up to max_n pulses.  A read
+        # stops at the end of the arrays, at a data_size change and at the
+        # next marker, and returns no pulses until the markers the cursor
+        # has reached are taken with markers().  acq_clock is NaN where not
+        # known.  Raises queue.Empty if there is nothing to read, with
+        # block after waiting timeout seconds.
+        ring = self.ring
+        if not self._ready():
+            if not block:
+                raise queue.Empty
+            deadline = None if timeout is None else time.perf_counter() + timeout
+            with ring._cond:
+                while not self._ready():
+                    wait = None if deadline is None else deadline - time.perf_counter()
+                    if wait is not None and wait <= 0.0:
+                        raise queue.Empty
+                    ring._cond.wait(wait)
+
+        pending = self._pending_markers()
+        if len(pending) > 0 and pending[0][1] <= self.cursor:
+            return _empty_views()
+
+        gen = self._current_generation()
+        end = ring.write_seq if gen.end_seq is None else gen.end_seq
+        if end - self.cursor > gen.capacity:
+            # Overwritten before this reader got to them
+            self.lost = self.lost + end - gen.capacity - self.cursor
+            self.cursor = end - gen.capacity
+            # Markers among the overwritten pulses are reached here
+            if len(pending) > 0 and pending[0][1] <= self.cursor:
+                return _empty_views()
+
+        count = end - self.cursor
+        if len(pending) > 0:
+            count = min(count, pending[0][1] - self.cursor)
+        if max_n is not None:
+            count = min(count, max_n)
+        start = self.cursor % gen.capacity
+        count = min(count, gen.capacity - start)
+        self.cursor = self.cursor + count
+        if not ring.overwrite:
+            with ring._cond:
+                ring._cond.notify_all()
+        return gen.views(start, start+count)
+
+    def get_block(self, max_n=None, block=True, timeout=None):
+        # The next marker, or the (headers, data, acq_clock) views from
+        # read() up to it.  Raises queue.Empty like Queue.get().
+        views = self.read(max_n, block, timeout)
+        if len(views[0]) == 0:
+            marker_id, seq, item = self._pending_markers()[0]
+            self._marker_id = marker_id
+            return item
+        return views
+
+    def get(self, block=True, timeout=None):
+        # The next marker or pulse, pulses as message.msg_pulse with data a
+        # view into the ring.  Raises queue.Empty like Queue.get().
+        item = self.get_block(1, block, timeout)
+        if not isinstance(item, tuple):
+            return item
+        headers, data, acq_clock = item
+        acq_clock = float(acq_clock[0])
+        return message.msg_pulse(message.msg_pulse_header(*headers[0].tolist()), data[0],
+                                 None if np.isnan(acq_clock) else acq_clock)
+
+    def _ready(self):
+        # Pulses to read or markers to take
+        if self.available() > 0:
+            return True
+        pending = self._pending_markers()
+        return len(pending) > 0 and pending[0][1] <= self.cursor
+
+    def _pending_markers(self):
+        return [marker for marker in list(self.ring._markers) if marker[0] > self._marker_id]
+
+    def _current_generation(self):
+        # Finish each set of arrays before moving to the next
+        while self.gen.end_seq is not None and self.cursor >= self.gen.end_seq:
+            self.gen = self.gen.next
+            self.cursor = max(self.cursor, self.gen.start_seq)
+        return self.gen
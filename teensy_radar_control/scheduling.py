@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 21:52:40 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Process and thread scheduling for the acquisition path: nice level,
+real time policy (SCHED_FIFO / SCHED_RR where the OS and permissions
+allow) and CPU affinity.  Every setting is best effort, what was actually
+applied is read back with scheduling_report().
+"""
+import logging
+import os, platform
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# sched_policy names
+SCHED_POLICIES = {}
+for _name, _attr in (('other', 'SCHED_OTHER'), ('batch', 'SCHED_BATCH'),
+                     ('idle', 'SCHED_IDLE'), ('fifo', 'SCHED_FIFO'),
+                     ('rr', 'SCHED_RR')):
+    if hasattr(os, _attr):
+        SCHED_POLICIES[_name] = getattr(os, _attr)
+
+def apply_scheduling(pid=0, nice=None, sched_policy=None, sched_priority=None, cpu_affinity=None):
+    # Apply the settings that are not None to process pid (0 is this
+    # process).  Returns a list of messages, one per setting, saying what
+    # happened.  Failures are reported, not raised.
+    msgs = []
+    p = psutil.Process(pid if pid != 0 else None)
+
+    if nice is not None:
+        try:
+            if platform.system() == 'Windows':
+                # Windows has priority classes, not nice levels
+                if nice < 0:
+                    p.nice(psutil.HIGH_PRIORITY_CLASS)
+                elif nice > 0:
+                    p.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+                else:
+                    p.nice(psutil.NORMAL_PRIORITY_CLASS)
+            else:
+                p.nice(nice)
+            msgs.append('nice set to %s' % (p.nice(),))
+        except (psutil.Error, OSError) as e:
+            msgs.append('nice %s failed: %s' % (nice, e))
+
+    if sched_policy is not None:
+        if sched_policy not in SCHED_POLICIES:
+            msgs.append('sched_policy %s not available on this OS' % (sched_policy,))
+        else:
+            policy = SCHED_POLICIES[sched_policy]
+            if sched_priority is None:
+                sched_priority = 10 if sched_policy in ('fifo', 'rr') else 0
+            try:
+                priority = min(max(sched_priority, os.sched_get_priority_min(policy)),
+                               os.sched_get_priority_max(policy))
+                os.sched_setscheduler(pid, policy, os.sched_param(priority))
+                msgs.append('sched_policy set to %s priority %d' % (sched_policy, priority))
+            except OSError as e:
+                # Usually EPERM, needs root or CAP_SYS_NICE / RLIMIT_RTPRIO
+                msgs.append('sched_policy %s failed: %s' % (sched_policy, e))
+
+    if cpu_affinity is not None:
+        try:
+            p.cpu_affinity(list(cpu_affinity))
+            msgs.append('cpu_affinity set to %s' % (p.cpu_affinity(),))
+        except (psutil.Error, OSError, ValueError, AttributeError) as e:
+            msgs.append('cpu_affinity %s failed: %s' % (cpu_affinity, e))
+
+    return msgs
+
+def pin_current_thread(cpu_affinity):
+    # Linux applies sched_setaffinity(0) to the calling thread only.
+    # Returns True if the thread was pinned.
+    if cpu_affinity is None:
+        return False
+    if not hasattr(os, 'sched_setaffinity') or platform.system() != 'Linux':
+        logger.warning('Thread affinity not supported on %s' % (platform.system(),))
+        return False
+    try:
+        os.sched_setaffinity(0, cpu_affinity)
+    except OSError as e:
+        logger.warning('Thread affinity %s failed: %s' % (cpu_affinity, e))
+        return False
+    return True
+
+def scheduling_report(pid=0):
+    # The effective settings of process pid, read back from the OS
+    report = {'pid': pid if pid != 0 else os.getpid()}
+    report['nice'] = None
+    report['cpu_affinity'] = None
+    try:
+        p = psutil.Process(report['pid'])
+        report['nice'] = p.nice()
+        if hasattr(p, 'cpu_affinity'):
+            report['cpu_affinity'] = p.cpu_affinity()
+    except (psutil.Error, OSError):
+        pass
+    report['sched_policy'] = None
+    report['sched_priority'] = None
+    if hasattr(os, 'sched_getscheduler'):
+        try:
+            policy = os.sched_getscheduler(pid)
+            for name, value in SCHED_POLICIES.items():
+                if value == policy:
+                    report['sched_policy'] = name
+            report['sched_priority'] = os.sched_getparam(pid).sched_priority
+        except OSError:
+            pass
+    return report
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 11:02:18 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+"""
+import logging
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+# Ring control block, followed by one entry per slot, followed by the slots
+RING_CTRL_DTYPE = np.dtype([('write_seq','<u8'), ('read_seq','<u8'), ('overflow_count','<u8')])
+RING_SLOT_DTYPE = np.dtype([('seq','<u8'), ('size','<u4'), ('_pad','<u4')])
+
+class SharedPulseRing(object):
+    # Fixed size frame slots in shared memory with one writer (the
+    # SerialMonitor process) and one reader (the parent).
+    #
+    # The writer copies a frame into the next free slot and passes
+    # (slot, seq) to the reader over a queue.  The reader gets a numpy view
+    # of the slot, and releases it when done so the writer can reuse it.
+    # When every slot is still held by the reader the writer drops the
+    # frame and counts an overflow.
+    #
+    # Each counter in the control block has exactly one writer, so no
+    # locking is needed.
+    #
+    def __init__(self, slot_count=256, slot_size=8192, name=None):
+        if shared_memory is None:
+            raise RuntimeError('SharedPulseRing needs multiprocessing.shared_memory (Python 3.8+)')
+
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+
+        create = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=self._total_size())
+        self._owner = create
+        self._map_arrays()
+
+        if create:
+            self._ctrl[0] = (0,0,0)
+            self._slots[:] = (0,0,0)
+
+    def __getstate__(self):
+        # Only the name crosses the process boundary, the child attaches
+        return {'slot_count':self.slot_count, 'slot_size':self.slot_size,
+                'name':self._shm.name}
+
+    def __setstate__(self, state):
+        self.slot_count = state['slot_count']
+        self.slot_size = state['slot_size']
+        self._shm = shared_memory.SharedMemory(name=state['name'], create=False)
+        self._owner = False
+        self._untrack()
+        self._map_arrays()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def overflow_count(self):
+        return int(self._ctrl[0]['overflow_count'])
+
+    def pending(self):
+        ctrl = self._ctrl[0]
+        return int(ctrl['write_seq'] - ctrl['read_seq'])
+
+    def write(self, frame):
+        # Writer side.  Returns (slot, seq) or None if the frame was dropped.
+        size = len(frame)
+        ctrl = self._ctrl[0]
+        seq = int(ctrl['write_seq'])
+        if size > self.slot_size or seq - int(ctrl['read_seq']) >= self.slot_count:
+            self._ctrl['overflow_count'] += 1
+            return None
+
+        slot = seq % self.slot_count
+        self._data[slot,0:size] = np.frombuffer(frame, dtype=np.uint8)
+        self._slots[slot] = (seq,size,0)
+        # Publish the frame only after the data and slot entry are written
+        self._ctrl['write_seq'] = seq + 1
+        return slot, seq
+
+    def read(self, slot, seq):
+        # Reader side.  Returns a read only numpy view of the frame, or None
+        # if the slot does not hold the expected frame.
+        entry = self._slots[slot]
+        if int(entry['seq']) != seq or seq >= int(self._ctrl[0]['write_seq']):
+            logger.debug('Ring slot %d does not hold seq %d' % (slot, seq))
+            return None
+        view = self._data[slot,0:int(entry['size'])]
+        view.flags.writeable = False
+        return view
+
+    def release(self, seq):
+        # Reader side.  Slots up to and including seq may be reused.
+        if seq + 1 > int(self._ctrl[0]['read_seq']):
+            self._ctrl['read_seq'] = seq + 1
+
+    def close(self):
+        self._ctrl = None
+        self._slots = None
+        self._data = None
+        try:
+            self._shm.close()
+        except Exception as e:
+            # Views handed to the reader may still be alive
+            logger.debug('Problem closing shared ring, continuing')
+            logger.debug(str(e))
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except Exception as e:
+                logger.debug('Problem unlinking shared ring, continuing')
+                logger.debug(str(e))
+
+    def _total_size(self):
+        return RING_CTRL_DTYPE.itemsize + \
+            self.slot_count*RING_SLOT_DTYPE.itemsize + \
+            self.slot_count*self.slot_size
+
+    def _map_arrays(self):
+        buf = self._shm.buf
+        offset = 0
+        self._ctrl = np.ndarray((1,), dtype=RING_CTRL_DTYPE, buffer=buf, offset=offset)
+        offset = offset + RING_CTRL_DTYPE.itemsize
+        self._slots = np.ndarray((self.slot_count,), dtype=RING_SLOT_DTYPE, buffer=buf, offset=offset)
+        offset = offset + self.slot_count*RING_SLOT_DTYPE.itemsize
+        self._data = np.ndarray((self.slot_count,self.slot_size), dtype=np.uint8, buffer=buf, offset=offset)
+
+    def _untrack(self):
+        # Attaching registers the segment with the resource tracker, which
+        # would unlink it when this process exits.  Only the owner unlinks.
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+        except Exception:
+            pass
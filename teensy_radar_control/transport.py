@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 20:02:37 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Byte transports for SerialPacketHandler.  Every transport looks like the
+part of serial.Serial the handlers use: read(), write(), flush(),
+in_waiting, fileno(), reset_input_buffer(), reset_output_buffer() and
+close(), and raises serial.SerialException on errors.
+
+    COM3, /dev/ttyACM0           serial port
+    tcp://host:port              TCP client
+    udp://host:port              UDP, datagrams to and from host:port
+    udp://:port                  UDP, listen on port, reply to the sender
+    replay://path/capture.bin    raw byte capture, at maximum speed
+    replay://path?speed=1.0      ... paced by the pulse lengths, x speed
+    replay://path?loop=1         ... starting over at the end
+
+replay:// also takes the timestamped captures SerialPacketHandler writes
+with capture_path, see capture.py.  Those are paced by the recorded read
+times.
+"""
+import logging
+import io, time, struct, socket, select
+from urllib.parse import urlsplit, parse_qs
+
+import serial
+from cobs import cobs
+
+from teensy_radar_control import message, capture
+
+try:
+    import fcntl, termios
+except ImportError:
+    # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Read size used where the bytes waiting on a socket can not be counted
+SOCKET_READ_SIZE = 65536
+
+def open_transport(port, baudrate=2000000, timeout=None, write_timeout=None):
+    # Plain port names open a serial port
+    url = urlsplit(port)
+    if url.scheme == 'tcp':
+        return TcpTransport(url.hostname, url.port, timeout=timeout, write_timeout=write_timeout)
+    elif url.scheme == 'udp':
+        return UdpTransport(url.hostname, url.port, timeout=timeout, write_timeout=write_timeout)
+    elif url.scheme == 'replay':
+        query = parse_qs(url.query)
+        speed = query.get('speed', [None])[0]
+        if speed is not None and speed != 'max':
+            speed = float(speed)
+        else:
+            speed = None
+        loop = query.get('loop', ['0'])[0] not in ('0', 'false', 'False', '')
+        return ReplayTransport(url.netloc + url.path, speed=speed, loop=loop, timeout=timeout)
+    return serial.Serial(port=port, baudrate=baudrate, timeout=timeout, write_timeout=write_timeout)
+
+def pollable(port):
+    # True if poll() on port.fileno() tells when data is waiting
+    try:
+        port.fileno()
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return False
+    return True
+
+
+class _SocketTransport(object):
+    def __init__(self, sock, timeout=None, write_timeout=None):
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self._sock = sock
+        self._sock.setblocking(False)
+        self.is_open = True
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    @property
+    def in_waiting(self):
+        if fcntl is None:
+            return SOCKET_READ_SIZE
+        try:
+            buf = fcntl.ioctl(self._sock.fileno(), termios.FIONREAD, b'\x00\x00\x00\x00')
+        except OSError as e:
+            raise serial.SerialException(str(e))
+        return struct.unpack('I', buf)[0]
+
+    def read(self, size=1):
+        # Returns whatever arrives first, up to size bytes, or b'' after
+        # timeout
+        if not self._wait(False, self.timeout):
+            return b''
+        return self._recv(size)
+
+    def write(self, data):
+        view = memoryview(data)
+        if self.write_timeout == 0:
+            # Non blocking, returns the bytes written like serial.Serial
+            try:
+                return self._send(view)
+            except (BlockingIOError, InterruptedError):
+                return 0
+            except OSError as e:
+                raise serial.SerialException('write failed: %s' % (e,))
+        while len(view) > 0:
+            if not self._wait(True, self.write_timeout):
+                raise serial.SerialTimeoutException('Write timeout')
+            try:
+                size = self._send(view)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError as e:
+                raise serial.SerialException('write failed: %s' % (e,))
+            view = view[size:]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        while self._wait(False, 0) and len(self._recv(SOCKET_READ_SIZE)) > 0:
+            pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+        try:
+            self._sock.close()
+        except OSError as e:
+            raise serial.SerialException(str(e))
+
+    def _wait(self, writing, timeout):
+        # True once the socket is readable (or writable)
+        rlist = [] if writing else [self._sock]
+        wlist = [self._sock] if writing else []
+        try:
+            readable, writable, failed = select.select(rlist, wlist, [self._sock], timeout)
+        except (OSError, ValueError) as e:
+            raise serial.SerialException('select failed: %s' % (e,))
+        if failed:
+            raise serial.SerialException('Socket error')
+        return len(readable) + len(writable) > 0
+
+    def _recv(self, size):
+        try:
+            return self._sock.recv(size)
+        except (BlockingIOError, InterruptedError):
+            return b''
+        except OSError as e:
+            raise serial.SerialException('read failed: %s' % (e,))
+
+    def _send(self, view):
+        return self._sock.send(view)
+
+
+class TcpTransport(_SocketTransport):
+    def __init__(self, host, port, timeout=None, write_timeout=None):
+        try:
+            sock = socket.create_connection((host, port), timeout=5.0)
+        except OSError as e:
+            raise serial.SerialException('could not connect to %s:%s: %s' % (host, port, e))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().__init__(sock, timeout=timeout, write_timeout=write_timeout)
+
+    def _recv(self, size):
+        data = super()._recv(size)
+        if len(data) == 0 and self._wait(False, 0):
+            # Readable with nothing to read, the other end closed
+            raise serial.SerialException('Connection closed by peer')
+        return data
+
+
+class UdpTransport(_SocketTransport):
+    # Datagrams can not be read in pieces, so each one is received whole
+    # and handed out from a buffer.  With no host, listen on port and send
+    # to whoever sent last.
+    def __init__(self, host, port, timeout=None, write_timeout=None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024*1024)
+        try:
+            if host:
+                sock.connect((host, port))
+                self._peer = (host, port)
+            else:
+                sock.bind(('', port))
+                self._peer = None
+        except OSError as e:
+            sock.close()
+            raise serial.SerialException('could not open udp port %s:%s: %s' % (host, port, e))
+        self._connected = bool(host)
+        self._buf = bytearray()
+        super().__init__(sock, timeout=timeout, write_timeout=write_timeout)
+
+    @property
+    def in_waiting(self):
+        return len(self._buf) + super().in_waiting
+
+    def read(self, size=1):
+        if len(self._buf) == 0:
+            if not self._wait(False, self.timeout):
+                return b''
+            self._buf.extend(self._recv(SOCKET_READ_SIZE))
+        data = bytes(self._buf[0:size])
+        del self._buf[0:size]
+        return data
+
+    def reset_input_buffer(self):
+        self._buf.clear()
+        super().reset_input_buffer()
+
+    def _recv(self, size):
+        try:
+            data, peer = self._sock.recvfrom(size)
+        except (BlockingIOError, InterruptedError):
+            return b''
+        except OSError as e:
+            raise serial.SerialException('read failed: %s' % (e,))
+        if not self._connected:
+            self._peer = peer
+        return data
+
+    def _send(self, view):
+        if self._connected:
+            return self._sock.send(view)
+        if self._peer is None:
+            raise serial.SerialTimeoutException('No udp peer to write to yet')
+        return self._sock.sendto(view, self._peer)
+
+
+class ReplayTransport(object):
+    # Plays back a raw byte capture of the serial stream.  Writes are
+    # dropped.  With speed=None the bytes go out as fast as they are read.
+    # Otherwise each frame is held back so pulses come out at
+    # speed x the real pulse rate, given by pulse_length_ms in the pulse
+    # headers.  At the end of the file the port goes quiet, or starts over
+    # with loop.
+    #
+    # Timestamped captures (capture.py) are handed out a recorded chunk at
+    # a time, each one due at its recorded time / speed.
+    #
+    # There is no file descriptor to poll, reads wait up to timeout.
+    #
+    def __init__(self, path, speed=None, loop=False, timeout=None, chunk_size=1<<20):
+        try:
+            self._fh = open(path, 'rb')
+        except OSError as e:
+            raise serial.SerialException('could not open capture %s: %s' % (path, e))
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.is_open = True
+
+        try:
+            self.is_capture = capture.is_capture(self._fh)
+        except ValueError as e:
+            self._fh.close()
+            raise serial.SerialException('could not read capture %s: %s' % (path, e))
+        self._data_start = self._fh.tell()
+
+        # Paced replay.  _data[_pos:] is read but not framed yet, _frame is
+        # being handed out.
+        self._data = b''
+        self._pos = 0
+        self._frame = b''
+        self._frame_due = None
+        self._clock = None
+        self._record_start = None
+
+    def fileno(self):
+        raise io.UnsupportedOperation('ReplayTransport has no file descriptor')
+
+    @property
+    def in_waiting(self):
+        return len(self._frame)
+
+    def read(self, size=1):
+        if self.speed is None and not self.is_capture:
+            data = self._fh.read(size)
+            if len(data) == 0:
+                if self.loop:
+                    self._fh.seek(0)
+                    data = self._fh.read(size)
+                else:
+                    self._idle(time.perf_counter())
+            return data
+
+        start = time.perf_counter()
+        out = bytearray()
+        while len(out) < size:
+            if len(self._frame) == 0 and not self._next_frame():
+                if len(out) == 0:
+                    self._idle(start)
+                break
+            wait = self._frame_due - time.perf_counter()
+            if wait > 0.0:
+                if len(out) > 0:
+                    break
+                if self.timeout is not None:
+                    wait = min(wait, start + self.timeout - time.perf_counter())
+                if wait <= 0.0:
+                    break
+                time.sleep(wait)
+                continue
+            take = self._frame[0:size-len(out)]
+            out.extend(take)
+            self._frame = self._frame[len(take):]
+        return bytes(out)
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+        self._fh.close()
+
+    def _idle(self, start):
+        # End of the capture, like a radar that stopped sending
+        if self.timeout is not None:
+            time.sleep(max(start + self.timeout - time.perf_counter(), 0.0))
+
+    def _next_frame(self):
+        # Load the next frame and work out when it is due
+        if self.is_capture:
+            return self._next_record()
+
+        idx = self._data.find(b'\x00', self._pos)
+        while idx < 0:
+            chunk = self._fh.read(self.chunk_size)
+            if len(chunk) == 0 and self.loop and self._fh.tell() > 0:
+                self._fh.seek(0)
+                continue
+            self._data = self._data[self._pos:] + chunk
+            self._pos = 0
+            if len(chunk) == 0:
+                # Hand out what is left, as is
+                self._frame = self._data
+                self._data = b''
+                self._frame_due = time.perf_counter()
+                return len(self._frame) > 0
+            idx = self._data.find(b'\x00')
+        self._frame = self._data[self._pos:idx+1]
+        self._pos = idx + 1
+
+        if self._clock is None:
+            self._clock = time.perf_counter()
+        self._clock = self._clock + self._frame_period(self._frame[0:-1])/self.speed
+        self._frame_due = self._clock
+        return True
+
+    def _next_record(self):
+        # Load the next captured chunk, due at its recorded time
+        record = capture.read_record(self._fh)
+        if record is None and self.loop and self._fh.tell() > self._data_start:
+            self._fh.seek(self._data_start)
+            self._record_start = None
+            record = capture.read_record(self._fh)
+        if record is None:
+            return False
+        clock, self._frame = record
+
+        now = time.perf_counter()
+        if self.speed is None:
+            self._frame_due = now
+        else:
+            if self._record_start is None:
+                self._clock = now
+                self._record_start = clock
+            self._frame_due = self._clock + (clock - self._record_start)/self.speed
+        return True
+
+    def _frame_period(self, frame):
+        # Time the radar takes to produce a frame, zero except for pulses
+        try:
+            msg = cobs.decode(frame)
+            if len(msg) >= 8 + 32:
+                unique_word, msg_size, msg_type = struct.unpack_from('IHH', msg, 0)
+                if unique_word == message.MSG_UNIQUE_WORD and msg_type in (message.MSG_TYPE_PULSE, message.MSG_TYPE_PULSE12):
+                    pulse_length_ms, = struct.unpack_from('H', msg, 8 + 18)
+                    return pulse_length_ms/1000.0
+        except cobs.DecodeError:
+            pass
+        return 0.0
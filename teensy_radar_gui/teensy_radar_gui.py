@@ -15,6 +15,7 @@ from pyqtgraph.Qt import QtCore, QtWidgets, QtGui
 import serial.tools.list_ports
 
 from teensy_radar_control.handler import ExtendedRadarHandler
+from teensy_radar_control import message
 import RadarProcessors
 
 
@@ -429,6 +430,10 @@ class RadarDisplay(QtWidgets.QMainWindow, RadarGUI.Ui_MainWindow):
                 self.connect_status_le.setStyleSheet('background-color: yellow; color: black;')
                 txt = 'Wait'
                 self.connect_status_le.setText(txt)
+        elif self.rh.is_reconnecting():
+            # The handler is bringing the radar back, collections carry on
+            self.connect_status_le.setStyleSheet('background-color: yellow; color: black;')
+            self.connect_status_le.setText('Reconnect')
         else:
             self.connect_status_le.setStyleSheet('background-color: red; color: black;')
             self.connect_status_le.setText('None')
@@ -451,6 +456,14 @@ class RadarDisplay(QtWidgets.QMainWindow, RadarGUI.Ui_MainWindow):
             except queue.Empty:
                 break
 
+            # The radar was lost and came back between these pulses
+            if isinstance(pulse, message.msg_gap):
+                msg_str = '%s GAP: %.2f s without the radar after pulse %s, reconnected on %s' % \
+                    (datetime.now().isoformat(), pulse.restored_clock - pulse.lost_clock,
+                     pulse.last_pulse_number, pulse.port)
+                self.log_area.appendPlainText(msg_str)
+                continue
+
             # If a record is in progress, add the pulse
             if self.record_collection_running and self.rcp.in_progress():
                 try:
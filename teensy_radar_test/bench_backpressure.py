@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 23:31:02 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Pulses lost to a consumer stall under each read_queue policy.  The parent
+reads for 1 s, stops reading for 3 s like a stalled GUI, then catches up.
+Missing pulses are counted from gaps in the pulse numbers.
+"""
+import time, struct
+
+from teensy_radar_control import emulator, packet, message
+
+
+def run(policy, rate, stall):
+    emu = emulator.RadarEmulator(pulse_rate=rate, use_process=True).start()
+    sph = packet.SerialPacketHandler(emu.port, queue_policy=policy)
+    sph.write_packet(b'S  10  10 2400.000 2480.000    0.000 \x00')
+
+    numbers = []
+    def drain(seconds):
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < seconds:
+            for pkt in sph.read_packets(timeout=0.05):
+                msg_type, = struct.unpack_from('H', pkt, 6)
+                if msg_type == message.MSG_TYPE_PULSE:
+                    numbers.append(struct.unpack_from('I', pkt, 12)[0])
+
+    drain(1.0)
+    time.sleep(stall)
+    drain(stall)
+    sph.write_packet(b'X')
+    drain(0.5)
+
+    stats = sph.stats()['counts']
+    emu_dropped = emu.pulses_dropped
+    sph.join()
+    emu.join()
+    missing = (numbers[-1] - numbers[0] + 1) - len(numbers)
+    return len(numbers), missing, emu_dropped, stats
+
+
+def main():
+    rate = 2000
+    stall = 3.0
+    print('%d pulses/s, %.1f s consumer stall' % (rate, stall))
+    print('%-12s %8s %8s %10s  %s' % ('policy','pulses','missing','emu drops','counters'))
+    for policy in packet.SerialPacketHandler.QUEUE_POLICIES:
+        count, missing, emu_dropped, stats = run(policy, rate, stall)
+        counters = ['%s=%.1f' % (name, value) for name, value in stats.items()
+                    if value and name.startswith(('queue_', 'spill', 'unspill'))]
+        print('%-12s %8d %8d %10d  %s' % (policy, count, missing, emu_dropped, ' '.join(counters)))
+
+
+if __name__ == '__main__':
+    main()
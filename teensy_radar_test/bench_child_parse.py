@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 22:51:18 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+CPU time the parent (GUI) process spends per pulse, with messages parsed
+in the parent _bg_thread or in the serial child (parse_in_child).  Pulses
+come from the pty radar emulator through ExtendedRadarHandler.  Parsing in
+the child pays off once pulses cross the process boundary in blocks, so
+both are also run with a 5 ms batch_latency.
+"""
+import time, queue
+
+from teensy_radar_control import emulator, handler
+
+
+def run(rate, seconds, parse_in_child, batch_latency):
+    emu = emulator.RadarEmulator(pulse_rate=rate, use_process=True).start()
+    rh = handler.ExtendedRadarHandler(parse_in_child=parse_in_child, batch_latency=batch_latency)
+    rh.connect(emu.port)
+    rh.cmd_start(10, 10, 2400.0, 2480.0, 0.0)
+    time.sleep(0.5)
+    rh.sph.reset_stats()
+    count = 0
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        try:
+            rh.get_pulse(block=True, timeout=0.1)
+        except queue.Empty:
+            continue
+        count = count + 1
+        while not rh.log_queue.empty():
+            rh.get_log_msg(block=False)
+    dt = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+    stats = rh.sph.stats()
+    rh.cmd_stop()
+    rh.join()
+    emu.join()
+    return count/dt, cpu/dt, cpu/max(count,1), stats
+
+
+def main():
+    seconds = 5.0
+    print('%-8s %8s %8s %10s %10s %12s %12s' % ('parse','batch','rate','recv/s','cpu %','us/pulse','queue drops'))
+    for rate in (1000, 2000):
+        for batch_latency in (0.0, 0.005):
+            for parse_in_child in (False, True):
+                recv_rate, cpu_load, cpu_pulse, stats = run(rate, seconds, parse_in_child, batch_latency)
+                print('%-8s %8.3f %8d %10.0f %10.1f %12.1f %12d' %
+                      ('child' if parse_in_child else 'parent', batch_latency, rate, recv_rate,
+                       100.0*cpu_load, 1e6*cpu_pulse, stats['counts']['queue_full_drops']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 05:20:13 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Accuracy of the pulse acq_clock from clocksync against the pty radar
+emulator.  The emulator runs as a thread so its pulse schedule, the true
+acquisition times, can be read back.  Compared with stamping pulses when
+get_pulse() returns them.
+"""
+import time, queue
+
+import numpy as np
+
+from teensy_radar_control import emulator, handler
+
+
+def run(pulse_rate, duration):
+    emu = emulator.RadarEmulator(pulse_rate=pulse_rate, use_process=False).start()
+    rh = handler.ExtendedRadarHandler()
+    rh.connect(emu.port)
+    rh.cmd_start(10, 10, 2400.0, 2480.0, 0.0)
+
+    rows = []
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < duration:
+        try:
+            pulse = rh.get_pulse(block=True, timeout=0.1)
+        except queue.Empty:
+            continue
+        if pulse.acq_clock is not None:
+            rows.append((pulse.header.pulse_number, pulse.acq_clock, time.perf_counter()))
+    report = rh.clock_sync.report()
+    rh.join()
+
+    rows = np.array(rows)
+    true_clock = emu._pulse_clock + rows[:,0]*emu._pulse_period
+    emu.join()
+    return rows[:,1] - true_clock, rows[:,2] - true_clock, report
+
+
+def main():
+    duration = 10.0
+    print('%6s %22s %22s %10s' % ('rate','acq_clock err us','get_pulse err us','drift ppm'))
+    print('%6s %11s %10s %11s %10s' % ('','mean','std','mean','std'))
+    for pulse_rate in (200, 1000, 2000):
+        acq_err, get_err, report = run(pulse_rate, duration)
+        print('%6d %11.1f %10.1f %11.1f %10.1f %10.2f' %
+              (pulse_rate, 1e6*np.mean(acq_err), 1e6*np.std(acq_err),
+               1e6*np.mean(get_err), 1e6*np.std(get_err), report['pulse_drift_ppm']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 14:25:07 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Benchmark of codec.decode_frames() against cobs.decode() on batches of
+pulse frames with ADC like sample data.  Also checks the results match.
+"""
+import struct, time
+import numpy as np
+from cobs import cobs
+
+from teensy_radar_control import codec, message
+
+try:
+    from cobs.cobs import _cobs_py
+except ImportError:
+    _cobs_py = None
+
+
+def make_frames(pcount, data_size):
+    frames = []
+    for ii in range(0,pcount):
+        data = np.random.normal(32768,3000,size=data_size)
+        data = np.clip(data,0,65535).astype('<u2')
+        header = struct.pack('HHIIIHHfff', 32, data_size, ii, ii*1000, 0, 10,
+                             data_size//50, 2400.0, 2480.0, 0.0)
+        payload = header + data.tobytes()
+        msg = struct.pack('IHH', message.MSG_UNIQUE_WORD, len(payload),
+                          message.MSG_TYPE_PULSE) + payload
+        frames.append(msg)
+    return frames
+
+
+def check(frames, buf):
+    out = bytearray(len(buf))
+    consumed, offsets, sizes, ok = codec.decode_frames(buf, out)
+    assert consumed == len(buf)
+    assert np.all(ok)
+    for msg, off, size in zip(frames, offsets, sizes):
+        assert bytes(out[off:off+size]) == msg
+
+
+def rate(func, count, reps):
+    t0 = time.perf_counter()
+    for ii in range(0,reps):
+        func()
+    return count*reps/(time.perf_counter() - t0)
+
+
+def main():
+    print('%9s %6s %14s %14s %14s' % ('data_size','batch','cobs (C) f/s','cobs (py) f/s','numpy f/s'))
+    for data_size in (250, 1000, 2000):
+        for batch in (1, 10, 50, 200):
+            frames = make_frames(batch, data_size)
+            encoded = [cobs.encode(f) for f in frames]
+            buf = b''.join([e + b'\x00' for e in encoded])
+            out = bytearray(len(buf))
+            check(frames, buf)
+
+            reps = max(1, 1000//batch)
+            c_rate = rate(lambda: [cobs.decode(e) for e in encoded], batch, reps)
+            py_rate = float('nan')
+            if _cobs_py is not None:
+                py_rate = rate(lambda: [_cobs_py.decode(e) for e in encoded], batch, max(1,reps//10))
+            np_rate = rate(lambda: codec.decode_frames(buf, out), batch, reps)
+            print('%9d %6d %14.0f %14.0f %14.0f' % (data_size, batch, c_rate, py_rate, np_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 02:04:16 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Connect and reconnect time against the pty radar emulator: how long
+connect() takes, and how long until the first pulse after cmd_start().
+"""
+import time, queue
+
+import numpy as np
+
+from teensy_radar_control import emulator, handler
+
+
+def main():
+    cycles = 10
+    emu = emulator.RadarEmulator(use_process=True).start()
+    rh = handler.ExtendedRadarHandler()
+
+    connect = []
+    first_pulse = []
+    start_to_first = []
+    reconnect = []
+    for ii in range(0,cycles):
+        t0 = time.perf_counter()
+        if ii > 0:
+            rh.disconnect()
+        rh.connect(emu.port)
+        rh.cmd_start(10, 10, 2400.0, 2480.0, 0.0)
+        try:
+            rh.get_pulse(block=True, timeout=5.0)
+        except queue.Empty:
+            print('No pulse on cycle %d' % (ii,))
+            continue
+        if ii > 0:
+            reconnect.append(time.perf_counter() - t0)
+        stats = rh.connect_stats()
+        connect.append(stats['connect'])
+        first_pulse.append(stats['first_pulse'])
+        start_to_first.append(stats['start_to_first_pulse'])
+        rh.cmd_stop()
+
+    rh.join()
+    emu.join()
+
+    print('%d cycles, ms     mean     max' % (cycles,))
+    for name, values in (('connect()', connect), ('first pulse', first_pulse),
+                         ('start to pulse', start_to_first),
+                         ('reconnect to pulse', reconnect)):
+        print('  %-18s %7.1f %7.1f' % (name, 1e3*np.mean(values), 1e3*np.max(values)))
+
+
+if __name__ == '__main__':
+    main()
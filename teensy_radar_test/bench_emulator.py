@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 18:55:12 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+End to end throughput of the host software against the pty radar
+emulator.  Sweeps the pulse rate past what the host can take and reports
+pulses received, pulses the emulator had to drop, and the link counters.
+"""
+import time, queue
+
+from teensy_radar_control import emulator, handler, packet
+
+
+def run_packets(emu, seconds):
+    # SerialPacketHandler alone, raw packets
+    sph = packet.SerialPacketHandler(emu.port)
+    sph.write_packet(b'S  10  10 2400.000 2480.000    0.000 \x00')
+    sph.reset_stats()
+    dropped = emu.pulses_dropped
+    count = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        count = count + len(sph.read_packets(timeout=0.1))
+    dt = time.perf_counter() - t0
+    stats = sph.stats()
+    dropped = emu.pulses_dropped - dropped
+    sph.write_packet(b'X')
+    sph.join()
+    return count/dt, dropped, stats
+
+
+def run_handler(emu, seconds):
+    # ExtendedRadarHandler, parsed pulses
+    rh = handler.ExtendedRadarHandler()
+    rh.connect(emu.port)
+    rh.cmd_start(10, 10, 2400.0, 2480.0, 0.0)
+    rh.sph.reset_stats()
+    dropped = emu.pulses_dropped
+    count = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        try:
+            rh.get_pulse(block=True, timeout=0.1)
+        except queue.Empty:
+            continue
+        count = count + 1
+        # The handler blocks once its log queue is full, keep it drained
+        # like the GUI does
+        while not rh.log_queue.empty():
+            rh.get_log_msg(block=False)
+    dt = time.perf_counter() - t0
+    stats = rh.sph.stats()
+    dropped = emu.pulses_dropped - dropped
+    rh.cmd_stop()
+    rh.join()
+    return count/dt, dropped, stats
+
+
+def main():
+    seconds = 5.0
+    print('%-8s %10s %10s %10s %10s %8s' % ('stack','rate','recv/s','MB/s','emu drops','resyncs'))
+    for name, func in (('packets', run_packets), ('handler', run_handler)):
+        for rate in (100, 1000, 5000, 10000, 20000, 40000):
+            emu = emulator.RadarEmulator(pulse_rate=rate, use_process=True).start()
+            recv_rate, dropped, stats = func(emu, seconds)
+            emu.join()
+            print('%-8s %10d %10.0f %10.1f %10d %8d' %
+                  (name, rate, recv_rate, stats['rates']['bytes_received']/1e6,
+                   dropped, stats['counts']['resyncs']))
+
+
+if __name__ == '__main__':
+    main()
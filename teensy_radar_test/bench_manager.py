@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 00:48:09 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Several pty radar emulators read by one SerialPacketHandler each, or by a
+single RadarManager.  Reports pulses received per radar, emulator drops,
+host CPU and the thread count of the host processes.
+"""
+import os, time, struct
+
+import psutil
+
+from teensy_radar_control import emulator, packet, manager, message
+
+START = b'S  10  10 2400.000 2480.000    0.000 \x00'
+
+
+def host_usage(pids):
+    # (cpu seconds, threads) summed over the host processes
+    cpu = 0.0
+    threads = 0
+    for pid in pids:
+        p = psutil.Process(pid)
+        times = p.cpu_times()
+        cpu = cpu + times.user + times.system
+        threads = threads + p.num_threads()
+    return cpu, threads
+
+
+def count_pulses(packets):
+    count = 0
+    for pkt in packets:
+        if struct.unpack_from('H', pkt, 6)[0] == message.MSG_TYPE_PULSE:
+            count = count + 1
+    return count
+
+
+def run_handlers(emus, seconds):
+    sphs = [packet.SerialPacketHandler(emu.port) for emu in emus]
+    pids = [os.getpid()] + [sph._sp.pid for sph in sphs]
+    for sph in sphs:
+        sph.write_packet(START)
+    time.sleep(0.5)
+    counts = [0]*len(emus)
+    cpu0, threads = host_usage(pids)
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        for ii, sph in enumerate(sphs):
+            counts[ii] = counts[ii] + count_pulses(sph.read_packets(timeout=0.0))
+        time.sleep(0.001)
+    dt = time.perf_counter() - t0
+    cpu1, threads = host_usage(pids)
+    for sph in sphs:
+        sph.write_packet(b'X')
+        sph.join()
+    return [c/dt for c in counts], (cpu1-cpu0)/dt, len(pids), threads
+
+
+def run_manager(emus, seconds):
+    rm = manager.RadarManager([emu.port for emu in emus])
+    pids = [os.getpid(), rm._mp.pid]
+    for ii in range(0,len(emus)):
+        rm.write_packet(ii, START)
+    time.sleep(0.5)
+    counts = [0]*len(emus)
+    cpu0, threads = host_usage(pids)
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        for device_id, pkt in rm.read_packets(timeout=0.1):
+            if struct.unpack_from('H', pkt, 6)[0] == message.MSG_TYPE_PULSE:
+                counts[device_id] = counts[device_id] + 1
+    dt = time.perf_counter() - t0
+    cpu1, threads = host_usage(pids)
+    for ii in range(0,len(emus)):
+        rm.write_packet(ii, b'X')
+    rm.join()
+    return [c/dt for c in counts], (cpu1-cpu0)/dt, len(pids), threads
+
+
+def main():
+    seconds = 5.0
+    rate = 1000
+    print('%-9s %7s %9s %12s %9s %10s %8s' % ('host','radars','rate','recv/s/radar','emu drops','host cpu %','threads'))
+    for radars in (1, 2, 4):
+        for name, func in (('handlers', run_handlers), ('manager', run_manager)):
+            emus = [emulator.RadarEmulator(pulse_rate=rate, use_process=True).start()
+                    for ii in range(0,radars)]
+            rates, cpu, processes, threads = func(emus, seconds)
+            dropped = sum([emu.pulses_dropped for emu in emus])
+            for emu in emus:
+                emu.join()
+            print('%-9s %7d %9d %12.0f %9d %10.1f %8d' %
+                  (name, radars, rate, min(rates), dropped, 100.0*cpu, threads))
+
+
+if __name__ == '__main__':
+    main()
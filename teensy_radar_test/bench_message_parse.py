@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 03:10:42 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Per message cost of message.parse_message() for each message type:
+microseconds per message, and bytes and allocated blocks held per parsed
+message.  The used rows also read the pulse header and data, the batch
+rows are message.parse_messages() on the whole batch.
+"""
+import sys, gc, struct, time
+import tracemalloc
+
+import numpy as np
+
+from teensy_radar_control import message
+
+
+def make_msg(msg_type, payload):
+    return struct.pack('IHH', message.MSG_UNIQUE_WORD, len(payload), msg_type) + payload
+
+
+def make_msgs(count):
+    data_size = 250
+    data = np.clip(np.random.normal(2048,300,size=data_size),0,4095).astype('<u2')
+    msgs = {}
+    msgs['heartbeat'] = [make_msg(message.MSG_TYPE_HEARTBEAT, struct.pack('I', ii))
+                         for ii in range(0,count)]
+    msgs['log'] = [make_msg(message.MSG_TYPE_LOG, struct.pack('BB', 0, 1) + b'log line %d' % (ii,))
+                   for ii in range(0,count)]
+    msgs['reply'] = [make_msg(message.MSG_TYPE_REPLY, struct.pack('h', 0) + b'OK')
+                     for ii in range(0,count)]
+    msgs['pulse'] = [make_msg(message.MSG_TYPE_PULSE,
+                              struct.pack('HHIIIHHfff', 32, data_size, ii, ii*1000, 0, 10,
+                                          5, 2400.0, 2480.0, 0.0) + data.tobytes())
+                     for ii in range(0,count)]
+    msgs['pulse12'] = [make_msg(message.MSG_TYPE_PULSE12,
+                                struct.pack('HHIIIHHfff', 32, data_size, ii, ii*1000, 0, 10,
+                                            5, 2400.0, 2480.0, 0.0) + message.pack12(data))
+                       for ii in range(0,count)]
+    return msgs
+
+
+def measure(func, count, reps):
+    # Best time of reps calls to func, and the bytes and allocated blocks
+    # held by what it returns, per message
+    best = None
+    for ii in range(0,reps):
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+
+    # Memory held by the parsed messages, not counting the frames
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    parsed = func()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    blocks = sys.getallocatedblocks() - blocks
+    del parsed
+    return best/count, held/count, blocks/count
+
+
+def use(pulse):
+    # What a consumer does with a pulse
+    return pulse.header.pulse_number, pulse.data[0]
+
+
+def main():
+    count = 20000
+    reps = 5
+    msgs = make_msgs(count)
+
+    rows = []
+    for name, batch in msgs.items():
+        rows.append((name, lambda batch=batch: [message.parse_message(msg) for msg in batch]))
+    for name in ('pulse', 'pulse12'):
+        batch = msgs[name]
+        rows.append((name + ' used', lambda batch=batch: [(p, use(p)) for p in map(message.parse_message, batch)]))
+    for name in ('pulse', 'pulse12'):
+        batch = msgs[name]
+        rows.append((name + ' batch', lambda batch=batch: message.parse_messages(batch)))
+
+    print('%-13s %10s %12s %12s' % ('type','us/msg','bytes/msg','blocks/msg'))
+    for name, func in rows:
+        dt, held, blocks = measure(func, count, reps)
+        print('%-13s %10.2f %12.0f %12.1f' % (name, 1e6*dt, held, blocks))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 01:27:50 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+12 bit packed pulses (MSG_TYPE_PULSE12) against 16 bit pulses: unpack cost
+on the host, and the pulse rate a bandwidth limited link sustains with the
+pty radar emulator.
+"""
+import time, struct
+
+import numpy as np
+
+from teensy_radar_control import emulator, packet, message
+
+
+def bench_unpack(data_size, pulses, repeat=200):
+    samples = np.random.default_rng(0).integers(0, 4096, size=(pulses,data_size)).astype('<u2')
+    packed = np.frombuffer(b''.join([message.pack12(row) for row in samples]), dtype=np.uint8)
+    packed = packed.reshape(pulses, -1)
+    if not np.array_equal(message.unpack12(packed, data_size), samples):
+        raise RuntimeError('unpack12 does not invert pack12')
+
+    t0 = time.perf_counter()
+    for ii in range(0,repeat):
+        message.unpack12(packed, data_size)
+    dt = time.perf_counter() - t0
+    return repeat*pulses*data_size/dt
+
+
+def bench_link(packed12, link_rate, seconds):
+    emu = emulator.RadarEmulator(pulse_rate=5000, data_size=500, link_rate=link_rate,
+                                 use_process=True, packed12=packed12).start()
+    sph = packet.SerialPacketHandler(emu.port)
+    sph.write_packet(b'S  10  10 2400.000 2480.000    0.000 \x00')
+    time.sleep(0.5)
+    sph.reset_stats()
+    count = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        for pkt in sph.read_packets(timeout=0.1):
+            msg_type, = struct.unpack_from('H', pkt, 6)
+            if msg_type in (message.MSG_TYPE_PULSE, message.MSG_TYPE_PULSE12):
+                # Unpacking is part of the host cost
+                message.parse_message(pkt)
+                count = count + 1
+    dt = time.perf_counter() - t0
+    stats = sph.stats()
+    sph.write_packet(b'X')
+    sph.join()
+    emu.join()
+    return count/dt, stats['rates']['bytes_received']
+
+
+def main():
+    print('unpack12, Msamples/s')
+    for data_size, pulses in ((500, 1), (500, 100), (2000, 100)):
+        print('  data_size %4d x %3d pulses %8.1f' % (data_size, pulses, bench_unpack(data_size, pulses)/1e6))
+
+    seconds = 5.0
+    link_rate = 1.0e6
+    print('500 sample pulses over a %.1f MB/s link' % (link_rate/1e6,))
+    print('  %-8s %10s %10s' % ('samples','pulses/s','MB/s'))
+    for packed12 in (False, True):
+        rate, byte_rate = bench_link(packed12, link_rate, seconds)
+        print('  %-8s %10.0f %10.2f' % ('12 bit' if packed12 else '16 bit', rate, byte_rate/1e6))
+
+
+if __name__ == '__main__':
+    main()
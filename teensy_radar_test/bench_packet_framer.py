@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 09:12:40 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Microbenchmark of the serial framing used in the SerialMonitor process.
+Compares the original bytes/partition framer against PacketFramer on a
+stream of COBS encoded pulse messages delivered in serial sized chunks.
+Each pass through a loop also pays for the write_queue.empty() check the
+run loop makes, since the old framer costs one loop pass per packet.
+"""
+import struct, time
+import multiprocessing as mp
+import numpy as np
+from cobs import cobs
+
+from teensy_radar_control import message
+from teensy_radar_control.packet import PacketFramer
+
+
+def make_stream(pcount, data_size):
+    frames = []
+    for ii in range(0,pcount):
+        data = np.random.randint(0,65536,size=data_size).astype('<u2')
+        header = struct.pack('HHIIIHHfff', 32, data_size, ii, ii*1000, 0, 10,
+                             data_size//50, 2400.0, 2480.0, 0.0)
+        payload = header + data.tobytes()
+        msg = struct.pack('IHH', message.MSG_UNIQUE_WORD, len(payload),
+                          message.MSG_TYPE_PULSE) + payload
+        frames.append(cobs.encode(msg) + b'\x00')
+    return b''.join(frames)
+
+
+class ChunkReader(object):
+    # Stands in for serial.Serial.read(), handing out at most chunk bytes
+    def __init__(self, stream, chunk):
+        self.stream = stream
+        self.chunk = chunk
+        self.pos = 0
+
+    def read(self, size):
+        size = min(size, self.chunk)
+        dat = self.stream[self.pos:self.pos+size]
+        self.pos = self.pos + len(dat)
+        return dat
+
+    def done(self):
+        return self.pos >= len(self.stream)
+
+
+def legacy_framer(reader, write_queue, max_buf_len=6000):
+    # The original _sp_read_packet(), one packet per call
+    count = 0
+    buf = b''
+    while True:
+        write_queue.empty()
+        dat,sep,rest = buf.partition(b'\x00')
+        if sep == b'\x00':
+            buf = rest
+        else:
+            if reader.done():
+                break
+            read_bytes = reader.read(max_buf_len - len(buf))
+            buf = buf + read_bytes
+            dat,sep,rest = buf.partition(b'\x00')
+            if sep == b'\x00':
+                buf = rest
+            elif len(buf) >= max_buf_len:
+                buf = b''
+        if dat != b'':
+            cobs.decode(dat)
+            count = count + 1
+    return count
+
+
+def packet_framer(reader, write_queue, max_buf_len=6000):
+    count = 0
+    framer = PacketFramer(max_buf_len=max_buf_len)
+    while not reader.done():
+        write_queue.empty()
+        framer.feed(reader.read(framer.free_space()))
+        for dat in framer.frames():
+            cobs.decode(dat)
+            count = count + 1
+    return count
+
+
+def run(name, func, stream, chunk, max_buf_len):
+    reader = ChunkReader(stream, chunk)
+    write_queue = mp.Queue(maxsize=1)
+    t0 = time.perf_counter()
+    count = func(reader, write_queue, max_buf_len)
+    dt = time.perf_counter() - t0
+    print('  %-8s %6d frames %10.0f frames/s %8.1f MB/s' %
+          (name, count, count/dt, len(stream)/dt/1e6))
+
+
+def main():
+    pcount = 10000
+    for data_size in (250, 1000, 2000):
+        stream = make_stream(pcount, data_size)
+        for chunk, max_buf_len in ((6000, 6000), (65536, 65536)):
+            print('data_size=%d chunk=%d max_buf_len=%d' % (data_size, chunk, max_buf_len))
+            run('legacy', legacy_framer, stream, chunk, max_buf_len)
+            run('framer', packet_framer, stream, chunk, max_buf_len)
+
+
+if __name__ == '__main__':
+    main()
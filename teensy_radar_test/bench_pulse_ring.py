@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 06:31:55 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Per pulse cost of handing pulses from the handler reader thread to the
+consumer, through two stages as in ExtendedRadarHandler: the old
+queue.Queue of msg_pulse objects against pulse_ring.PulseRingBuffer read
+a pulse at a time (get_pulse()) and a block at a time (get_pulses()).
+Microseconds per pulse and the peak memory allocated on the way over
+the whole run, not counting the preallocated rings.
+"""
+import gc, time
+import tracemalloc
+
+import numpy as np
+
+from teensy_radar_control import message, pulse_ring
+
+
+def make_block(count, data_size):
+    headers = np.zeros(count, dtype=message.PULSE_HEADER_DTYPE)
+    headers['hdr_size'] = 32
+    headers['data_size'] = data_size
+    headers['pulse_number'] = np.arange(count)
+    headers['pulse_cycle_count'] = 180000*np.arange(count)
+    data = np.clip(np.random.normal(2048,300,size=(count,data_size)),0,4095).astype('<u2')
+    return headers, data, np.arange(count, dtype=float)
+
+
+def via_queues(batches):
+    # Pulse objects through pulse_queue and extended_pulse_queue
+    import queue
+    pulse_queue = queue.Queue(maxsize=1000)
+    extended_queue = queue.Queue(maxsize=1000)
+    for headers, data, acq_clock in batches:
+        block = message.msg_pulse_block(headers, data)
+        for pulse, clock in zip(block.pulses(), acq_clock.tolist()):
+            pulse.acq_clock = clock
+            pulse_queue.put(pulse)
+        while not pulse_queue.empty():
+            extended_queue.put(pulse_queue.get())
+            pulse_queue.task_done()
+        while not extended_queue.empty():
+            pulse = extended_queue.get()
+            extended_queue.task_done()
+            pulse.header.pulse_number, pulse.data[0]
+
+
+def make_rings(batch):
+    # Allocated ahead, the arrays are not part of the per pulse cost
+    ring = pulse_ring.PulseRingBuffer()
+    extended_ring = pulse_ring.PulseRingBuffer()
+    ring.write(*batch)
+    extended_ring.write(*batch)
+    return ring, extended_ring
+
+
+def via_rings(rings, batches, by_block):
+    ring, extended_ring = rings
+    worker = ring.reader()
+    consumer = extended_ring.reader()
+    for batch in batches:
+        ring.write(*batch)
+        while worker.available() > 0:
+            extended_ring.write(*worker.read())
+        while consumer.available() > 0:
+            if by_block:
+                headers, data, acq_clock = consumer.get_block(block=False)
+                headers['pulse_number'], data[:,0]
+            else:
+                pulse = consumer.get(block=False)
+                pulse.header.pulse_number, pulse.data[0]
+
+
+def measure(func, count, reps):
+    best = None
+    for ii in range(0,reps):
+        gc.collect()
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    tracemalloc.start()
+    func()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best/count, peak
+
+
+def main():
+    batch_size = 100
+    count = 20000
+    reps = 5
+    print('%-10s %6s %10s %12s' % ('path','size','us/pulse','peak kB'))
+    for data_size in (250, 2000):
+        batch = make_block(batch_size, data_size)
+        batches = [batch]*(count//batch_size)
+        rings = make_rings(batch)
+        rows = (('queue', lambda: via_queues(batches)),
+                ('ring get', lambda: via_rings(rings, batches, False)),
+                ('ring block', lambda: via_rings(rings, batches, True)))
+        for name, func in rows:
+            dt, peak = measure(func, count, reps)
+            print('%-10s %6d %10.2f %12.1f' % (name, data_size, 1e6*dt, peak/1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 22:20:31 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+Frame drops of the serial child under CPU load for different scheduling
+settings.  Busy processes load every cpu while the pty radar emulator
+streams pulses.  The emulator runs SCHED_FIFO when permitted so that only
+the host side is starved.
+"""
+import os, time
+import multiprocessing as mp
+
+from teensy_radar_control import emulator, packet, scheduling
+
+
+def busy(stop):
+    while not stop.is_set():
+        pass
+
+
+def run(settings, rate, seconds, load):
+    emu = emulator.RadarEmulator(pulse_rate=rate, use_process=True).start()
+    scheduling.apply_scheduling(pid=emu._th.pid, sched_policy='fifo', sched_priority=50)
+
+    stop = mp.Event()
+    hogs = [mp.Process(target=busy, args=(stop,), daemon=True) for ii in range(0,load)]
+    for hog in hogs:
+        hog.start()
+
+    sph = packet.SerialPacketHandler(emu.port, **settings)
+    report = sph.scheduling()
+    sph.write_packet(b'S  10  10 2400.000 2480.000    0.000 \x00')
+    time.sleep(0.5)
+    sph.reset_stats()
+    dropped = emu.pulses_dropped
+    count = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        count = count + len(sph.read_packets(timeout=0.1))
+    dt = time.perf_counter() - t0
+    stats = sph.stats()
+    dropped = emu.pulses_dropped - dropped
+
+    stop.set()
+    for hog in hogs:
+        hog.join()
+    sph.write_packet(b'X')
+    sph.join()
+    emu.join()
+    return report, count/dt, dropped, stats
+
+
+def main():
+    seconds = 5.0
+    rate = 5000
+    load = 2*os.cpu_count()
+    cases = (('nice 20 (old)', {'nice': 20}),
+             ('nice 0', {'nice': 0}),
+             ('nice -10', {'nice': -10}),
+             ('fifo 20', {'nice': None, 'sched_policy': 'fifo', 'sched_priority': 20}),
+             ('fifo 20, cpu 0', {'nice': None, 'sched_policy': 'fifo', 'sched_priority': 20, 'cpu_affinity': [0]}))
+    print('%d pulses/s, %d busy processes, %d cpus' % (rate, load, os.cpu_count()))
+    print('%-16s %-26s %10s %10s %12s %8s' % ('setting','effective','recv/s','emu drops','queue drops','resyncs'))
+    for name, settings in cases:
+        report, recv_rate, dropped, stats = run(settings, rate, seconds, load)
+        effective = '%s/%s nice %s' % (report['sched_policy'], report['sched_priority'], report['nice'])
+        print('%-16s %-26s %10.0f %10d %12d %8d' %
+              (name, effective, recv_rate, dropped,
+               stats['counts']['queue_full_drops'], stats['counts']['resyncs']))
+
+
+if __name__ == '__main__':
+    main()
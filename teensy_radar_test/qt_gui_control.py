@@ -12,6 +12,7 @@ import threading, queue
 from datetime import datetime
 
 from teensy_radar_control.handler import BasicRadarHandler, ExtendedRadarHandler
+from teensy_radar_control import message
 import numpy as np
 
 import signal
@@ -421,6 +422,10 @@ class RadarDisplay(QtWidgets.QWidget):
             except queue.Empty:
                 break
 
+            # The radar was lost and came back between these pulses
+            if isinstance(pulse, message.msg_gap):
+                continue
+
             # Write pulses to file if required
             # TBD: does this need to be a copy?
             self.write_queue.put(copy.copy(pulse))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:22:48 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+integrity.PulseIntegrity must tell a radar restart with a small step back
+of pulse_number from late pulses.  Run with pytest.
+"""
+import numpy as np
+
+from teensy_radar_control import integrity
+
+# Pulse interval in CPU cycles
+PERIOD = 180000
+
+
+def stream(first, count, cycle_offset=0):
+    numbers = np.arange(first, first+count)
+    return numbers, numbers*PERIOD + cycle_offset
+
+
+def test_late_pulses_are_reordered():
+    tracker = integrity.PulseIntegrity()
+    tracker.update(*stream(0, 100))
+    numbers, cycles = stream(100, 10)
+    # Pulse 103 arrives after 105
+    order = [0, 1, 2, 4, 5, 3, 6, 7, 8, 9]
+    tracker.update(numbers[order], cycles[order])
+
+    report = tracker.report()
+    assert report['restarts'] == 0
+    assert report['reordered'] == 1
+    assert report['lost'] == 0
+
+
+def test_restart_small_step_back_from_cycle_counts():
+    tracker = integrity.PulseIntegrity()
+    tracker.update(*stream(0, 100))
+    # The radar restarts 40 pulses back, its cycle counter starts over
+    tracker.update(*stream(60, 100, cycle_offset=-59*PERIOD))
+
+    report = tracker.report()
+    assert report['restarts'] == 1
+    assert report['reordered'] == 0
+    assert report['duplicates'] == 0
+    assert report['lost'] == 0
+    assert report['received'] == 200
+
+
+def test_restart_from_heartbeat():
+    tracker = integrity.PulseIntegrity()
+    tracker.heartbeat(10000)
+    # No interval statistics yet, the cycle counts can not tell
+    tracker.update([5], [5*PERIOD])
+    tracker.heartbeat(2000)
+    tracker.update(*stream(3, 10))
+
+    report = tracker.report()
+    assert report['restarts'] == 1
+    assert report['reordered'] == 0
+    assert report['duplicates'] == 0
+    assert report['lost'] == 0
+
+
+def test_heartbeat_after_restart_in_pulses():
+    tracker = integrity.PulseIntegrity()
+    tracker.heartbeat(10000)
+    tracker.update(*stream(0, 100))
+    tracker.update(*stream(60, 100, cycle_offset=-59*PERIOD))
+    # The heartbeat going back is the restart already counted
+    tracker.heartbeat(2000)
+    tracker.update(*stream(160, 10, cycle_offset=-59*PERIOD))
+
+    report = tracker.report()
+    assert report['restarts'] == 1
+    assert report['lost'] == 0
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:40:12 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+packet.PacketFramer must not drop data fed past its free space, frames
+too long to be valid are resynced and counted.  Run with pytest.
+"""
+from teensy_radar_control.packet import PacketFramer
+
+
+def test_feed_past_free_space_keeps_frames():
+    framer = PacketFramer(max_buf_len=64)
+    frames = [bytes([i+1])*20 for i in range(10)]
+    stream = b''.join(f + b'\x00' for f in frames)
+
+    # One feed three times the buffer size
+    assert framer.feed(stream) == len(stream)
+    assert [bytes(f) for f in framer.frames()] == frames
+    assert framer.discarded_bytes == 0
+    assert framer.buffered() == 0
+
+
+def test_feed_past_free_space_counts_discarded():
+    framer = PacketFramer(max_buf_len=64)
+    # A lost delimiter, the partial frame is longer than max_frame_len
+    stream = b'\x02'*10 + b'\x00' + b'\x01'*200
+
+    assert framer.feed(stream) == len(stream)
+    assert [bytes(f) for f in framer.frames()] == [b'\x02'*10]
+    assert framer.resync_count == 1
+    assert framer.discarded_bytes == 200
+
+    # Dropped up to the next delimiter, then back in sync
+    framer.feed(b'\x01'*5 + b'\x00' + b'\x03'*4 + b'\x00')
+    assert [bytes(f) for f in framer.frames()] == [b'\x03'*4]
+    assert framer.discarded_bytes == 205
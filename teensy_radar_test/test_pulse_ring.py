@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:05:21 2026
+Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
+@author: ER17450
+
+pulse_ring.PulseRingBuffer without overwrite must not lose pulses, also
+across a data_size change.  Run with pytest.
+"""
+import threading
+
+import numpy as np
+
+from teensy_radar_control import message, pulse_ring
+
+
+def make_block(first, count, data_size):
+    headers = np.zeros(count, dtype=message.PULSE_HEADER_DTYPE)
+    headers['data_size'] = data_size
+    headers['pulse_number'] = np.arange(first, first+count)
+    data = np.repeat(headers['pulse_number'][:,None].astype(message.SAMPLE_DTYPE), data_size, axis=1)
+    return headers, data
+
+
+def read_all(reader, numbers):
+    while reader.available() > 0:
+        headers, data, acq_clock = reader.read()
+        # Every sample still holds its own pulse number
+        assert np.all(data == headers['pulse_number'][:,None])
+        numbers.extend(headers['pulse_number'].tolist())
+
+
+def test_no_overwrite_lagging_reader_across_data_size_change():
+    ring = pulse_ring.PulseRingBuffer(memory_budget=4096, overwrite=False)
+    reader = ring.reader()
+
+    # Old arrays, not read yet when the data_size changes
+    assert ring.write(*make_block(0, 4, 16))
+    capacity = ring.capacity_for(8)
+    new_count = capacity + capacity//2
+
+    # The new arrays fill up past start_seq + capacity only once the
+    # reader has moved on to them and made room
+    assert ring.write(*make_block(4, capacity, 8), timeout=1.0)
+    assert not ring.write(*make_block(4+capacity, 1, 8), timeout=0.05)
+
+    numbers = []
+    writer = threading.Thread(target=ring.write, args=make_block(4+capacity, capacity//2, 8),
+                              kwargs={'timeout':1.0})
+    writer.start()
+    read_all(reader, numbers)
+    writer.join()
+    read_all(reader, numbers)
+
+    assert numbers == list(range(0, 4+new_count))
+    assert reader.lost == 0
@@ -43,6 +43,21 @@ st = np.arange(0,pcount)*pl
 
 print('pcount=%d, collect_time = %.3f' % (pcount,pcount*pl))
 
+#%%
+#
+# Missing, duplicated and late pulses in the recording
+#
+report, loss_map = tfr.check_integrity()
+print('received=%d lost=%d duplicates=%d reordered=%d wraps=%d restarts=%d' %
+      (report['received'], report['lost'], report['duplicates'],
+       report['reordered'], report['wraps'], report['restarts']))
+if report['interval_count'] > 0:
+    print('pulse interval %.6f s, jitter %.3f us, min %.6f s, max %.6f s' %
+          (report['interval_mean'], report['interval_jitter']*1e6,
+           report['interval_min'], report['interval_max']))
+for first, count in loss_map:
+    print('  lost %d pulses from pulse %d' % (count, first))
+
 #%%
 #
 # Time domain voltage plots
@@ -5,7 +5,7 @@ Copyright (C) 2020 MASSACHUSETTS INSTITUTE OF TECHNOLOGY
 @author: ER17450
 """
 
-import struct
+import os, struct
 import numpy as np
 import pylab as plt
 from math import floor, fabs, log10, sqrt, pi
@@ -13,7 +13,7 @@ from scipy.constants import speed_of_light
 import scipy.signal
 
 from dataclasses import dataclass
-from teensy_radar_control import message
+from teensy_radar_control import message, integrity
 
 # Common packet
 FILE_UNIQUE_WORD = 0xB1B2B3B4
@@ -95,6 +95,22 @@ class teensy_radar_file_reader(object):
             trigger_arr = (status_arr&0x1).astype(int)
         return trigger_arr, adc_arr
 
+    def read_pulse_headers(self):
+        # Every pulse header in the file, as a PULSE_HEADER_DTYPE array.
+        # The samples are mapped, not read.
+        dtype = np.dtype([('header',message.PULSE_HEADER_DTYPE),
+                          ('data','<u2',(self.data_size,))])
+        pcount = (os.path.getsize(self.fh.name) - self.FILE_HEADER_BYTES)//dtype.itemsize
+        if pcount <= 0:
+            return np.empty(0, dtype=message.PULSE_HEADER_DTYPE)
+        records = np.memmap(self.fh.name, dtype=dtype, mode='r',
+                            offset=self.FILE_HEADER_BYTES, shape=(pcount,))
+        return np.array(records['header'])
+
+    def check_integrity(self):
+        # (report, loss map) from integrity.check_headers() for the file
+        return integrity.check_headers(self.read_pulse_headers())
+
     def read_if_voltage_pulses(self,pcount):
         trigger, adc = self.read_if_adc_pulses(pcount)
         vsig = adc*self.v_scale - self.v_center